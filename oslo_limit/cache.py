@@ -0,0 +1,270 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Caches of limits shared by the enforcers of several processes
+
+Enforcers look limits up in their shared cache before querying keystone, and
+save the limits they get from keystone there, so that the workers of a
+service only query keystone once for the same limits.
+"""
+
+import abc
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+from typing import Any
+import zlib
+
+from oslo_log import log
+
+__all__ = [
+    'FileCache',
+    'MemoryCache',
+    'RegionCache',
+    'SharedCache',
+]
+
+LOG = log.getLogger(__name__)
+
+
+class SharedCache(abc.ABC):
+    """A cache of limits shared by enforcers
+
+    Values are opaque bytes which hold their own expiration time, so a shared
+    cache does not need to expire them, and may drop any of them at any time.
+    """
+
+    @abc.abstractmethod
+    def get(self, key: str) -> bytes | None:
+        """Get the value of a key, or None if it is not cached."""
+
+    @abc.abstractmethod
+    def set(self, key: str, value: bytes) -> None:
+        """Set the value of a key."""
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        """Delete a key if it is cached."""
+
+
+class MemoryCache(SharedCache):
+    """A shared cache held in the memory of the process
+
+    It is only shared by the enforcers of a process, and is mostly useful for
+    testing.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._values: dict[str, bytes] = {}
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            return self._values.get(key)
+
+    def set(self, key: str, value: bytes) -> None:
+        with self._lock:
+            self._values[key] = value
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._values.pop(key, None)
+
+
+class RegionCache(SharedCache):
+    """A shared cache backed by a dogpile.cache region
+
+    This is the kind of region returned by oslo.cache, so a service can use
+    the cache it configures with oslo.cache, such as memcached, to share
+    limits between its hosts.
+
+    :param region: a configured dogpile.cache region.
+    """
+
+    def __init__(self, region: Any) -> None:
+        from dogpile.cache import api
+
+        self.region = region
+        self._no_value = api.NO_VALUE
+
+    def get(self, key: str) -> bytes | None:
+        value = self.region.get(key)
+        if value is self._no_value:
+            return None
+        return value  # type: ignore
+
+    def set(self, key: str, value: bytes) -> None:
+        self.region.set(key, value)
+
+    def delete(self, key: str) -> None:
+        self.region.delete(key)
+
+
+class FileCache(SharedCache):
+    """A shared cache in a memory-mapped file
+
+    The processes of a host which use the same file share the cache. The file
+    is divided in a fixed number of slots, and each key is stored in the slot
+    its hash points to, replacing any other key stored there. Values which do
+    not fit in a slot are not cached, and a warning is logged the first time.
+
+    Writers lock the slot they write to, and readers check the checksum of the
+    slot, so that a slot being written is not read as a value.
+
+    :param path: path of the file, which is created if needed.
+    :param slots: number of slots of the file, when it is created.
+    :param slot_size: size in bytes of each slot, when the file is created.
+    """
+
+    _MAGIC = b'OSLOLIM1'
+    # magic, number of slots, slot size
+    _HEADER = struct.Struct('<8sII')
+    # key length, value length, checksum of the key and value
+    _SLOT_HEADER = struct.Struct('<HII')
+
+    def __init__(
+        self, path: str, slots: int = 4096, slot_size: int = 16384
+    ) -> None:
+        if slot_size <= self._SLOT_HEADER.size:
+            raise ValueError(
+                f'slot_size must be over {self._SLOT_HEADER.size}'
+            )
+        if slots <= 0:
+            raise ValueError('slots must be positive')
+
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                header = os.pread(self._fd, self._HEADER.size, 0)
+                if not header:
+                    header = self._HEADER.pack(self._MAGIC, slots, slot_size)
+                    os.ftruncate(
+                        self._fd, self._HEADER.size + slots * slot_size
+                    )
+                    os.pwrite(self._fd, header, 0)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+            if (
+                len(header) != self._HEADER.size
+                or header[: len(self._MAGIC)] != self._MAGIC
+            ):
+                raise ValueError(f'{path} is not a limit cache file')
+            _, slots, slot_size = self._HEADER.unpack(header)
+            self.slots: int = slots
+            self.slot_size: int = slot_size
+            self._map = mmap.mmap(
+                self._fd, self._HEADER.size + self.slots * self.slot_size
+            )
+            self._warned_too_large = False
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    def close(self) -> None:
+        self._map.close()
+        os.close(self._fd)
+
+    def _offset(self, key: bytes) -> int:
+        digest = hashlib.blake2b(key, digest_size=8).digest()
+        slot = int.from_bytes(digest, 'little') % self.slots
+        return self._HEADER.size + slot * self.slot_size
+
+    def _read(self, offset: int) -> tuple[bytes, bytes] | None:
+        key_len, value_len, checksum = self._SLOT_HEADER.unpack_from(
+            self._map, offset
+        )
+        start = offset + self._SLOT_HEADER.size
+        end = start + key_len + value_len
+        if not key_len or end > offset + self.slot_size:
+            return None
+
+        data = self._map[start:end]
+        if zlib.crc32(data) != checksum:
+            return None
+        return data[:key_len], data[key_len:]
+
+    def get(self, key: str) -> bytes | None:
+        encoded_key = key.encode()
+        entry = self._read(self._offset(encoded_key))
+        if entry is None or entry[0] != encoded_key:
+            return None
+        return entry[1]
+
+    def set(self, key: str, value: bytes) -> None:
+        encoded_key = key.encode()
+        offset = self._offset(encoded_key)
+        data = encoded_key + value
+        size = self._SLOT_HEADER.size + len(data)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, self.slot_size, offset)
+        try:
+            if size > self.slot_size:
+                # The previous value of the key must not be left in the slot
+                self._delete(offset, encoded_key)
+                self._log_too_large(key, size)
+                return
+
+            # The slot is invalidated while the data is written
+            self._map[offset : offset + self._SLOT_HEADER.size] = bytes(
+                self._SLOT_HEADER.size
+            )
+            self._map[offset + self._SLOT_HEADER.size : offset + size] = data
+            self._SLOT_HEADER.pack_into(
+                self._map,
+                offset,
+                len(encoded_key),
+                len(value),
+                zlib.crc32(data),
+            )
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self.slot_size, offset)
+
+    def _log_too_large(self, key: str, size: int) -> None:
+        # Every value of the kind is likely too large, so only warn once
+        log_level = (
+            logging.DEBUG if self._warned_too_large else logging.WARNING
+        )
+        self._warned_too_large = True
+        LOG.log(
+            log_level,
+            'Not caching %(key)s in %(path)s since it needs %(size)d bytes, '
+            'over the slot size of %(slot_size)d bytes. The file must be '
+            'created again with larger slots to cache it.',
+            {
+                'key': key,
+                'path': self.path,
+                'size': size,
+                'slot_size': self.slot_size,
+            },
+        )
+
+    def delete(self, key: str) -> None:
+        encoded_key = key.encode()
+        offset = self._offset(encoded_key)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, self.slot_size, offset)
+        try:
+            self._delete(offset, encoded_key)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self.slot_size, offset)
+
+    def _delete(self, offset: int, key: bytes) -> None:
+        entry = self._read(offset)
+        if entry is not None and entry[0] == key:
+            self._map[offset : offset + self._SLOT_HEADER.size] = bytes(
+                self._SLOT_HEADER.size
+            )
@@ -78,3 +78,13 @@ class SessionInitError(Exception):
             'reason': reason
         }
         super().__init__(msg)
+
+
+class KeystoneUnavailable(Exception):
+    def __init__(self, reason: object) -> None:
+        """Exception raised when keystone is not queried for limits
+
+        :param reason: why keystone is considered unavailable
+        """
+        msg = _("Keystone is unavailable: %(reason)s.") % {'reason': reason}
+        super().__init__(msg)
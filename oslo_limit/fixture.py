@@ -14,11 +14,13 @@
 from collections.abc import Generator
 from typing import Any
 from unittest import mock
+import uuid
 
 import fixtures as fixtures
-
+from openstack import exceptions as os_exceptions
 from openstack.identity.v3 import endpoint as _endpoint
 from openstack.identity.v3 import limit as _limit
+from openstack.identity.v3 import project as _project
 from openstack.identity.v3 import region as _region
 from openstack.identity.v3 import registered_limit as _registered_limit
 from openstack.identity.v3 import service as _service
@@ -66,6 +68,7 @@ class LimitFixture(fixtures.Fixture):
         self,
         reglimits: dict[str, int],
         projlimits: dict[str, dict[str, int]],
+        hierarchy: dict[str, list[str]] | None = None,
     ) -> None:
         """A fixture for testing code that relies on Keystone Unified Limits.
 
@@ -78,9 +81,34 @@ class LimitFixture(fixtures.Fixture):
                            provided here; any unmentioned projects or
                            resources will take the registered limit defaults.
         :type projlimits: dict
+        :param hierarchy: A dictionary of top-level project ids to the list of
+                          ids of their child projects, like
+                          {project_id: [child_project_id]}. When provided, the
+                          strict-two-level enforcement model is used instead
+                          of the flat one. Any unmentioned projects are
+                          top-level projects without children.
+        :type hierarchy: dict
         """
         self.reglimits = reglimits
         self.projlimits = projlimits
+        self.hierarchy = hierarchy
+        # {(project_id, resource_name): limit_id}, where project_id is None
+        # for registered limits
+        self._limit_ids: dict[tuple[str | None, str], str] = {}
+
+    def get_limit_id(self, project_id: str | None, resource_name: str) -> str:
+        """Get the id of a project limit, or of a registered limit.
+
+        Limits keep the same id for the lifetime of the fixture, so that tests
+        can refer to them, for example in notifications.
+
+        :param project_id: The project of the limit, or None for a registered
+                           limit.
+        :param resource_name: The resource of the limit.
+        """
+        return self._limit_ids.setdefault(
+            (project_id, resource_name), uuid.uuid4().hex
+        )
 
     def get_reglimit_objects(
         self,
@@ -95,6 +123,9 @@ class LimitFixture(fixtures.Fixture):
 
             registered_limit = sdk_fakes.generate_fake_resource(
                 _registered_limit.RegisteredLimit,
+                id=self.get_limit_id(None, name),
+                service_id='service_id',
+                region_id='region_id',
                 resource_name=name,
                 default_limit=value,
             )
@@ -120,6 +151,9 @@ class LimitFixture(fixtures.Fixture):
 
                 limit = sdk_fakes.generate_fake_resource(
                     _limit.Limit,
+                    id=self.get_limit_id(proj_id, name),
+                    service_id='service_id',
+                    region_id='region_id',
                     resource_name=name,
                     resource_limit=value,
                     project_id=proj_id,
@@ -128,6 +162,46 @@ class LimitFixture(fixtures.Fixture):
 
         return limits
 
+    def get_reglimit_object(
+        self, limit_id: str
+    ) -> _registered_limit.RegisteredLimit:
+        for registered_limit in self.get_reglimit_objects():
+            if registered_limit.id == limit_id:
+                return registered_limit
+
+        raise os_exceptions.ResourceNotFound(f'No limit {limit_id}')
+
+    def get_projlimit_object(self, limit_id: str) -> _limit.Limit:
+        for limit in self.get_projlimit_objects():
+            if limit.id == limit_id:
+                return limit
+
+        raise os_exceptions.ResourceNotFound(f'No limit {limit_id}')
+
+    def get_project_object(self, project_id: str) -> _project.Project:
+        assert self.hierarchy is not None  # narrow type
+        parent_id = 'domain_id'
+        for proj_id, children in self.hierarchy.items():
+            if project_id in children:
+                parent_id = proj_id
+
+        return sdk_fakes.generate_fake_resource(
+            _project.Project,
+            id=project_id,
+            domain_id='domain_id',
+            parent_id=parent_id,
+        )
+
+    def get_project_objects(
+        self, parent_id: str | None = None
+    ) -> list[_project.Project]:
+        assert self.hierarchy is not None  # narrow type
+        assert parent_id is not None
+        return [
+            self.get_project_object(project_id)
+            for project_id in self.hierarchy.get(parent_id, [])
+        ]
+
     def setUp(self) -> None:
         super().setUp()
 
@@ -139,13 +213,17 @@ class LimitFixture(fixtures.Fixture):
             )
         )
 
-        # Use a flat enforcement model
+        # Use a flat enforcement model, unless given a project hierarchy
         mock_gem = self.useFixture(
             fixtures.MockPatch(
                 'oslo_limit.limit.Enforcer._get_enforcement_model'
             )
         ).mock
         mock_gem.return_value = 'flat'
+        if self.hierarchy is not None:
+            mock_gem.return_value = 'strict-two-level'
+            self.mock_conn.get_project.side_effect = self.get_project_object
+            self.mock_conn.projects.side_effect = self.get_project_objects
 
         # Fake keystone endpoint; this can be requested by ID or by name and we
         # need to handle both. First, requests by ID
@@ -166,3 +244,7 @@ class LimitFixture(fixtures.Fixture):
         self.mock_conn.registered_limits.side_effect = (
             self.get_reglimit_objects
         )
+        self.mock_conn.get_limit.side_effect = self.get_projlimit_object
+        self.mock_conn.get_registered_limit.side_effect = (
+            self.get_reglimit_object
+        )
@@ -10,43 +10,96 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-from collections.abc import Callable, Collection
-from collections import defaultdict, namedtuple
-from typing import cast, Protocol, TypeAlias
-
-from keystoneauth1 import exceptions as ksa_exceptions
-from keystoneauth1 import loading
-from openstack import connection
-from openstack import exceptions as os_exceptions
-from openstack.identity.v3 import _proxy as _identity_proxy
-from openstack.identity.v3 import endpoint as _endpoint
-from openstack.identity.v3 import limit as _limit
-from openstack.identity.v3 import registered_limit as _registered_limit
-from openstack import utils as os_utils
+import asyncio
+from collections.abc import (
+    Awaitable,
+    Callable,
+    Collection,
+    Hashable,
+    Iterable,
+    Iterator,
+)
+from collections import defaultdict
+from collections import namedtuple
+from collections import OrderedDict
+from concurrent import futures
+import contextlib
+import contextvars
+import inspect
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Generic, Protocol, TYPE_CHECKING, TypeAlias, TypeVar
+import weakref
+
 from oslo_config import cfg
 from oslo_log import log
 
+from oslo_limit import cache as limit_cache
 from oslo_limit import exception
+from oslo_limit import metrics as limit_metrics
 from oslo_limit import opts
+from oslo_limit import tracing
+
+if TYPE_CHECKING:
+    # openstacksdk is slow to import, so it is only imported once a
+    # connection to keystone is needed.
+    from openstack.identity.v3 import _proxy as _identity_proxy
+    from openstack.identity.v3 import endpoint as _endpoint
+    from openstack.identity.v3 import limit as _limit
+    from openstack.identity.v3 import registered_limit as _registered_limit
 
 CONF = cfg.CONF
 LOG = log.getLogger(__name__)
-_SDK_CONNECTION: _identity_proxy.Proxy | None = None
+_SDK_CONNECTION: '_identity_proxy.Proxy | None' = None
+# The process which created _SDK_CONNECTION
+_SDK_CONNECTION_PID: int | None = None
 
 ProjectUsage = namedtuple('ProjectUsage', ['limit', 'usage'])
 
+CacheStats = namedtuple('CacheStats', ['size', 'hits', 'misses', 'evictions'])
+
+CircuitBreakerStats = namedtuple(
+    'CircuitBreakerStats', ['state', 'failures', 'opened', 'rejected']
+)
+
 UsageCallbackT: TypeAlias = Callable[
     [str | None, Collection[str]], dict[str, int]
 ]
 
-opts.register_opts(CONF)
+AsyncUsageCallbackT: TypeAlias = Callable[
+    [str | None, Collection[str]], Awaitable[dict[str, int]]
+]
+
+BatchUsageCallbackT: TypeAlias = Callable[
+    [Collection[str | None], Collection[str]],
+    dict[str | None, dict[str, int]],
+]
+
+AsyncBatchUsageCallbackT: TypeAlias = Callable[
+    [Collection[str | None], Collection[str]],
+    Awaitable[dict[str | None, dict[str, int]]],
+]
+
+_T = TypeVar('_T')
+
+opts._register_base_opts(CONF)
 
 
 class _EnforcerImplProtocol(Protocol):
     name: str
 
     def __init__(
-        self, usage_callback: UsageCallbackT, cache: bool = True
+        self,
+        usage_callback: UsageCallbackT,
+        cache: bool = True,
+        batch_usage_callback: BatchUsageCallbackT | None = None,
+        shared_cache: limit_cache.SharedCache | None = None,
+        metrics: limit_metrics.Metrics | None = None,
     ) -> None: ...
 
     def get_registered_limits(
@@ -65,10 +118,55 @@ class _EnforcerImplProtocol(Protocol):
         self, project_id: str | None, deltas: dict[str, int]
     ) -> None: ...
 
+    def get_projects_limits(
+        self,
+        project_ids: Collection[str | None],
+        resources_to_check: Collection[str],
+    ) -> dict[str | None, list[tuple[str, int]]]: ...
+
+    def get_projects_usage(
+        self,
+        project_ids: Collection[str | None],
+        resources_to_check: Collection[str],
+    ) -> dict[str | None, dict[str, int]]: ...
+
+    def enforce_many(
+        self, deltas_by_project: dict[str | None, dict[str, int]]
+    ) -> dict[str | None, exception.ProjectOverLimit | None]: ...
+
+    def get_enforced_usage(
+        self,
+        project_ids: Collection[str | None],
+        resources_to_check: Collection[str],
+    ) -> dict[str | None, dict[str, int]]: ...
+
+    def get_claim_key(self, project_id: str | None) -> str | None: ...
+
+    def get_cache_stats(self) -> dict[str, CacheStats]: ...
+
+    def get_circuit_breaker_stats(self) -> CircuitBreakerStats: ...
+
+    def warm_cache(self) -> None: ...
+
+    def invalidate_limit(
+        self, limit_id: str, registered: bool = False, deleted: bool = False
+    ) -> None: ...
+
+
+def _get_keystone_connection() -> '_identity_proxy.Proxy':
+    global _SDK_CONNECTION, _SDK_CONNECTION_PID
+    if _SDK_CONNECTION_PID is not None and _SDK_CONNECTION_PID != os.getpid():
+        # The connection was created before this process was forked, so its
+        # sockets are shared with the parent process.
+        _SDK_CONNECTION = None
+        _SDK_CONNECTION_PID = None
 
-def _get_keystone_connection() -> _identity_proxy.Proxy:
-    global _SDK_CONNECTION
     if not _SDK_CONNECTION:
+        from keystoneauth1 import exceptions as ksa_exceptions
+        from keystoneauth1 import loading
+        from openstack import connection
+        from openstack import utils as os_utils
+
         try:
             auth = loading.load_auth_from_conf_options(
                 CONF, group='oslo_limit'
@@ -92,6 +190,7 @@ def _get_keystone_connection() -> _identity_proxy.Proxy:
             _SDK_CONNECTION = os_utils.ensure_service_version(
                 conn.identity, '3'
             )
+            _SDK_CONNECTION_PID = os.getpid()
         except (
             ksa_exceptions.NoMatchingPlugin,
             ksa_exceptions.MissingRequiredOptions,
@@ -106,39 +205,422 @@ def _get_keystone_connection() -> _identity_proxy.Proxy:
     return _SDK_CONNECTION
 
 
-class Enforcer:
-    model: _EnforcerImplProtocol
+# Objects to reset in a forked child process
+_FORK_AWARE: 'weakref.WeakSet[Enforcer | _EnforcerUtils | _ProjectHierarchy]'
+_FORK_AWARE = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    """Reset the state which the child process must not share.
+
+    Other threads do not survive the fork, so locks they held are replaced
+    and the calls they were making are forgotten.
+    """
+    global _SDK_CONNECTION, _SDK_CONNECTION_PID
+    if _SDK_CONNECTION_PID is not None:
+        _SDK_CONNECTION = None
+        _SDK_CONNECTION_PID = None
+
+    keep_cache = CONF.oslo_limit.cache_keep_after_fork
+    for obj in list(_FORK_AWARE):
+        obj._reset_after_fork(keep_cache)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+# The options identifying the endpoint whose discovery is saved in a snapshot
+_DISCOVERY_OPTIONS = (
+    'endpoint_id',
+    'endpoint_service_name',
+    'endpoint_service_type',
+    'endpoint_region_name',
+    'endpoint_interface',
+)
+_DISCOVERY_SNAPSHOT_LOCK = threading.Lock()
+
+
+def _load_discovery_snapshot(path: str) -> dict[str, Any]:
+    """Load the entries of the discovery snapshot at path.
+
+    The entries are dropped if the snapshot cannot be read, or if it was saved
+    for another endpoint configuration.
+    """
+    key = {name: CONF.oslo_limit[name] for name in _DISCOVERY_OPTIONS}
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        LOG.warning("Ignoring unreadable discovery snapshot %s: %s", path, e)
+        return {}
+
+    if not isinstance(snapshot, dict) or snapshot.get('key') != key:
+        return {}
+    entries = snapshot.get('entries')
+    if not isinstance(entries, dict):
+        return {}
+    return entries
+
+
+def _read_discovery_snapshot(name: str) -> Any:
+    """Get an entry of the discovery snapshot.
+
+    :returns: the value of the entry, or None if there is no snapshot, or if
+              the entry is missing or has expired.
+    """
+    path = CONF.oslo_limit.discovery_cache_file
+    if not path:
+        return None
+
+    entry = _load_discovery_snapshot(path).get(name)
+    try:
+        saved_at, value = entry  # type: ignore
+        age = time.time() - float(saved_at)
+    except (TypeError, ValueError):
+        return None
+
+    expiration_time = CONF.oslo_limit.discovery_cache_expiration_time
+    if age < 0 or (expiration_time and age >= expiration_time):
+        return None
+    return value
+
+
+def _write_discovery_snapshot(name: str, value: Any) -> None:
+    """Set an entry of the discovery snapshot, if there is one.
+
+    The snapshot is replaced atomically, so that other processes never read a
+    partially written snapshot.
+    """
+    path = CONF.oslo_limit.discovery_cache_file
+    if not path:
+        return
+
+    key = {name: CONF.oslo_limit[name] for name in _DISCOVERY_OPTIONS}
+    with _DISCOVERY_SNAPSHOT_LOCK:
+        entries = _load_discovery_snapshot(path)
+        entries[name] = [time.time(), value]
+        snapshot = {'key': key, 'entries': entries}
+
+        directory, filename = os.path.split(os.path.abspath(path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=directory, prefix=f'.{filename}.', suffix='.tmp'
+            )
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(snapshot, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except (OSError, TypeError, ValueError) as e:
+            LOG.warning("Unable to save discovery snapshot %s: %s", path, e)
+
+
+def _start_discovery_verifier(
+    verify: Callable[[_T], None], value: _T
+) -> threading.Thread:
+    """Check a value of the discovery snapshot against keystone."""
+
+    def run() -> None:
+        try:
+            verify(value)
+        except Exception:
+            LOG.warning(
+                "Unable to check the discovery snapshot against keystone.",
+                exc_info=True,
+            )
+
+    verifier = threading.Thread(
+        target=run, name='oslo-limit-discovery-verify', daemon=True
+    )
+    verifier.start()
+    return verifier
+
 
+def _validate_project_id(project_id: str | None) -> None:
+    if project_id is not None and (
+        not project_id or not isinstance(project_id, str)
+    ):
+        msg = 'project_id must be a non-empty string or None.'
+        raise ValueError(msg)
+
+
+def _validate_deltas(deltas: dict[str, int]) -> None:
+    if not isinstance(deltas, dict) or len(deltas) == 0:
+        msg = 'deltas must be a non-empty dictionary.'
+        raise ValueError(msg)
+
+    for k, v in deltas.items():
+        if not isinstance(k, str):
+            raise ValueError('resource name is not a string.')
+        elif not isinstance(v, int):
+            raise ValueError('resource limit is not an integer.')
+
+
+def _validate_resources_to_check(resources_to_check: Collection[str]) -> None:
+    msg = (
+        'resources_to_check must be non-empty sequence of '
+        'resource name strings'
+    )
+    try:
+        if len(resources_to_check) == 0:
+            raise ValueError(msg)
+    except TypeError:
+        raise ValueError(msg)
+
+    for resource_name in resources_to_check:
+        if not isinstance(resource_name, str):
+            raise ValueError(msg)
+
+
+class Enforcer:
     def __init__(
-        self, usage_callback: UsageCallbackT, cache: bool = True
+        self,
+        usage_callback: UsageCallbackT,
+        cache: bool = True,
+        batch_usage_callback: BatchUsageCallbackT | None = None,
+        lazy: bool = False,
+        prewarm: bool = False,
+        shared_cache: limit_cache.SharedCache | None = None,
+        metrics: limit_metrics.Metrics | None = None,
     ) -> None:
         """An object for checking usage against resource limits and requests.
 
         :param usage_callback: A callable function that accepts a project_id
                                string as a parameter and calculates the current
                                usage of a resource.
-        :param cache: Whether to cache resource limits for the lifetime of this
-                      enforcer. Defaults to True.
+        :param cache: Whether to cache resource limits. Cached limits are kept
+                      for the lifetime of this enforcer unless
+                      ``[oslo_limit] cache_expiration_time`` is set.
+                      Defaults to True.
+        :param batch_usage_callback: An optional callable function that
+                                     accepts a list of project_ids and a list
+                                     of resource names, and returns a
+                                     dictionary of project_id to the current
+                                     usage of those resources. When given, it
+                                     is used instead of usage_callback to
+                                     calculate the usage of several projects
+                                     at once.
+        :param lazy: Whether to wait until the enforcer is first used to
+                     connect to keystone and look up the enforcement model and
+                     the endpoint, rather than doing so now. Defaults to False.
+        :param prewarm: Whether to connect to keystone, look up the enforcement
+                        model and the endpoint, and load limits into the cache
+                        in a background thread, when lazy is True, so that
+                        the enforcer is ready when first used. Defaults to
+                        False.
+        :param shared_cache: An optional cache of limits shared with the
+                             enforcers of other processes, such as a
+                             ``cache.RegionCache``, in which limits are looked
+                             up before querying keystone. Only used when
+                             cache is True. Defaults to a ``cache.FileCache``
+                             if ``[oslo_limit] shared_cache_file`` is set.
+        :raises ValueError: if ``[oslo_limit] shared_cache_file`` is set
+                            without ``[oslo_limit] cache_expiration_time``.
+        :param metrics: An optional ``metrics.Metrics`` to which the enforcer
+                        reports the duration of checks and of requests to
+                        keystone, cache hits and misses, and resources found
+                        over limit. Defaults to discarding them.
         """
         if not callable(usage_callback):
             msg = 'usage_callback must be a callable function.'
             raise ValueError(msg)
+        if batch_usage_callback is not None and not callable(
+            batch_usage_callback
+        ):
+            msg = 'batch_usage_callback must be a callable function.'
+            raise ValueError(msg)
 
-        self.connection = _get_keystone_connection()
-        self.model = self._get_model_impl(usage_callback, cache=cache)
+        self._metrics = _guard_metrics(metrics)
+        self._keystone_enforce_budget: float = (
+            CONF.oslo_limit.keystone_enforce_budget
+        )
+        self._usage_cache = None
+        self._apply_deltas = False
+        if CONF.oslo_limit.usage_cache_expiration_time:
+            self._usage_cache = _UsageCache(
+                usage_callback,
+                batch_usage_callback,
+                CONF.oslo_limit.usage_cache_expiration_time,
+                metrics=self._metrics,
+            )
+            self._apply_deltas = CONF.oslo_limit.usage_cache_apply_deltas
+            usage_callback = self._usage_cache.get_usage
+            if batch_usage_callback is not None:
+                batch_usage_callback = self._usage_cache.get_usage_many
+
+        # Outstanding claims are counted on top of the usage of the callbacks
+        self._ledger = _ClaimLedger(usage_callback, batch_usage_callback)
+        usage_callback = self._ledger.get_usage
+        if batch_usage_callback is not None:
+            batch_usage_callback = self._ledger.get_usage_many
+
+        if shared_cache is None and CONF.oslo_limit.shared_cache_file:
+            # The file outlives the processes of the service, so limits
+            # which never expire would never be looked up in keystone again,
+            # even once the service is restarted.
+            if cache and not CONF.oslo_limit.cache_expiration_time:
+                msg = (
+                    '[oslo_limit] cache_expiration_time must be set when '
+                    '[oslo_limit] shared_cache_file is.'
+                )
+                raise ValueError(msg)
+            shared_cache = limit_cache.FileCache(
+                CONF.oslo_limit.shared_cache_file,
+                slots=CONF.oslo_limit.shared_cache_file_slots,
+                slot_size=CONF.oslo_limit.shared_cache_file_slot_size,
+            )
+        self._shared_cache = shared_cache
+
+        self._discovery_verifier: threading.Thread | None = None
+        self._model_args = (usage_callback, cache, batch_usage_callback)
+        self._model: _EnforcerImplProtocol | None = None
+        self._model_lock = threading.Lock()
+        self._prewarm_thread: threading.Thread | None = None
+        _FORK_AWARE.add(self)
+        if not lazy:
+            self._initialize()
+        elif prewarm:
+            self._prewarm_thread = threading.Thread(
+                target=self._prewarm, name='oslo-limit-prewarm', daemon=True
+            )
+            self._prewarm_thread.start()
+
+    @property
+    def connection(self) -> '_identity_proxy.Proxy':
+        return _get_keystone_connection()
+
+    def _reset_after_fork(self, keep_cache: bool) -> None:
+        self._model_lock = threading.Lock()
+        self._ledger._reset_after_fork()
+        if self._usage_cache is not None:
+            self._usage_cache._reset_after_fork(keep_cache)
+
+    @property
+    def model(self) -> _EnforcerImplProtocol:
+        model = self._model
+        if model is None:
+            model = self._initialize()
+        return model
+
+    @model.setter
+    def model(self, model: _EnforcerImplProtocol) -> None:
+        self._model = model
+
+    def _initialize(self) -> _EnforcerImplProtocol:
+        """Connect to keystone and look up the enforcement model."""
+        with self._model_lock:
+            if self._model is None:
+                usage_callback, cache, batch_usage_callback = self._model_args
+                self._model = self._get_model_impl(
+                    usage_callback,
+                    cache=cache,
+                    batch_usage_callback=batch_usage_callback,
+                    shared_cache=self._shared_cache,
+                    metrics=self._metrics,
+                )
+            return self._model
+
+    def _prewarm(self) -> None:
+        try:
+            model = self._initialize()
+            # Limits are already loaded if cache_prefetch is set
+            if self._model_args[1] and not CONF.oslo_limit.cache_prefetch:
+                model.warm_cache()
+        except Exception:
+            LOG.warning(
+                "Unable to prepare the enforcer in the background, this will "
+                "be retried when it is first used.",
+                exc_info=True,
+            )
 
     def _get_enforcement_model(self) -> str:
         """Query keystone for the configured enforcement model."""
         return self.connection.get('/limits/model').json()['model']['name']  # type: ignore
 
+    def _discover_enforcement_model(self) -> str:
+        """Get the enforcement model from the snapshot, or keystone."""
+        model = _read_discovery_snapshot('model')
+        if isinstance(model, str):
+            self._discovery_verifier = _start_discovery_verifier(
+                self._verify_enforcement_model, model
+            )
+            return model
+
+        model = self._get_enforcement_model()
+        _write_discovery_snapshot('model', model)
+        return model
+
+    def _verify_enforcement_model(self, model: str) -> None:
+        """Check that the enforcement model of the snapshot is current."""
+        current_model = self._get_enforcement_model()
+        _write_discovery_snapshot('model', current_model)
+        if current_model != model:
+            LOG.warning(
+                "The enforcement model changed from %s to %s since it was "
+                "saved in the discovery snapshot.",
+                model,
+                current_model,
+            )
+            usage_callback, cache, batch_usage_callback = self._model_args
+            new_model = self._create_model_impl(
+                current_model,
+                usage_callback,
+                cache=cache,
+                batch_usage_callback=batch_usage_callback,
+                shared_cache=self._shared_cache,
+                metrics=self._metrics,
+            )
+            # The enforcer is being initialized with the model of the
+            # snapshot while the lock is held, so wait for it to be done,
+            # and replace the model if it is still that of the snapshot.
+            with self._model_lock:
+                if self._model is not None and self._model.name == model:
+                    self._model = new_model
+
     def _get_model_impl(
-        self, usage_callback: UsageCallbackT, cache: bool = True
+        self,
+        usage_callback: UsageCallbackT,
+        cache: bool = True,
+        batch_usage_callback: BatchUsageCallbackT | None = None,
+        shared_cache: limit_cache.SharedCache | None = None,
+        metrics: limit_metrics.Metrics | None = None,
     ) -> _EnforcerImplProtocol:
         """get the enforcement model based on configured model in keystone."""
-        model = self._get_enforcement_model()
+        model = self._discover_enforcement_model()
+        return self._create_model_impl(
+            model,
+            usage_callback,
+            cache=cache,
+            batch_usage_callback=batch_usage_callback,
+            shared_cache=shared_cache,
+            metrics=metrics,
+        )
+
+    def _create_model_impl(
+        self,
+        model: str,
+        usage_callback: UsageCallbackT,
+        cache: bool = True,
+        batch_usage_callback: BatchUsageCallbackT | None = None,
+        shared_cache: limit_cache.SharedCache | None = None,
+        metrics: limit_metrics.Metrics | None = None,
+    ) -> _EnforcerImplProtocol:
         for impl in _MODELS:
             if model == impl.name:
-                return impl(usage_callback, cache=cache)
+                return impl(
+                    usage_callback,
+                    cache=cache,
+                    batch_usage_callback=batch_usage_callback,
+                    shared_cache=shared_cache,
+                    metrics=metrics,
+                )
         raise ValueError(f"enforcement model {model} is not supported")
 
     def enforce(self, project_id: str | None, deltas: dict[str, int]) -> None:
@@ -151,7 +633,10 @@ class Enforcer:
         not None) and the endpoint specified in the configuration.
 
         Using the usage_callback specified when creating the enforcer,
-        we fetch the existing usage.
+        we fetch the existing usage. Resources whose limit is unlimited
+        (-1) cannot go over their limit, so their usage is not fetched, and
+        the usage_callback is not called at all if every resource is
+        unlimited.
 
         We then add the existing usage to the provided deltas to get
         the total proposed usage. This total proposed usage is then
@@ -176,23 +661,142 @@ class Enforcer:
         :raises exception.ClaimExceedsLimit: when over limits
 
         """
-        if project_id is not None and (
-            not project_id or not isinstance(project_id, str)
+        _validate_project_id(project_id)
+        _validate_deltas(deltas)
+
+        with (
+            tracing.get_tracer().start_as_current_span(
+                'oslo_limit.enforce'
+            ) as span,
+            _keystone_budget(self._keystone_enforce_budget),
+            self._metrics.timer('enforce.duration', {'phase': 'total'}),
         ):
-            msg = 'project_id must be a non-empty string or None.'
+            if span.is_recording():
+                tracing._set_attributes(
+                    span, project_id=project_id, resources=sorted(deltas)
+                )
+            try:
+                self.model.enforce(project_id, deltas)
+            except exception.ProjectOverLimit as e:
+                self._count_over_limit(e)
+                raise
+
+        if self._usage_cache is not None and self._apply_deltas:
+            self._usage_cache.add(project_id, deltas)
+
+    def enforce_many(
+        self, deltas_by_project: dict[str | None, dict[str, int]]
+    ) -> dict[str | None, exception.ProjectOverLimit | None]:
+        """Check resource usage against limits for many projects at once
+
+        This is equivalent to calling enforce() for each project, but the
+        limits of all the projects are looked up together, and a project
+        being over its limits does not prevent the others from being checked.
+        The usage of all the projects is calculated with a single call to the
+        batch_usage_callback, if the enforcer was created with one.
+
+        :param deltas_by_project: A dictionary of project_id (or None) to
+                                  deltas, as passed to enforce().
+        :returns: A dictionary of project_id to the
+                  exception.ProjectOverLimit describing the limits the project
+                  would go over, or None if it would not go over any.
+        """
+        if not isinstance(deltas_by_project, dict) or not deltas_by_project:
+            msg = 'deltas_by_project must be a non-empty dictionary.'
             raise ValueError(msg)
 
-        if not isinstance(deltas, dict) or len(deltas) == 0:
-            msg = 'deltas must be a non-empty dictionary.'
-            raise ValueError(msg)
+        for project_id, deltas in deltas_by_project.items():
+            _validate_project_id(project_id)
+            _validate_deltas(deltas)
+
+        with (
+            tracing.get_tracer().start_as_current_span(
+                'oslo_limit.enforce_many'
+            ) as span,
+            _keystone_budget(self._keystone_enforce_budget),
+            self._metrics.timer('enforce.duration', {'phase': 'total'}),
+        ):
+            if span.is_recording():
+                tracing._set_attributes(
+                    span,
+                    project_ids=sorted(filter(None, deltas_by_project)),
+                    resources=sorted(
+                        {
+                            resource
+                            for deltas in deltas_by_project.values()
+                            for resource in deltas
+                        }
+                    ),
+                )
+            results = self.model.enforce_many(deltas_by_project)
+        for over_limit in results.values():
+            if over_limit is not None:
+                self._count_over_limit(over_limit)
+
+        if self._usage_cache is not None and self._apply_deltas:
+            for project_id, deltas in deltas_by_project.items():
+                if results[project_id] is None:
+                    self._usage_cache.add(project_id, deltas)
+
+        return results
 
-        for k, v in deltas.items():
-            if not isinstance(k, str):
-                raise ValueError('resource name is not a string.')
-            elif not isinstance(v, int):
-                raise ValueError('resource limit is not an integer.')
+    def claim(self, project_id: str | None, deltas: dict[str, int]) -> 'Claim':
+        """Check resource usage against limits and reserve the deltas
 
-        self.model.enforce(project_id, deltas)
+        This checks limits like enforce(), but also records the deltas as an
+        outstanding claim of the project, which is counted on top of the usage
+        returned by the usage_callback by the checks of this enforcer until
+        the claim is committed or rolled back. Claims of the same project are
+        checked one at a time, so concurrent claims cannot both go over a
+        limit.
+
+        The service should commit the claim once the resources are created,
+        so that they are counted by the usage_callback, or roll it back if
+        they are not. The claim can be used as a context manager, which
+        commits it if the block succeeds and rolls it back otherwise.
+
+        :param project_id: The project to check usage and enforce limits
+                           against (or None).
+        :param deltas: An dictionary containing resource names as keys and
+                       requests resource quantities as positive integers.
+        :returns: A limit.Claim for the deltas.
+
+        :raises exception.ClaimExceedsLimit: when over limits
+        """
+        _validate_project_id(project_id)
+        _validate_deltas(deltas)
+
+        claim_key = self.model.get_claim_key(project_id)
+        with (
+            tracing.get_tracer().start_as_current_span(
+                'oslo_limit.claim'
+            ) as span,
+            _keystone_budget(self._keystone_enforce_budget),
+            self._metrics.timer('enforce.duration', {'phase': 'total'}),
+            self._ledger.lock(claim_key),
+        ):
+            if span.is_recording():
+                tracing._set_attributes(
+                    span, project_id=project_id, resources=sorted(deltas)
+                )
+            try:
+                self.model.enforce(project_id, deltas)
+            except exception.ProjectOverLimit as e:
+                self._count_over_limit(e)
+                raise
+            claim = Claim(
+                self._ledger, self._usage_cache, project_id, deltas, claim_key
+            )
+            self._ledger.add(claim)
+        return claim
+
+    def _count_over_limit(
+        self, over_limit: exception.ProjectOverLimit
+    ) -> None:
+        for info in over_limit.over_limit_info_list:
+            self._metrics.increment(
+                'over_limit', tags={'resource': info.resource_name}
+            )
 
     def calculate_usage(
         self, project_id: str | None, resources_to_check: Collection[str]
@@ -207,155 +811,2353 @@ class Enforcer:
         This should *not* be used to conduct custom enforcement, but
         rather only for reporting.
 
-        :param project_id: The project for which to check usage and limits,
-                           or None.
-        :param resources_to_check: A list of resource names to query.
-        :returns: A dictionary of name:limit.ProjectUsage for the
-                  requested names against the provided project.
-        """
-        if project_id is not None and (
-            not project_id or not isinstance(project_id, str)
+        With the strict-two-level model, the usage of a top-level project
+        is that of its whole tree, to which its limits apply.
+
+        :param project_id: The project for which to check usage and limits,
+                           or None.
+        :param resources_to_check: A list of resource names to query.
+        :returns: A dictionary of name:limit.ProjectUsage for the
+                  requested names against the provided project.
+        """
+        _validate_project_id(project_id)
+        _validate_resources_to_check(resources_to_check)
+
+        with _keystone_budget(self._keystone_enforce_budget):
+            limits = self.model.get_project_limits(
+                project_id, resources_to_check
+            )
+        usage = self.model.get_enforced_usage(
+            [project_id], resources_to_check
+        )[project_id]
+
+        return {
+            resource: ProjectUsage(limit, usage[resource])
+            for resource, limit in limits
+        }
+
+    def calculate_usage_many(
+        self,
+        project_ids: Collection[str | None],
+        resources_to_check: Collection[str],
+    ) -> dict[str | None, dict[str, ProjectUsage]]:
+        """Calculate resource usage and limits for many projects at once.
+
+        This is equivalent to calling calculate_usage() for each project, but
+        the limits of all the projects are looked up together, and their usage
+        is calculated with a single call to the batch_usage_callback, if the
+        enforcer was created with one.
+
+        :param project_ids: The projects for which to check usage and limits.
+        :param resources_to_check: A list of resource names to query.
+        :returns: A dictionary of project_id to a dictionary of
+                  name:limit.ProjectUsage for the requested names against
+                  that project.
+        """
+        msg = 'project_ids must be a non-empty collection of project ids.'
+        if isinstance(project_ids, str) or not project_ids:
+            raise ValueError(msg)
+        for project_id in project_ids:
+            _validate_project_id(project_id)
+        _validate_resources_to_check(resources_to_check)
+
+        with _keystone_budget(self._keystone_enforce_budget):
+            limits = self.model.get_projects_limits(
+                project_ids, resources_to_check
+            )
+        usage = self.model.get_enforced_usage(project_ids, resources_to_check)
+
+        return {
+            project_id: {
+                resource: ProjectUsage(limit, usage[project_id][resource])
+                for resource, limit in limits[project_id]
+            }
+            for project_id in project_ids
+        }
+
+    def get_registered_limits(
+        self, resources_to_check: Collection[str]
+    ) -> list[tuple[str, int]]:
+        with _keystone_budget(self._keystone_enforce_budget):
+            return self.model.get_registered_limits(resources_to_check)
+
+    def get_project_limits(
+        self, project_id: str | None, resources_to_check: Collection[str]
+    ) -> list[tuple[str, int]]:
+        with _keystone_budget(self._keystone_enforce_budget):
+            return self.model.get_project_limits(
+                project_id, resources_to_check
+            )
+
+    def invalidate_usage(
+        self,
+        project_id: str | None,
+        resources_to_check: Collection[str] | None = None,
+    ) -> None:
+        """Drop the cached usage of a project.
+
+        Services using ``[oslo_limit] usage_cache_expiration_time`` should call
+        this when they change the usage of a project, so that the next check
+        calls the usage callback rather than using outdated usage. This does
+        nothing if usage is not cached.
+
+        :param project_id: The project whose usage changed, or None.
+        :param resources_to_check: A list of resource names whose usage
+                                   changed. Defaults to all resources.
+        """
+        if self._usage_cache is not None:
+            self._usage_cache.invalidate(project_id, resources_to_check)
+
+    def invalidate_limit(
+        self, limit_id: str, registered: bool = False, deleted: bool = False
+    ) -> None:
+        """Evict the cached limits affected by a change of a limit.
+
+        This is called by ``notifications.LimitNotificationEndpoint`` when a
+        limit is created, updated or deleted in keystone, so that the change
+        applies right away rather than once the cached limits expire. The
+        limit is looked up in keystone if it was created or updated and its
+        project is not known. This does nothing if limits are not cached.
+
+        :param limit_id: The id of the project limit or registered limit.
+        :param registered: Whether the limit is a registered limit.
+                           Defaults to False.
+        :param deleted: Whether the limit was deleted. Defaults to False.
+        """
+        # Nothing is cached until the enforcer is initialized
+        if self._model is not None:
+            self._model.invalidate_limit(
+                limit_id, registered=registered, deleted=deleted
+            )
+
+    def get_cache_stats(self) -> dict[str, CacheStats]:
+        """Get statistics about the limits cached by this enforcer.
+
+        :returns: A dictionary of cache name to limit.CacheStats, with the
+                  'project_limits' and 'registered_limits' caches, and the
+                  'usage' cache if usage is cached.
+        """
+        stats = self.model.get_cache_stats()
+        if self._usage_cache is not None:
+            stats['usage'] = self._usage_cache.stats()
+        return stats
+
+    def get_circuit_breaker_stats(self) -> CircuitBreakerStats:
+        """Get the state of the circuit breaker of the calls to keystone.
+
+        :returns: A limit.CircuitBreakerStats with the state of the circuit,
+                  'closed', 'open' or 'half-open', the number of calls in a
+                  row which failed, and the number of times the circuit
+                  opened and calls were rejected.
+        """
+        return self.model.get_circuit_breaker_stats()
+
+    def warm_cache(self) -> None:
+        """Load all the limits of the endpoint into the cache.
+
+        The registered limits and the project limits of every project are
+        fetched from keystone at once, so that checks do not need to query
+        keystone for limits until the cached limits expire. This does nothing
+        if the enforcer was created without caching.
+        """
+        self.model.warm_cache()
+
+
+# The event loop of the AsyncEnforcer call being run in a worker thread
+_EVENT_LOOP: contextvars.ContextVar[asyncio.AbstractEventLoop] = (
+    contextvars.ContextVar('oslo_limit_event_loop')
+)
+
+
+async def _await(awaitable: Awaitable[_T]) -> _T:
+    return await awaitable
+
+
+class AsyncEnforcer:
+    def __init__(
+        self,
+        usage_callback: AsyncUsageCallbackT | UsageCallbackT,
+        cache: bool = True,
+        batch_usage_callback: (
+            AsyncBatchUsageCallbackT | BatchUsageCallbackT | None
+        ) = None,
+        lazy: bool = False,
+        prewarm: bool = False,
+        shared_cache: limit_cache.SharedCache | None = None,
+        metrics: limit_metrics.Metrics | None = None,
+    ) -> None:
+        """An asyncio counterpart of Enforcer.
+
+        Calls to keystone are made in a worker thread of the event loop's
+        default executor, so that they do not block the event loop. A usage
+        callback which is a coroutine function is awaited on the event loop
+        of the caller, while a plain callable is called in the worker thread.
+
+        Unless lazy is True, keystone is queried for the enforcement model
+        and the endpoint when this object is created, so create it before
+        handling requests.
+
+        :param usage_callback: A callable function, or coroutine function,
+                               that accepts a project_id string and a list of
+                               resource names as parameters and calculates the
+                               current usage of those resources.
+        :param cache: Whether to cache resource limits, as for Enforcer.
+                      Defaults to True.
+        :param batch_usage_callback: An optional callable function, or
+                                     coroutine function, that calculates the
+                                     usage of several projects at once, as for
+                                     Enforcer.
+        :param lazy: Whether to wait until the enforcer is first used to query
+                     keystone, as for Enforcer. Defaults to False.
+        :param prewarm: Whether to query keystone in a background thread when
+                        lazy is True, as for Enforcer. Defaults to False.
+        :param shared_cache: An optional cache of limits shared with other
+                             processes, as for Enforcer.
+        :param metrics: An optional ``metrics.Metrics`` to which the enforcer
+                        reports metrics, as for Enforcer.
+        """
+        if not callable(usage_callback):
+            msg = 'usage_callback must be a callable function.'
+            raise ValueError(msg)
+        if batch_usage_callback is not None and not callable(
+            batch_usage_callback
+        ):
+            msg = 'batch_usage_callback must be a callable function.'
+            raise ValueError(msg)
+
+        self._usage_callback = usage_callback
+        self._batch_usage_callback = batch_usage_callback
+        self._enforcer = Enforcer(
+            self._get_usage,
+            cache=cache,
+            batch_usage_callback=(
+                self._get_batch_usage if batch_usage_callback else None
+            ),
+            lazy=lazy,
+            prewarm=prewarm,
+            shared_cache=shared_cache,
+            metrics=metrics,
+        )
+
+    def _get_usage(
+        self, project_id: str | None, resources_to_check: Collection[str]
+    ) -> dict[str, int]:
+        # This runs in a worker thread, so run coroutines on the event loop of
+        # the caller, which is free while it waits for the worker thread.
+        usage = self._usage_callback(project_id, resources_to_check)
+        if inspect.isawaitable(usage):
+            loop = _EVENT_LOOP.get()
+            return asyncio.run_coroutine_threadsafe(
+                _await(usage), loop
+            ).result()
+        return usage
+
+    def _get_batch_usage(
+        self,
+        project_ids: Collection[str | None],
+        resources_to_check: Collection[str],
+    ) -> dict[str | None, dict[str, int]]:
+        assert self._batch_usage_callback is not None  # narrow type
+        usage = self._batch_usage_callback(project_ids, resources_to_check)
+        if inspect.isawaitable(usage):
+            loop = _EVENT_LOOP.get()
+            return asyncio.run_coroutine_threadsafe(
+                _await(usage), loop
+            ).result()
+        return usage
+
+    async def _run_in_thread(
+        self, func: Callable[..., _T], *args: object
+    ) -> _T:
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        context.run(_EVENT_LOOP.set, loop)
+        return await loop.run_in_executor(None, context.run, func, *args)
+
+    async def enforce(
+        self, project_id: str | None, deltas: dict[str, int]
+    ) -> None:
+        """Check resource usage against limits for resources in deltas
+
+        See Enforcer.enforce().
+
+        :param project_id: The project to check usage and enforce limits
+                           against (or None).
+        :param deltas: An dictionary containing resource names as keys and
+                       requests resource quantities as positive integers.
+
+        :raises exception.ClaimExceedsLimit: when over limits
+        """
+        await self._run_in_thread(self._enforcer.enforce, project_id, deltas)
+
+    async def claim(
+        self, project_id: str | None, deltas: dict[str, int]
+    ) -> 'Claim':
+        """Check resource usage against limits and reserve the deltas
+
+        See Enforcer.claim().
+
+        :param project_id: The project to check usage and enforce limits
+                           against (or None).
+        :param deltas: An dictionary containing resource names as keys and
+                       requests resource quantities as positive integers.
+        :returns: A limit.Claim for the deltas.
+
+        :raises exception.ClaimExceedsLimit: when over limits
+        """
+        return await self._run_in_thread(
+            self._enforcer.claim, project_id, deltas
+        )
+
+    async def calculate_usage(
+        self, project_id: str | None, resources_to_check: Collection[str]
+    ) -> dict[str, ProjectUsage]:
+        """Calculate resource usage and limits for resources_to_check.
+
+        See Enforcer.calculate_usage().
+
+        :param project_id: The project for which to check usage and limits,
+                           or None.
+        :param resources_to_check: A list of resource names to query.
+        :returns: A dictionary of name:limit.ProjectUsage for the
+                  requested names against the provided project.
+        """
+        return await self._run_in_thread(
+            self._enforcer.calculate_usage, project_id, resources_to_check
+        )
+
+    async def enforce_many(
+        self, deltas_by_project: dict[str | None, dict[str, int]]
+    ) -> dict[str | None, exception.ProjectOverLimit | None]:
+        """Check resource usage against limits for many projects at once
+
+        See Enforcer.enforce_many().
+        """
+        return await self._run_in_thread(
+            self._enforcer.enforce_many, deltas_by_project
+        )
+
+    async def calculate_usage_many(
+        self,
+        project_ids: Collection[str | None],
+        resources_to_check: Collection[str],
+    ) -> dict[str | None, dict[str, ProjectUsage]]:
+        """Calculate resource usage and limits for many projects at once.
+
+        See Enforcer.calculate_usage_many().
+        """
+        return await self._run_in_thread(
+            self._enforcer.calculate_usage_many,
+            project_ids,
+            resources_to_check,
+        )
+
+    async def get_registered_limits(
+        self, resources_to_check: Collection[str]
+    ) -> list[tuple[str, int]]:
+        return await self._run_in_thread(
+            self._enforcer.get_registered_limits, resources_to_check
+        )
+
+    async def get_project_limits(
+        self, project_id: str | None, resources_to_check: Collection[str]
+    ) -> list[tuple[str, int]]:
+        return await self._run_in_thread(
+            self._enforcer.get_project_limits, project_id, resources_to_check
+        )
+
+    async def warm_cache(self) -> None:
+        """Load all the limits of the endpoint into the cache.
+
+        See Enforcer.warm_cache().
+        """
+        await self._run_in_thread(self._enforcer.warm_cache)
+
+    def invalidate_usage(
+        self,
+        project_id: str | None,
+        resources_to_check: Collection[str] | None = None,
+    ) -> None:
+        """Drop the cached usage of a project.
+
+        See Enforcer.invalidate_usage().
+        """
+        self._enforcer.invalidate_usage(project_id, resources_to_check)
+
+    def invalidate_limit(
+        self, limit_id: str, registered: bool = False, deleted: bool = False
+    ) -> None:
+        """Evict the cached limits affected by a change of a limit.
+
+        This may query keystone, so it must not be called from the event
+        loop. See Enforcer.invalidate_limit().
+        """
+        self._enforcer.invalidate_limit(
+            limit_id, registered=registered, deleted=deleted
+        )
+
+    def get_cache_stats(self) -> dict[str, CacheStats]:
+        """Get statistics about the limits cached by this enforcer.
+
+        See Enforcer.get_cache_stats().
+        """
+        return self._enforcer.get_cache_stats()
+
+    def get_circuit_breaker_stats(self) -> CircuitBreakerStats:
+        """Get the state of the circuit breaker of the calls to keystone.
+
+        See Enforcer.get_circuit_breaker_stats().
+        """
+        return self._enforcer.get_circuit_breaker_stats()
+
+
+class Claim:
+    """Resources reserved for a project by Enforcer.claim()
+
+    The claim is outstanding until it is committed or rolled back.
+    """
+
+    def __init__(
+        self,
+        ledger: '_ClaimLedger',
+        usage_cache: '_UsageCache | None',
+        project_id: str | None,
+        deltas: dict[str, int],
+        claim_key: str | None = None,
+    ) -> None:
+        self._ledger = ledger
+        self._usage_cache = usage_cache
+        self._claim_key = claim_key
+        self.project_id = project_id
+        self.deltas = dict(deltas)
+        self.outstanding = True
+
+    def commit(self) -> None:
+        """Release the claim once its resources are counted as usage."""
+        # Claims of the project must not be checked once the resources are
+        # removed from the ledger but not yet added to the cached usage.
+        with self._ledger.lock(self._claim_key):
+            if self._ledger.remove(self) and self._usage_cache is not None:
+                # Cached usage does not include the resources yet
+                self._usage_cache.add(self.project_id, self.deltas)
+
+    def rollback(self) -> None:
+        """Release the claim without its resources being used."""
+        self._ledger.remove(self)
+
+    def __enter__(self) -> 'Claim':
+        return self
+
+    def __exit__(self, exc_type: object, *args: object) -> None:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def __repr__(self) -> str:
+        return (
+            f'Claim(project_id={self.project_id!r}, deltas={self.deltas!r}, '
+            f'outstanding={self.outstanding!r})'
+        )
+
+
+class _FlatEnforcer:
+    name = 'flat'
+
+    def __init__(
+        self,
+        usage_callback: UsageCallbackT,
+        cache: bool = True,
+        batch_usage_callback: BatchUsageCallbackT | None = None,
+        shared_cache: limit_cache.SharedCache | None = None,
+        metrics: limit_metrics.Metrics | None = None,
+    ) -> None:
+        self._usage_callback = usage_callback
+        self._batch_usage_callback = batch_usage_callback
+        self._utils = _EnforcerUtils(
+            cache=cache, shared_cache=shared_cache, metrics=metrics
+        )
+        self._metrics = self._utils.metrics
+
+    def get_registered_limits(
+        self, resources_to_check: Collection[str]
+    ) -> list[tuple[str, int]]:
+        return self._utils.get_registered_limits(resources_to_check)
+
+    def get_project_limits(
+        self, project_id: str | None, resources_to_check: Collection[str]
+    ) -> list[tuple[str, int]]:
+        return self._utils.get_project_limits(project_id, resources_to_check)
+
+    def get_project_usage(
+        self, project_id: str | None, resources_to_check: Collection[str]
+    ) -> dict[str, int]:
+        with tracing.get_tracer().start_as_current_span(
+            'oslo_limit.usage'
+        ) as span:
+            if span.is_recording():
+                tracing._set_attributes(
+                    span,
+                    project_ids=(
+                        [project_id] if project_id is not None else None
+                    ),
+                    resources=sorted(resources_to_check),
+                )
+            return self._usage_callback(project_id, resources_to_check)
+
+    def enforce(self, project_id: str | None, deltas: dict[str, int]) -> None:
+        resources_to_check = list(deltas.keys())
+        # Always check the limits in the same order, for predictable errors
+        resources_to_check.sort()
+
+        with self._metrics.timer('enforce.duration', {'phase': 'limits'}):
+            project_limits = _finite_limits(
+                self.get_project_limits(project_id, resources_to_check)
+            )
+        if not project_limits:
+            # Every resource is unlimited, so there is no usage to count
+            return
+        with self._metrics.timer('enforce.duration', {'phase': 'usage'}):
+            current_usage = self.get_project_usage(
+                project_id, [resource for resource, _ in project_limits]
+            )
+
+        with self._metrics.timer('enforce.duration', {'phase': 'check'}):
+            self._utils.enforce_limits(
+                project_id, project_limits, current_usage, deltas
+            )
+
+    def get_projects_limits(
+        self,
+        project_ids: Collection[str | None],
+        resources_to_check: Collection[str],
+    ) -> dict[str | None, list[tuple[str, int]]]:
+        return self._utils.get_projects_limits(project_ids, resources_to_check)
+
+    def get_projects_usage(
+        self,
+        project_ids: Collection[str | None],
+        resources_to_check: Collection[str],
+    ) -> dict[str | None, dict[str, int]]:
+        with tracing.get_tracer().start_as_current_span(
+            'oslo_limit.usage'
+        ) as span:
+            if span.is_recording():
+                tracing._set_attributes(
+                    span,
+                    project_ids=sorted(filter(None, project_ids)),
+                    resources=sorted(resources_to_check),
+                )
+            if self._batch_usage_callback is None:
+                return {
+                    project_id: self._usage_callback(
+                        project_id, resources_to_check
+                    )
+                    for project_id in project_ids
+                }
+
+            usage = self._batch_usage_callback(project_ids, resources_to_check)
+        for project_id in project_ids:
+            if project_id not in usage:
+                msg = f"unable to get current usage for project {project_id}"
+                raise ValueError(msg)
+        return usage
+
+    def enforce_many(
+        self, deltas_by_project: dict[str | None, dict[str, int]]
+    ) -> dict[str | None, exception.ProjectOverLimit | None]:
+        resources_to_check = sorted(
+            {
+                resource
+                for deltas in deltas_by_project.values()
+                for resource in deltas
+            }
+        )
+
+        with self._metrics.timer('enforce.duration', {'phase': 'limits'}):
+            all_limits = self.get_projects_limits(
+                list(deltas_by_project), resources_to_check
+            )
+        finite_limits = {
+            project_id: _finite_limits(
+                (resource, limit)
+                for resource, limit in all_limits[project_id]
+                if resource in deltas
+            )
+            for project_id, deltas in deltas_by_project.items()
+        }
+        with self._metrics.timer('enforce.duration', {'phase': 'usage'}):
+            all_usage = self._get_usage_of_resources(
+                {
+                    project_id: [resource for resource, _ in limits]
+                    for project_id, limits in finite_limits.items()
+                }
+            )
+
+        results: dict[str | None, exception.ProjectOverLimit | None] = {}
+        with self._metrics.timer('enforce.duration', {'phase': 'check'}):
+            for project_id, deltas in deltas_by_project.items():
+                project_limits = finite_limits[project_id]
+                if not project_limits:
+                    results[project_id] = None
+                    continue
+                try:
+                    self._utils.enforce_limits(
+                        project_id,
+                        project_limits,
+                        all_usage[project_id],
+                        deltas,
+                    )
+                except exception.ProjectOverLimit as e:
+                    results[project_id] = e
+                else:
+                    results[project_id] = None
+
+        return results
+
+    def _get_usage_of_resources(
+        self, resources_by_project: dict[str | None, list[str]]
+    ) -> dict[str | None, dict[str, int]]:
+        """Get the usage of the given resources of each project.
+
+        Projects without any resource are left out.
+        """
+        resources_by_project = {
+            project_id: resources
+            for project_id, resources in resources_by_project.items()
+            if resources
+        }
+        if not resources_by_project:
+            return {}
+
+        if self._batch_usage_callback is not None:
+            resources_to_check = sorted(
+                {
+                    resource
+                    for resources in resources_by_project.values()
+                    for resource in resources
+                }
+            )
+            return self.get_projects_usage(
+                list(resources_by_project), resources_to_check
+            )
+
+        return {
+            project_id: self.get_project_usage(project_id, resources)
+            for project_id, resources in resources_by_project.items()
+        }
+
+    def get_enforced_usage(
+        self,
+        project_ids: Collection[str | None],
+        resources_to_check: Collection[str],
+    ) -> dict[str | None, dict[str, int]]:
+        """Get the usage against which the limits of each project apply
+
+        The usage of a single project is counted with the usage callback, as
+        by enforce(), and that of several with the batch usage callback if
+        there is one, as by enforce_many().
+        """
+        if len(project_ids) == 1:
+            (project_id,) = project_ids
+            return {
+                project_id: self.get_project_usage(
+                    project_id, resources_to_check
+                )
+            }
+        return self.get_projects_usage(project_ids, resources_to_check)
+
+    def get_claim_key(self, project_id: str | None) -> str | None:
+        return project_id
+
+    def get_cache_stats(self) -> dict[str, CacheStats]:
+        return self._utils.get_cache_stats()
+
+    def get_circuit_breaker_stats(self) -> CircuitBreakerStats:
+        return self._utils.breaker.stats()
+
+    def warm_cache(self) -> None:
+        self._utils.warm_cache()
+
+    def invalidate_limit(
+        self, limit_id: str, registered: bool = False, deleted: bool = False
+    ) -> None:
+        self._utils.invalidate_limit(
+            limit_id, registered=registered, deleted=deleted
+        )
+
+
+def _finite_limits(
+    limits: Iterable[tuple[str, int]],
+) -> list[tuple[str, int]]:
+    """Leave out unlimited resources, which can never be over limit."""
+    # Keystone unified limits use -1 to represent unlimited.
+    return [(resource, limit) for resource, limit in limits if limit >= 0]
+
+
+class _StrictTwoLevelEnforcer(_FlatEnforcer):
+    """Enforce limits with the strict-two-level model of keystone
+
+    Projects form trees of at most two levels, a top-level project and its
+    children. The usage of a project must be within its own limits, and the
+    usage of the whole tree, i.e. of the top-level project and all its
+    children, within the limits of the top-level project.
+    """
+
+    name = 'strict-two-level'
+
+    def __init__(
+        self,
+        usage_callback: UsageCallbackT,
+        cache: bool = True,
+        batch_usage_callback: BatchUsageCallbackT | None = None,
+        shared_cache: limit_cache.SharedCache | None = None,
+        metrics: limit_metrics.Metrics | None = None,
+    ) -> None:
+        super().__init__(
+            usage_callback,
+            cache=cache,
+            batch_usage_callback=batch_usage_callback,
+            shared_cache=shared_cache,
+            metrics=metrics,
+        )
+        # Keystone is down for both limits and projects
+        self._hierarchy = _ProjectHierarchy(
+            cache=cache, breaker=self._utils.breaker, metrics=self._metrics
+        )
+
+    def enforce(self, project_id: str | None, deltas: dict[str, int]) -> None:
+        over_limit = self.enforce_many({project_id: deltas})[project_id]
+        if over_limit is not None:
+            raise over_limit
+
+    def enforce_many(
+        self, deltas_by_project: dict[str | None, dict[str, int]]
+    ) -> dict[str | None, exception.ProjectOverLimit | None]:
+        resources_to_check = sorted(
+            {
+                resource
+                for deltas in deltas_by_project.values()
+                for resource in deltas
+            }
+        )
+
+        with self._metrics.timer('enforce.duration', {'phase': 'limits'}):
+            roots = {
+                project_id: self._hierarchy.get_root(project_id)
+                for project_id in deltas_by_project
+            }
+            all_limits = {
+                project_id: dict(limits)
+                for project_id, limits in self.get_projects_limits(
+                    set(deltas_by_project) | set(roots.values()),
+                    resources_to_check,
+                ).items()
+            }
+
+            # Unlimited resources are not checked, so only count the usage of
+            # the resources of each project, and of each tree, with a limit.
+            resources_by_project: dict[str | None, set[str]] = defaultdict(set)
+            resources_by_tree: dict[str | None, set[str]] = defaultdict(set)
+            for project_id, deltas in deltas_by_project.items():
+                root = roots[project_id]
+                for resource in deltas:
+                    if (
+                        root != project_id
+                        and all_limits[project_id][resource] >= 0
+                    ):
+                        resources_by_project[project_id].add(resource)
+                    if all_limits[root][resource] >= 0:
+                        resources_by_tree[root].add(resource)
+
+            trees: dict[str | None, tuple[str | None, ...]] = {}
+            for root, resources in resources_by_tree.items():
+                trees[root] = (root,)
+                if root is not None:
+                    trees[root] = self._hierarchy.get_tree(
+                        root,
+                        [
+                            project_id
+                            for project_id in deltas_by_project
+                            if roots[project_id] == root
+                        ],
+                    )
+                for project_id in trees[root]:
+                    resources_by_project[project_id].update(resources)
+
+        with self._metrics.timer('enforce.duration', {'phase': 'usage'}):
+            all_usage = self._get_usage_of_resources(
+                {
+                    project_id: sorted(resources)
+                    for project_id, resources in resources_by_project.items()
+                }
+            )
+            for project_id, resources in resources_by_project.items():
+                for resource in resources:
+                    if resource not in all_usage.get(project_id, {}):
+                        msg = f"unable to get current usage for {resource}"
+                        raise ValueError(msg)
+
+        results: dict[str | None, exception.ProjectOverLimit | None] = {}
+        with self._metrics.timer('enforce.duration', {'phase': 'check'}):
+            for project_id, deltas in deltas_by_project.items():
+                root = roots[project_id]
+                over_limit_list = []
+                for resource in sorted(deltas):
+                    delta = int(deltas[resource])
+                    # The limit of a child project applies to its own usage,
+                    # and the limit of the top-level project to that of the
+                    # tree.
+                    usage_by_limit = []
+                    if (
+                        root != project_id
+                        and all_limits[project_id][resource] >= 0
+                    ):
+                        usage_by_limit.append(
+                            (
+                                all_limits[project_id][resource],
+                                int(all_usage[project_id][resource]),
+                            )
+                        )
+                    if resource in resources_by_tree[root]:
+                        usage_by_limit.append(
+                            (
+                                all_limits[root][resource],
+                                sum(
+                                    int(all_usage[member][resource])
+                                    for member in trees[root]
+                                ),
+                            )
+                        )
+
+                    for limit, current in usage_by_limit:
+                        if current + delta > limit:
+                            over_limit_list.append(
+                                exception.OverLimitInfo(
+                                    resource, limit, current, delta
+                                )
+                            )
+                            break
+
+                if over_limit_list:
+                    LOG.debug("hit limit for project: %s", over_limit_list)
+                    results[project_id] = exception.ProjectOverLimit(
+                        project_id, over_limit_list
+                    )
+                else:
+                    results[project_id] = None
+
+        return results
+
+    def get_enforced_usage(
+        self,
+        project_ids: Collection[str | None],
+        resources_to_check: Collection[str],
+    ) -> dict[str | None, dict[str, int]]:
+        # The limit of a top-level project applies to the usage of its tree,
+        # and the limit of a child project to its own usage.
+        roots = {
+            project_id: self._hierarchy.get_root(project_id)
+            for project_id in project_ids
+        }
+        trees: dict[str | None, tuple[str, ...]] = {}
+        for project_id in project_ids:
+            if project_id is not None and roots[project_id] == project_id:
+                trees[project_id] = self._hierarchy.get_tree(
+                    project_id,
+                    [
+                        member
+                        for member in project_ids
+                        if roots[member] == project_id
+                    ],
+                )
+
+        resources = sorted(resources_to_check)
+        resources_by_project: dict[str | None, list[str]] = dict.fromkeys(
+            project_ids, resources
+        )
+        for members in trees.values():
+            resources_by_project.update(dict.fromkeys(members, resources))
+        all_usage = self._get_usage_of_resources(resources_by_project)
+
+        usage: dict[str | None, dict[str, int]] = {}
+        for project_id in project_ids:
+            tree = trees.get(project_id)
+            if tree is None:
+                usage[project_id] = all_usage[project_id]
+                continue
+            usage[project_id] = {
+                resource: sum(
+                    int(all_usage[member][resource]) for member in tree
+                )
+                for resource in resources_to_check
+            }
+        return usage
+
+    def get_claim_key(self, project_id: str | None) -> str | None:
+        # Claims of any project of a tree count against the top-level project
+        return self._hierarchy.get_root(project_id)
+
+    def get_cache_stats(self) -> dict[str, CacheStats]:
+        stats = super().get_cache_stats()
+        stats.update(self._hierarchy.get_cache_stats())
+        return stats
+
+
+class _ProjectHierarchy:
+    """Look up the trees of projects of the strict-two-level model
+
+    :param cache: Whether to cache the hierarchy, which expires like limits.
+    :param breaker: The circuit breaker of the calls to keystone.
+    :param metrics: The metrics of the enforcer.
+    """
+
+    def __init__(
+        self,
+        cache: bool = True,
+        breaker: '_CircuitBreaker | None' = None,
+        metrics: 'limit_metrics.Metrics | None' = None,
+    ) -> None:
+        self.should_cache = cache
+        self.breaker = breaker if breaker is not None else _CircuitBreaker()
+        self.metrics = _guard_metrics(metrics)
+        expiration_time = CONF.oslo_limit.cache_expiration_time
+        max_projects = CONF.oslo_limit.cache_max_projects
+        # {project_id: top-level project_id}
+        self.root_cache: _LimitCache[str] = _LimitCache(
+            expiration_time,
+            max_projects,
+            name='project_parents',
+            metrics=self.metrics,
+        )
+        # {top-level project_id: ids of the projects of its tree}
+        self.tree_cache: _LimitCache[tuple[str, ...]] = _LimitCache(
+            expiration_time,
+            max_projects,
+            name='project_trees',
+            metrics=self.metrics,
+        )
+        self._root_calls: _SingleFlight[str] = _SingleFlight()
+        self._tree_calls: _SingleFlight[tuple[str, ...]] = _SingleFlight()
+        _FORK_AWARE.add(self)
+
+    @property
+    def connection(self) -> '_identity_proxy.Proxy':
+        return _get_keystone_connection()
+
+    def _reset_after_fork(self, keep_cache: bool) -> None:
+        self.root_cache._reset_after_fork(keep_cache)
+        self.tree_cache._reset_after_fork(keep_cache)
+        self._root_calls._reset_after_fork()
+        self._tree_calls._reset_after_fork()
+
+    def get_cache_stats(self) -> dict[str, CacheStats]:
+        return {
+            'project_parents': self.root_cache.stats(),
+            'project_trees': self.tree_cache.stats(),
+        }
+
+    def get_root(self, project_id: str | None) -> str | None:
+        """Get the top-level project of the tree of a project"""
+        if project_id is None:
+            return None
+
+        if self.should_cache:
+            root = self.root_cache.get(project_id)
+            if root is not None:
+                return root
+
+        self.breaker.check()
+        return self._root_calls.do(
+            project_id,
+            lambda: self.breaker.call(lambda: self._fetch_root(project_id)),
+        )
+
+    def _fetch_root(self, project_id: str) -> str:
+        with _keystone_request(self.metrics, 'get_project'):
+            project = self.connection.get_project(project_id)
+        # Top-level projects have their domain as parent
+        root = project_id
+        if project.parent_id and project.parent_id != project.domain_id:
+            root = project.parent_id
+
+        if self.should_cache:
+            self.root_cache.set(project_id, root)
+        return root
+
+    def get_tree(
+        self, root: str, members: Collection[str | None] = ()
+    ) -> tuple[str, ...]:
+        """Get the top-level project and all its children
+
+        :param root: The top-level project.
+        :param members: Projects known to be in the tree. A cached tree
+                        without them was cached before they were created, so
+                        it is fetched again.
+        """
+        if self.should_cache:
+            tree = self.tree_cache.get(root)
+            if tree is not None and all(
+                project_id in tree for project_id in members
+            ):
+                return tree
+
+        self.breaker.check()
+        tree = self._tree_calls.do(
+            root, lambda: self.breaker.call(lambda: self._fetch_tree(root))
+        )
+        # Keystone may not list projects as soon as they are created, and
+        # their usage must count towards the tree anyway.
+        missing = [
+            project_id
+            for project_id in members
+            if project_id is not None and project_id not in tree
+        ]
+        return (*tree, *missing)
+
+    def _fetch_tree(self, root: str) -> tuple[str, ...]:
+        with _keystone_request(self.metrics, 'projects'):
+            children = [
+                sys.intern(project.id)
+                for project in self.connection.projects(parent_id=root)
+            ]
+        tree = (root, *children)
+
+        if self.should_cache:
+            self.tree_cache.set(root, tree)
+            # Save looking up the parent of each project of the tree
+            for project_id in tree:
+                self.root_cache.set(project_id, root)
+        return tree
+
+
+_MODELS: list[type[_EnforcerImplProtocol]] = [
+    _FlatEnforcer,
+    _StrictTwoLevelEnforcer,
+]
+
+
+# The key of the registered limits snapshot in _EnforcerUtils.rlimit_cache
+_REGISTERED_LIMITS = 'registered_limits'
+# The name of the project limits of all projects in the shared cache
+_PROJECT_LIMITS = 'project_limits'
+
+
+def _endpoint_attrs(endpoint: '_endpoint.Endpoint') -> dict[str, Any]:
+    """Get the attributes of an endpoint saved in the discovery snapshot"""
+    return {
+        'id': endpoint.id,
+        'service_id': endpoint.service_id,
+        'region_id': endpoint.region_id,
+        'interface': endpoint.interface,
+        'url': endpoint.url,
+    }
+
+
+def _intern_limits(limits: dict[str, int]) -> dict[str, int]:
+    """Intern the resource names of limits read from the shared cache"""
+    return {sys.intern(name): limit for name, limit in limits.items()}
+
+
+class _LimitsUnavailable(Exception):
+    """Limits can't be fetched, and a policy gives them a value instead"""
+
+    def __init__(self, error: Exception, limit: int) -> None:
+        self.error = error
+        self.limit = limit
+        super().__init__(str(error))
+
+
+class _LimitNotFound(Exception):
+    def __init__(self, resource: str) -> None:
+        msg = f"Can't find the limit for resource {resource}"
+        self.resource = resource
+        super().__init__(msg)
+
+
+class _LimitCache(Generic[_T]):
+    """A mapping of cached limits whose entries may expire
+
+    :param expiration_time: seconds for which an entry is valid once set, or
+                            0 if entries never expire.
+    :param max_size: maximum number of entries, beyond which the least
+                     recently used entries are evicted, or 0 for no maximum.
+    :param keep_stale: whether to keep expired entries until they are
+                       replaced or evicted, for get_stale().
+    :param name: the name of the cache in metrics.
+    :param metrics: the metrics to which hits, misses and evictions are
+                    reported, if any.
+    :param on_evict: a function called with the keys of the entries evicted
+                     to bound the size of the cache, if any.
+    """
+
+    def __init__(
+        self,
+        expiration_time: int = 0,
+        max_size: int = 0,
+        keep_stale: bool = False,
+        name: str = '',
+        metrics: limit_metrics.Metrics | None = None,
+        on_evict: Callable[[list[str]], None] | None = None,
+    ) -> None:
+        self.expiration_time = expiration_time
+        self.max_size = max_size
+        self.keep_stale = keep_stale
+        self.metrics = metrics
+        self.on_evict = on_evict
+        self._tags = {'cache': name}
+        # {key: (expires_at, value)}, from least to most recently used
+        self._entries: OrderedDict[str, tuple[float | None, _T]] = (
+            OrderedDict()
+        )
+        # Keys of the entries used since they were last refreshed
+        self._used: set[str] = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> _T | None:
+        with self._lock:
+            value = self._get(key)
+        if self.metrics is not None:
+            self.metrics.increment(
+                'cache.misses' if value is None else 'cache.hits',
+                tags=self._tags,
+            )
+        return value
+
+    def _get(self, key: str) -> _T | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            if self.keep_stale:
+                self._entries.move_to_end(key)
+            else:
+                del self._entries[key]
+                self._used.discard(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self._used.add(key)
+        self.hits += 1
+        return value
+
+    def get_stale(self, key: str) -> _T | None:
+        """Get an entry even if it expired, if expired entries are kept"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None else None
+
+    def set(
+        self, key: str, value: _T, expiration_time: float | None = None
+    ) -> None:
+        if expiration_time is None:
+            expiration_time = self.expiration_time
+        expires_at = None
+        if expiration_time:
+            expires_at = time.monotonic() + expiration_time
+
+        evicted = []
+        with self._lock:
+            # Entries are only used once they are got, so the entries which
+            # are refreshed keep their place, while new entries were just
+            # looked up.
+            if key not in self._entries:
+                self._used.add(key)
+            self._entries[key] = (expires_at, value)
+
+            if self.max_size:
+                while len(self._entries) > self.max_size:
+                    evicted.append(self._entries.popitem(last=False)[0])
+            self._used.difference_update(evicted)
+            self.evictions += len(evicted)
+
+        if evicted:
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+            if self.metrics is not None:
+                self.metrics.increment(
+                    'cache.evictions', len(evicted), tags=self._tags
+                )
+
+    def pop(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+            self._used.discard(key)
+
+    def _reset_after_fork(self, keep_entries: bool) -> None:
+        self._lock = threading.Lock()
+        if not keep_entries:
+            self._entries.clear()
+            self._used.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._used.clear()
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                len(self._entries), self.hits, self.misses, self.evictions
+            )
+
+    def expiring(self, within: float) -> list[str]:
+        """Return the keys of entries to refresh before they expire
+
+        These are the entries expiring in the next within seconds which were
+        used since they were last returned, so that entries which are no
+        longer used expire. Entries which already expired are reloaded when
+        they are next used instead.
+        """
+        now = time.monotonic()
+        deadline = now + within
+        with self._lock:
+            keys = [
+                key
+                for key in self._used
+                if (expires_at := self._entries[key][0]) is not None
+                and now < expires_at <= deadline
+            ]
+            self._used.difference_update(keys)
+        return keys
+
+
+class _SingleFlight(Generic[_T]):
+    """Coalesce concurrent calls for the same key into a single call
+
+    While a call for a key is in flight, callers for the same key wait for it
+    and share its result (or exception) instead of making their own call.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, futures.Future[_T]] = {}
+
+    def _reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def submit(
+        self,
+        key: Hashable,
+        func: Callable[[], _T],
+        executor: futures.Executor,
+        on_submit: 'Callable[[futures.Future[_T]], None] | None' = None,
+    ) -> 'futures.Future[_T]':
+        """Call func in the executor, unless a call for key is in flight
+
+        :param on_submit: a function called with the future of the call when
+                          func is called, rather than a call in flight joined.
+        """
+
+        def call_func() -> _T:
+            try:
+                return func()
+            finally:
+                with self._lock:
+                    del self._calls[key]
+
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = executor.submit(call_func)
+                if on_submit is not None:
+                    on_submit(call)
+        return call
+
+    def do(self, key: Hashable, func: Callable[[], _T]) -> _T:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                waiting = True
+            else:
+                waiting = False
+                call = self._calls[key] = futures.Future()
+
+        if waiting:
+            return call.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+# The states of _CircuitBreaker
+_CIRCUIT_CLOSED = 'closed'
+_CIRCUIT_OPEN = 'open'
+_CIRCUIT_HALF_OPEN = 'half-open'
+
+
+class _CircuitBreaker:
+    """Stop calling keystone once calls to it keep failing
+
+    The circuit opens once failure_threshold calls in a row failed or timed
+    out, and calls are rejected while it is open, so that requests do not
+    all wait for a keystone which is down. After recovery_time seconds, a
+    single call is let through as a probe: the circuit closes if it succeeds,
+    and opens again otherwise.
+
+    :param failure_threshold: number of failures in a row which open the
+                              circuit, or 0 to never open it.
+    :param recovery_time: seconds for which the circuit stays open before a
+                          probe is let through.
+    """
+
+    def __init__(
+        self, failure_threshold: int = 0, recovery_time: float = 30
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self._lock = threading.Lock()
+        self.state = _CIRCUIT_CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        # Calls made in the background which callers stopped waiting for
+        self._timed_out: weakref.WeakSet[futures.Future[Any]] = (
+            weakref.WeakSet()
+        )
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+
+    def _reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+        # A probe in flight in the parent process never completes here
+        self._probing = False
+
+    def check(self) -> None:
+        """Check that keystone may be called
+
+        :raises exception.KeystoneUnavailable: if the circuit is open
+        """
+        with self._lock:
+            if self.state == _CIRCUIT_CLOSED:
+                return
+            if (
+                self.state == _CIRCUIT_OPEN
+                and self._opened_at + self.recovery_time <= time.monotonic()
+            ):
+                self.state = _CIRCUIT_HALF_OPEN
+            if self.state == _CIRCUIT_HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+
+        raise exception.KeystoneUnavailable(
+            f'{self.failures} calls in a row failed'
+        )
+
+    def call(self, func: Callable[[], _T]) -> _T:
+        """Call func, recording whether it failed"""
+        try:
+            result = func()
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def watch(self, call: 'futures.Future[Any]') -> None:
+        """Record whether a call made in the background failed"""
+        call.add_done_callback(self._record_outcome)
+
+    def _record_outcome(self, call: 'futures.Future[Any]') -> None:
+        with self._lock:
+            timed_out = call in self._timed_out
+            self._timed_out.discard(call)
+        if call.cancelled() or call.exception() is not None:
+            # A call which timed out was already counted as failed
+            if not timed_out:
+                self.record_failure()
+        else:
+            self.record_success()
+
+    def record_timeout(self, call: 'futures.Future[Any]') -> None:
+        """Record that a caller stopped waiting for a watched call
+
+        The call may never complete, so it fails now, once whatever the
+        number of callers waiting for it.
+        """
+        with self._lock:
+            if call.done() or call in self._timed_out:
+                return
+            self._timed_out.add(call)
+        self.record_failure()
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != _CIRCUIT_CLOSED:
+                LOG.info("Keystone is available again")
+            self.state = _CIRCUIT_CLOSED
+            self._probing = False
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == _CIRCUIT_HALF_OPEN or (
+                self.state == _CIRCUIT_CLOSED
+                and self.failure_threshold
+                and self.failures >= self.failure_threshold
+            ):
+                LOG.warning(
+                    "Not calling keystone for %(recovery_time)s seconds "
+                    "after %(failures)s calls in a row failed",
+                    {
+                        'recovery_time': self.recovery_time,
+                        'failures': self.failures,
+                    },
+                )
+                self.state = _CIRCUIT_OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+                self.opened += 1
+
+    def stats(self) -> CircuitBreakerStats:
+        with self._lock:
+            return CircuitBreakerStats(
+                self.state, self.failures, self.opened, self.rejected
+            )
+
+
+class _UsageCache:
+    """Cache the usage returned by the usage callbacks of an enforcer
+
+    Usage is cached per project and resource, so the callbacks are only asked
+    for the usage of resources which are not cached, and concurrent lookups of
+    the same usage are coalesced into a single call.
+
+    :param usage_callback: the usage callback of the enforcer.
+    :param batch_usage_callback: the batched usage callback of the enforcer,
+                                 or None.
+    :param expiration_time: seconds for which cached usage is valid.
+    :param metrics: the metrics of the enforcer.
+    """
+
+    def __init__(
+        self,
+        usage_callback: UsageCallbackT,
+        batch_usage_callback: BatchUsageCallbackT | None,
+        expiration_time: int,
+        metrics: limit_metrics.Metrics | None = None,
+    ) -> None:
+        self.metrics = (
+            metrics if metrics is not None else limit_metrics.Metrics()
+        )
+        self._usage_callback = usage_callback
+        self._batch_usage_callback = batch_usage_callback
+        self.expiration_time = expiration_time
+        # {(project_id, resource_name): (expires_at, usage)}
+        self._entries: dict[tuple[str | None, str], tuple[float, int]] = {}
+        self._purge_size = 0
+        self._lock = threading.Lock()
+        self._calls: _SingleFlight[dict[str, int]] = _SingleFlight()
+        self._batch_calls: _SingleFlight[dict[str | None, dict[str, int]]]
+        self._batch_calls = _SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(
+        self, project_id: str | None, resources_to_check: Collection[str]
+    ) -> tuple[dict[str, int], list[str]]:
+        """Split resources into cached usage and resources to look up"""
+        now = time.monotonic()
+        usage = {}
+        missing = []
+        with self._lock:
+            for resource_name in resources_to_check:
+                entry = self._entries.get((project_id, resource_name))
+                if entry is not None and entry[0] > now:
+                    usage[resource_name] = entry[1]
+                    self.hits += 1
+                else:
+                    missing.append(resource_name)
+                    self.misses += 1
+
+        if usage:
+            self.metrics.increment(
+                'cache.hits', len(usage), tags={'cache': 'usage'}
+            )
+        if missing:
+            self.metrics.increment(
+                'cache.misses', len(missing), tags={'cache': 'usage'}
+            )
+        return usage, missing
+
+    def _store(self, project_id: str | None, usage: dict[str, int]) -> None:
+        expires_at = time.monotonic() + self.expiration_time
+        with self._lock:
+            for resource_name, value in usage.items():
+                self._entries[(project_id, resource_name)] = (
+                    expires_at,
+                    int(value),
+                )
+            # Expired entries are otherwise only replaced, so drop them once
+            # the number of entries has doubled since they were last dropped.
+            if len(self._entries) > 2 * self._purge_size:
+                now = time.monotonic()
+                self._entries = {
+                    key: entry
+                    for key, entry in self._entries.items()
+                    if entry[0] > now
+                }
+                self._purge_size = len(self._entries)
+
+    def get_usage(
+        self, project_id: str | None, resources_to_check: Collection[str]
+    ) -> dict[str, int]:
+        usage, missing = self._lookup(project_id, resources_to_check)
+        if missing:
+            fetched = self._calls.do(
+                (project_id, tuple(missing)),
+                lambda: self._usage_callback(project_id, missing),
+            )
+            self._store(project_id, fetched)
+            usage.update(fetched)
+        return usage
+
+    def get_usage_many(
+        self,
+        project_ids: Collection[str | None],
+        resources_to_check: Collection[str],
+    ) -> dict[str | None, dict[str, int]]:
+        assert self._batch_usage_callback is not None  # narrow type
+        batch_usage_callback = self._batch_usage_callback
+
+        all_usage = {}
+        missing_projects = []
+        missing_resources: set[str] = set()
+        for project_id in project_ids:
+            usage, missing = self._lookup(project_id, resources_to_check)
+            all_usage[project_id] = usage
+            if missing:
+                missing_projects.append(project_id)
+                missing_resources.update(missing)
+
+        if missing_projects:
+            resource_names = sorted(missing_resources)
+            fetched = self._batch_calls.do(
+                (tuple(missing_projects), tuple(resource_names)),
+                lambda: batch_usage_callback(missing_projects, resource_names),
+            )
+            for project_id in missing_projects:
+                if project_id in fetched:
+                    self._store(project_id, fetched[project_id])
+                    # Keep the usage which was cached, as the usage which was
+                    # fetched may not include it.
+                    all_usage[project_id] = {
+                        **fetched[project_id],
+                        **all_usage[project_id],
+                    }
+                else:
+                    del all_usage[project_id]
+        return all_usage
+
+    def add(self, project_id: str | None, deltas: dict[str, int]) -> None:
+        """Add deltas to the cached usage of a project
+
+        Usage which is not cached is left to be looked up.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for resource_name, delta in deltas.items():
+                key = (project_id, resource_name)
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    self._entries[key] = (entry[0], entry[1] + int(delta))
+
+    def invalidate(
+        self,
+        project_id: str | None,
+        resource_names: Collection[str] | None = None,
+    ) -> None:
+        with self._lock:
+            if resource_names is None:
+                for key in [k for k in self._entries if k[0] == project_id]:
+                    del self._entries[key]
+            else:
+                for resource_name in resource_names:
+                    self._entries.pop((project_id, resource_name), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _reset_after_fork(self, keep_entries: bool) -> None:
+        self._lock = threading.Lock()
+        self._calls._reset_after_fork()
+        self._batch_calls._reset_after_fork()
+        if not keep_entries:
+            self._entries.clear()
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(len(self._entries), self.hits, self.misses, 0)
+
+
+class _ClaimLedger:
+    """Track the outstanding claims of an enforcer
+
+    The deltas of outstanding claims are added to the usage returned by the
+    usage callbacks of the enforcer.
+    """
+
+    def __init__(
+        self,
+        usage_callback: UsageCallbackT,
+        batch_usage_callback: BatchUsageCallbackT | None,
+    ) -> None:
+        self._usage_callback = usage_callback
+        self._batch_usage_callback = batch_usage_callback
+        self._lock = threading.Lock()
+        # {project_id: {resource_name: claimed}}
+        self._claimed: dict[str | None, dict[str, int]] = {}
+        self._claims: set[Claim] = set()
+        # {project_id: [lock, number of threads using it]}
+        self._project_locks: dict[str | None, list[Any]] = {}
+
+    @contextlib.contextmanager
+    def lock(self, project_id: str | None) -> Iterator[None]:
+        """Serialize the claims of a project"""
+        with self._lock:
+            entry = self._project_locks.setdefault(
+                project_id, [threading.Lock(), 0]
+            )
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._project_locks[project_id]
+
+    def _reset_after_fork(self) -> None:
+        # Claims are made for the resources created by the parent process
+        for claim in self._claims:
+            claim.outstanding = False
+        self._lock = threading.Lock()
+        self._claimed = {}
+        self._claims = set()
+        self._project_locks = {}
+
+    def add(self, claim: Claim) -> None:
+        with self._lock:
+            self._claims.add(claim)
+            claimed = self._claimed.setdefault(claim.project_id, {})
+            for resource_name, delta in claim.deltas.items():
+                claimed[resource_name] = claimed.get(resource_name, 0) + delta
+
+    def remove(self, claim: Claim) -> bool:
+        """Remove a claim, returning whether it was outstanding"""
+        with self._lock:
+            if claim not in self._claims:
+                return False
+            self._claims.remove(claim)
+            claim.outstanding = False
+            claimed = self._claimed[claim.project_id]
+            for resource_name, delta in claim.deltas.items():
+                claimed[resource_name] -= delta
+                if not claimed[resource_name]:
+                    del claimed[resource_name]
+            if not claimed:
+                del self._claimed[claim.project_id]
+            return True
+
+    def _add_claimed(
+        self, project_id: str | None, usage: dict[str, int]
+    ) -> dict[str, int]:
+        with self._lock:
+            claimed = self._claimed.get(project_id)
+            if not claimed:
+                return usage
+            return {
+                resource_name: int(value) + claimed.get(resource_name, 0)
+                for resource_name, value in usage.items()
+            }
+
+    def get_usage(
+        self, project_id: str | None, resources_to_check: Collection[str]
+    ) -> dict[str, int]:
+        usage = self._usage_callback(project_id, resources_to_check)
+        return self._add_claimed(project_id, usage)
+
+    def get_usage_many(
+        self,
+        project_ids: Collection[str | None],
+        resources_to_check: Collection[str],
+    ) -> dict[str | None, dict[str, int]]:
+        assert self._batch_usage_callback is not None  # narrow type
+        all_usage = self._batch_usage_callback(project_ids, resources_to_check)
+        return {
+            project_id: self._add_claimed(project_id, usage)
+            for project_id, usage in all_usage.items()
+        }
+
+
+# The maximum number of concurrent calls to keystone made in the background by
+# an enforcer
+_KEYSTONE_WORKERS = 4
+
+
+class _GuardedMetrics(limit_metrics.Metrics):
+    """Report metrics, without failing checks if that fails
+
+    :param metrics: the metrics to report to.
+    """
+
+    def __init__(self, metrics: limit_metrics.Metrics) -> None:
+        self.metrics = metrics
+        self._warned = False
+
+    def _records_timings(self) -> bool:
+        return self.metrics._records_timings()
+
+    def _get_log_level(self) -> int:
+        # Every check likely fails to report it the same way, so only warn
+        # once
+        log_level = logging.DEBUG if self._warned else logging.WARNING
+        self._warned = True
+        return log_level
+
+    def increment(
+        self, name: str, value: int = 1, tags: dict[str, str] | None = None
+    ) -> None:
+        try:
+            self.metrics.increment(name, value, tags)
+        except Exception:
+            LOG.log(
+                self._get_log_level(),
+                'Failed to report metric %s',
+                name,
+                exc_info=True,
+            )
+
+    def timing(
+        self, name: str, seconds: float, tags: dict[str, str] | None = None
+    ) -> None:
+        try:
+            self.metrics.timing(name, seconds, tags)
+        except Exception:
+            LOG.log(
+                self._get_log_level(),
+                'Failed to report metric %s',
+                name,
+                exc_info=True,
+            )
+
+
+# The default metrics, which discard everything
+_NOOP_METRICS = limit_metrics.Metrics()
+
+
+def _guard_metrics(
+    metrics: limit_metrics.Metrics | None,
+) -> limit_metrics.Metrics:
+    if metrics is None:
+        return _NOOP_METRICS
+    if isinstance(metrics, _GuardedMetrics) or (
+        type(metrics) is limit_metrics.Metrics
+    ):
+        return metrics
+    return _GuardedMetrics(metrics)
+
+
+@contextlib.contextmanager
+def _keystone_request(
+    metrics: limit_metrics.Metrics, request: str
+) -> Iterator[None]:
+    """Trace a request to keystone, and record its duration and result"""
+    result = 'failure'
+    try:
+        with (
+            tracing.get_tracer().start_as_current_span(
+                f'oslo_limit.keystone.{request}'
+            ),
+            metrics.timer('keystone.duration', {'request': request}),
         ):
-            msg = 'project_id must be a non-empty string or None.'
-            raise ValueError(msg)
-
-        msg = (
-            'resources_to_check must be non-empty sequence of '
-            'resource name strings'
+            yield
+        result = 'success'
+    finally:
+        metrics.increment(
+            'keystone.requests', tags={'request': request, 'result': result}
         )
-        try:
-            if len(resources_to_check) == 0:
-                raise ValueError(msg)
-        except TypeError:
-            raise ValueError(msg)
 
-        for resource_name in resources_to_check:
-            if not isinstance(resource_name, str):
-                raise ValueError(msg)
 
-        limits = self.model.get_project_limits(project_id, resources_to_check)
-        usage = self.model.get_project_usage(project_id, resources_to_check)
+# Whether limits were looked up in keystone, or the shared cache, rather than
+# the cache of the enforcer, since _EnforcerUtils._get_limit() reset it
+_LIMITS_LOADED: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    'oslo_limit_limits_loaded', default=False
+)
 
-        return {
-            resource: ProjectUsage(limit, usage[resource])
-            for resource, limit in limits
-        }
+# The time by which the check being made must be done waiting for keystone,
+# as set by _keystone_budget()
+_KEYSTONE_DEADLINE: contextvars.ContextVar[float | None] = (
+    contextvars.ContextVar('oslo_limit_keystone_deadline', default=None)
+)
 
-    def get_registered_limits(
-        self, resources_to_check: Collection[str]
-    ) -> list[tuple[str, int]]:
-        return self.model.get_registered_limits(resources_to_check)
 
-    def get_project_limits(
-        self, project_id: str | None, resources_to_check: Collection[str]
-    ) -> list[tuple[str, int]]:
-        return self.model.get_project_limits(project_id, resources_to_check)
+def _keystone_budget(
+    budget: float,
+) -> contextlib.AbstractContextManager[None]:
+    """Bound the time a check waits for keystone
 
+    Nested checks, such as a claim checking limits, share the budget of the
+    outermost one.
 
-class _FlatEnforcer:
-    name = 'flat'
+    :param budget: the keystone_enforce_budget of the enforcer, 0 for none.
+    """
+    if not budget or _KEYSTONE_DEADLINE.get() is not None:
+        return contextlib.nullcontext()
+    return _keystone_deadline(budget)
 
-    def __init__(
-        self, usage_callback: UsageCallbackT, cache: bool = True
-    ) -> None:
-        self._usage_callback = usage_callback
-        self._utils = _EnforcerUtils(cache=cache)
 
-    def get_registered_limits(
-        self, resources_to_check: Collection[str]
-    ) -> list[tuple[str, int]]:
-        return self._utils.get_registered_limits(resources_to_check)
+@contextlib.contextmanager
+def _keystone_deadline(budget: float) -> Iterator[None]:
+    token = _KEYSTONE_DEADLINE.set(time.monotonic() + budget)
+    try:
+        yield
+    finally:
+        _KEYSTONE_DEADLINE.reset(token)
 
-    def get_project_limits(
-        self, project_id: str | None, resources_to_check: Collection[str]
-    ) -> list[tuple[str, int]]:
-        return self._utils.get_project_limits(project_id, resources_to_check)
 
-    def get_project_usage(
-        self, project_id: str | None, resources_to_check: Collection[str]
-    ) -> dict[str, int]:
-        return self._usage_callback(project_id, resources_to_check)
+def _log_revalidation_failure(call: 'futures.Future[Any]') -> None:
+    error = call.exception()
+    if error is not None:
+        LOG.warning(
+            "Failed to revalidate expired limits: %s",
+            error or type(error).__name__,
+        )
 
-    def enforce(self, project_id: str | None, deltas: dict[str, int]) -> None:
-        resources_to_check = list(deltas.keys())
-        # Always check the limits in the same order, for predictable errors
-        resources_to_check.sort()
 
-        project_limits = self.get_project_limits(
-            project_id, resources_to_check
+def _refresh_cache_periodically(
+    utils_ref: Callable[[], '_EnforcerUtils | None'],
+    interval: int,
+    stop: threading.Event,
+) -> None:
+    # Only hold a strong reference to the utils while refreshing, so that this
+    # thread does not keep an otherwise unused enforcer alive.
+    while not stop.wait(interval):
+        utils = utils_ref()
+        if utils is None:
+            return
+        try:
+            utils.refresh_cache(interval)
+        except Exception:
+            LOG.exception('Failed to refresh cached limits')
+        del utils
+
+
+class _EnforcerUtils:
+    """Logic common used by multiple enforcers"""
+
+    def __init__(
+        self,
+        cache: bool = True,
+        shared_cache: 'limit_cache.SharedCache | None' = None,
+        metrics: 'limit_metrics.Metrics | None' = None,
+    ) -> None:
+        self._refresh_stop = threading.Event()
+        self.should_cache = cache
+        # Limits are looked up in the shared cache before keystone, and those
+        # fetched from keystone are saved there for the other processes.
+        self.shared_cache = shared_cache if cache else None
+        expiration_time = CONF.oslo_limit.cache_expiration_time
+        self._negative_expiration_time: int = (
+            CONF.oslo_limit.cache_negative_expiration_time
+        )
+        if self._negative_expiration_time is None:
+            self._negative_expiration_time = expiration_time
+        self.metrics = (
+            metrics if metrics is not None else limit_metrics.Metrics()
+        )
+        # When keystone is unavailable, the last known limits are used, so
+        # expired limits are kept.
+        self._stale_while_revalidate = (
+            CONF.oslo_limit.cache_stale_while_revalidate
+        )
+        self._unavailable_policy = CONF.oslo_limit.keystone_unavailable_policy
+        keep_stale = (
+            self._stale_while_revalidate or self._unavailable_policy != 'raise'
+        )
+        # Only the limit values are cached rather than the SDK resources, which
+        # are two orders of magnitude larger, so that the limits of many
+        # projects can be cached.
+        # {project_id: {resource_name: resource_limit}}, where an empty dict
+        # means that the project has no project limits
+        self.plimit_cache: _LimitCache[dict[str, int]] = _LimitCache(
+            expiration_time,
+            max_size=CONF.oslo_limit.cache_max_projects,
+            keep_stale=keep_stale,
+            name='project_limits',
+            metrics=self.metrics,
+            on_evict=self._disown_limits,
         )
-        current_usage = self.get_project_usage(project_id, resources_to_check)
+        # {_REGISTERED_LIMITS: {resource_name: default_limit}}, holding every
+        # registered limit for the endpoint
+        self.rlimit_cache: _LimitCache[dict[str, int]] = _LimitCache(
+            expiration_time,
+            keep_stale=keep_stale,
+            name='registered_limits',
+            metrics=self.metrics,
+        )
+        # Once warm_cache() has been used, the time until which plimit_cache is
+        # known to hold every project with project limits (or None if that
+        # never expires) and the number of evictions from it at the time.
+        self._plimit_snapshot: tuple[float | None, int] | None = None
+        expiration_times = [
+            t for t in (expiration_time, self._negative_expiration_time) if t
+        ]
+        self._plimit_snapshot_expiration_time = min(expiration_times or [0])
+        # Concurrent cache misses for the same limits share a single query to
+        # keystone.
+        self._plimit_calls: _SingleFlight[dict[str, int]] = _SingleFlight()
+        self._rlimit_calls: _SingleFlight[dict[str, int]] = _SingleFlight()
+        self._all_plimit_calls: _SingleFlight[dict[str, dict[str, int]]] = (
+            _SingleFlight()
+        )
+        # Calls to keystone are made by the executor when they must not take
+        # longer than keystone_timeout, or when limits are revalidated, so
+        # that lookups do not wait for them.
+        self._keystone_timeout: float = CONF.oslo_limit.keystone_timeout
+        self.breaker = _CircuitBreaker(
+            CONF.oslo_limit.keystone_failure_threshold,
+            CONF.oslo_limit.keystone_recovery_time,
+        )
+        self._executor: futures.ThreadPoolExecutor | None = None
+        self._executor_lock = threading.Lock()
+        # {limit_id: project_id or _REGISTERED_LIMITS} of the cached limits,
+        # to find the limits to evict when a limit changes in keystone
+        self._limit_owners: dict[str, str] = {}
+        # {project_id or _REGISTERED_LIMITS: ids of its limits}, to forget
+        # the owners of the limits of the projects evicted from plimit_cache
+        self._owned_limits: dict[str, set[str]] = {}
+        self._limit_owners_lock = threading.Lock()
+
+        self._discovery_verifier: threading.Thread | None = None
+        endpoint, from_snapshot = self._discover_endpoint()
+        self._endpoint: _endpoint.Endpoint = endpoint
+        self._service_id: str = endpoint.service_id
+        self._region_id: str = endpoint.region_id
+        if from_snapshot:
+            # Once the endpoint is set, so that it is replaced by the current
+            # one rather than the other way around
+            self._discovery_verifier = _start_discovery_verifier(
+                self._verify_endpoint, endpoint
+            )
 
-        self._utils.enforce_limits(
-            project_id, project_limits, current_usage, deltas
+        self._refresh_interval = 0
+        if cache and (expiration_time or self._negative_expiration_time):
+            self._refresh_interval = CONF.oslo_limit.cache_refresh_interval
+        if self._refresh_interval:
+            self._start_refresher()
+        _FORK_AWARE.add(self)
+
+        if cache and CONF.oslo_limit.cache_prefetch:
+            self.warm_cache()
+
+    def __del__(self) -> None:
+        self._refresh_stop.set()
+
+    @property
+    def connection(self) -> '_identity_proxy.Proxy':
+        return _get_keystone_connection()
+
+    def _start_refresher(self) -> None:
+        refresher = threading.Thread(
+            target=_refresh_cache_periodically,
+            args=(
+                weakref.ref(self),
+                self._refresh_interval,
+                self._refresh_stop,
+            ),
+            name='oslo-limit-cache-refresh',
+            daemon=True,
         )
+        refresher.start()
+
+    def _reset_after_fork(self, keep_cache: bool) -> None:
+        self.plimit_cache._reset_after_fork(keep_cache)
+        self.rlimit_cache._reset_after_fork(keep_cache)
+        self._limit_owners_lock = threading.Lock()
+        if not keep_cache:
+            self._plimit_snapshot = None
+            self._limit_owners = {}
+            self._owned_limits = {}
+        self._plimit_calls._reset_after_fork()
+        self._rlimit_calls._reset_after_fork()
+        self._all_plimit_calls._reset_after_fork()
+        self.breaker._reset_after_fork()
+        # The threads of the executor of the parent process are not running
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # The refresh thread of the parent process is not running here
+        if self._refresh_interval:
+            self._refresh_stop = threading.Event()
+            self._start_refresher()
+
+    def get_cache_stats(self) -> dict[str, CacheStats]:
+        return {
+            'project_limits': self.plimit_cache.stats(),
+            'registered_limits': self.rlimit_cache.stats(),
+        }
 
+    def refresh_cache(self, within: float) -> None:
+        """Reload cached limits which expire in the next within seconds
 
-class _StrictTwoLevelEnforcer:
-    name = 'strict-two-level'
+        Only the limits used since they were last loaded are reloaded, so
+        that the limits of projects which are no longer checked expire.
 
-    def __init__(
-        self, usage_callback: UsageCallbackT, cache: bool = True
+        :param within: number of seconds from now
+        """
+        if self._plimit_snapshot is not None:
+            expires_at = self._plimit_snapshot[0]
+            if (
+                expires_at is not None
+                and expires_at <= time.monotonic() + within
+            ):
+                self._load_registered_limits(fresh_for=within)
+                self._load_all_project_limits(fresh_for=within)
+                return
+
+        for project_id in self.plimit_cache.expiring(within):
+            self._load_project_limits(project_id, fresh_for=within)
+
+        if self.rlimit_cache.expiring(within):
+            self._load_registered_limits(fresh_for=within)
+
+    def _shared_key(self, name: str) -> str:
+        return f'oslo_limit:{self._service_id}:{self._region_id}:{name}'
+
+    def _get_shared(
+        self, name: str, fresh_for: float = 0
+    ) -> tuple[float | None, Any] | None:
+        """Get limits from the shared cache
+
+        :param name: name of the limits.
+        :param fresh_for: seconds for which the limits must remain valid.
+        :returns: the seconds until the limits expire, or None if they do not,
+                  and the limits, or None if they are not cached.
+        """
+        if self.shared_cache is None:
+            return None
+
+        try:
+            data = self.shared_cache.get(self._shared_key(name))
+            if data is None:
+                return None
+            expires_at, value, limit_owners = json.loads(data)
+        except Exception:
+            LOG.warning(
+                'Unable to get %s from the shared cache', name, exc_info=True
+            )
+            return None
+
+        expires_in = None
+        if expires_at is not None:
+            expires_in = expires_at - time.time()
+            if expires_in <= fresh_for:
+                return None
+        self._own_limits(limit_owners)
+        return expires_in, value
+
+    def _set_shared(
+        self,
+        name: str,
+        value: Any,
+        expiration_time: float,
+        limit_owners: dict[str, str],
     ) -> None:
-        self._usage_callback = usage_callback
+        if self.shared_cache is None:
+            return
 
-    def get_registered_limits(
-        self, resources_to_check: Collection[str]
-    ) -> list[tuple[str, int]]:
-        raise NotImplementedError()
+        # The clock of the other processes is the wall clock
+        expires_at = None
+        if expiration_time:
+            expires_at = time.time() + expiration_time
+        try:
+            self.shared_cache.set(
+                self._shared_key(name),
+                json.dumps([expires_at, value, limit_owners]).encode(),
+            )
+        except Exception:
+            LOG.warning(
+                'Unable to save %s in the shared cache', name, exc_info=True
+            )
 
-    def get_project_limits(
-        self, project_id: str | None, resources_to_check: Collection[str]
-    ) -> list[tuple[str, int]]:
-        raise NotImplementedError()
+    def _delete_shared(self, name: str) -> None:
+        if self.shared_cache is None:
+            return
 
-    def get_project_usage(
-        self, project_id: str | None, resources_to_check: Collection[str]
-    ) -> dict[str, int]:
-        raise NotImplementedError()
+        try:
+            self.shared_cache.delete(self._shared_key(name))
+        except Exception:
+            LOG.warning(
+                'Unable to delete %s from the shared cache',
+                name,
+                exc_info=True,
+            )
 
-    def enforce(self, project_id: str | None, deltas: dict[str, int]) -> None:
-        raise NotImplementedError()
+    def _own_limits(
+        self, limit_owners: dict[str, str], owners: Iterable[str] = ()
+    ) -> None:
+        """Record the owners of cached limits
 
+        :param limit_owners: {limit_id: owner} of the cached limits.
+        :param owners: owners all of whose limits were cached, so that their
+                       limits which are not in limit_owners are forgotten.
+        """
+        with self._limit_owners_lock:
+            self._forget_limits(owners)
+            for limit_id, owner in limit_owners.items():
+                self._limit_owners[limit_id] = owner
+                self._owned_limits.setdefault(owner, set()).add(limit_id)
+
+    def _disown_limits(self, owners: list[str]) -> None:
+        """Forget the owners of the limits of projects no longer cached"""
+        with self._limit_owners_lock:
+            self._forget_limits(owners)
+
+    def _forget_limits(self, owners: Iterable[str]) -> None:
+        for owner in owners:
+            for limit_id in self._owned_limits.pop(owner, ()):
+                self._limit_owners.pop(limit_id, None)
+
+    def invalidate_limit(
+        self, limit_id: str, registered: bool = False, deleted: bool = False
+    ) -> None:
+        """Evict the cached limits affected by a change of a limit
 
-_MODELS: list[type[_EnforcerImplProtocol]] = [
-    _FlatEnforcer,
-    _StrictTwoLevelEnforcer,
-]
+        :param limit_id: id of the project limit, or registered limit, which
+                         was created, updated or deleted in keystone.
+        :param registered: whether the limit is a registered limit.
+        :param deleted: whether the limit was deleted.
+        """
+        if not self.should_cache:
+            return
+
+        # Limits which were not cached are unknown. Only created limits may
+        # apply to cached projects, and deleted limits cannot be looked up.
+        owner = self._limit_owners.get(limit_id)
+        if owner is None and not deleted:
+            owner = self._get_limit_owner(limit_id, registered)
+        if deleted and owner is not None:
+            with self._limit_owners_lock:
+                self._limit_owners.pop(limit_id, None)
+                self._owned_limits.get(owner, set()).discard(limit_id)
+        if owner is None:
+            return
+
+        LOG.debug(
+            "Limit %s changed, evicting the limits of %s", limit_id, owner
+        )
+        if owner == _REGISTERED_LIMITS:
+            self._delete_shared(_REGISTERED_LIMITS)
+            self.rlimit_cache.pop(_REGISTERED_LIMITS)
+            return
+
+        self._delete_shared(f'{_PROJECT_LIMITS}:{owner}')
+        self._delete_shared(_PROJECT_LIMITS)
+        if self._has_all_project_limits():
+            # A project missing from the cache would be taken to have no
+            # project limits, so its limits are reloaded instead.
+            self._fetch_project_limits(owner)
+        else:
+            self.plimit_cache.pop(owner)
 
+    def _get_limit_owner(self, limit_id: str, registered: bool) -> str | None:
+        """Get the project of a limit, if it is a limit of the endpoint."""
+        from openstack import exceptions as os_exceptions
 
-class _LimitNotFound(Exception):
-    def __init__(self, resource: str) -> None:
-        msg = f"Can't find the limit for resource {resource}"
-        self.resource = resource
-        super().__init__(msg)
+        limit: _limit.Limit | _registered_limit.RegisteredLimit
+        try:
+            if registered:
+                with _keystone_request(self.metrics, 'get_registered_limit'):
+                    limit = self.connection.get_registered_limit(limit_id)
+            else:
+                with _keystone_request(self.metrics, 'get_limit'):
+                    limit = self.connection.get_limit(limit_id)
+        except os_exceptions.ResourceNotFound:
+            # It was deleted since, which is notified too
+            return None
 
+        if (limit.service_id, limit.region_id) != (
+            self._service_id,
+            self._region_id,
+        ):
+            return None
+        if registered:
+            return _REGISTERED_LIMITS
+        return limit.project_id  # type: ignore
 
-class _EnforcerUtils:
-    """Logic common used by multiple enforcers"""
+    def warm_cache(self) -> None:
+        """Load all the limits of the endpoint into the cache
 
-    def __init__(self, cache: bool = True) -> None:
-        self.connection = _get_keystone_connection()
-        self.should_cache = cache
-        # {project_id: {resource_name: project_limit}}
-        self.plimit_cache: dict[str, dict[str, _limit.Limit]] = defaultdict(
-            dict
+        The registered limits and the project limits of every project are
+        listed at once, rather than one project at a time as they are looked
+        up. Projects which are not found then have no project limits, until
+        the cached limits expire.
+        """
+        if not self.should_cache:
+            return
+
+        try:
+            self._load_registered_limits()
+        except _LimitsUnavailable as e:
+            raise e.error
+        self._load_all_project_limits()
+
+    def _load_all_project_limits(
+        self, fresh_for: float = 0
+    ) -> dict[str, dict[str, int]]:
+        # Projects evicted while loading would otherwise look like they have
+        # no project limits.
+        evictions = self.plimit_cache.evictions
+
+        expiration_time: float | None = None
+        shared = self._get_shared(_PROJECT_LIMITS, fresh_for)
+        if shared is not None:
+            expiration_time, value = shared
+            all_project_limits = {
+                project_id: _intern_limits(project_limits)
+                for project_id, project_limits in value.items()
+            }
+        else:
+            expiration_time = self._plimit_snapshot_expiration_time
+            all_project_limits, limit_owners = self._fetch_all_project_limits()
+            self._own_limits(limit_owners)
+            self._set_shared(
+                _PROJECT_LIMITS,
+                all_project_limits,
+                expiration_time,
+                limit_owners,
+            )
+
+        expires_at = None
+        if expiration_time:
+            expires_at = time.monotonic() + expiration_time
+
+        # Lookups must not rely on the previous snapshot while the cache is
+        # being replaced. Limits from the shared cache expire with it.
+        self._plimit_snapshot = None
+        self.plimit_cache.clear()
+        for project_id, project_limits in all_project_limits.items():
+            self.plimit_cache.set(
+                project_id,
+                project_limits,
+                expiration_time=expiration_time if shared else None,
+            )
+        self._plimit_snapshot = (expires_at, evictions)
+
+        LOG.debug(
+            "Cached the limits of %(count)d projects for %(service)s in "
+            "region %(region)s.",
+            {
+                "count": len(all_project_limits),
+                "service": self._service_id,
+                "region": self._region_id,
+            },
         )
-        # {resource_name: registered_limit}
-        self.rlimit_cache: dict[str, _registered_limit.RegisteredLimit] = {}
+        return all_project_limits
+
+    def _fetch_all_project_limits(
+        self,
+    ) -> tuple[dict[str, dict[str, int]], dict[str, str]]:
+        # Get the limits of all projects from keystone at once, and the
+        # project of each limit.
+        with _keystone_request(self.metrics, 'limits'):
+            limits = list(
+                self.connection.limits(
+                    service_id=self._service_id, region_id=self._region_id
+                )
+            )
+        all_project_limits: dict[str, dict[str, int]] = defaultdict(dict)
+        limit_owners = {}
+        for pl in limits:
+            all_project_limits[pl.project_id].setdefault(
+                sys.intern(pl.resource_name), int(pl.resource_limit)
+            )
+            limit_owners[pl.id] = pl.project_id
+        return all_project_limits, limit_owners
 
-        self._endpoint: _endpoint.Endpoint = self._get_endpoint()
-        self._service_id: str = self._endpoint.service_id
-        self._region_id: str = self._endpoint.region_id
+    def _has_all_project_limits(self) -> bool:
+        # Whether plimit_cache holds every project with project limits.
+        if self._plimit_snapshot is None:
+            return False
 
-    def _get_endpoint(self) -> _endpoint.Endpoint:
+        expires_at, evictions = self._plimit_snapshot
+        if evictions != self.plimit_cache.evictions or (
+            expires_at is not None and expires_at <= time.monotonic()
+        ):
+            self._plimit_snapshot = None
+            return False
+
+        return True
+
+    def _discover_endpoint(self) -> tuple['_endpoint.Endpoint', bool]:
+        """Get the endpoint from the discovery snapshot, or keystone.
+
+        :returns: the endpoint, and whether it is that of the snapshot, which
+                  must be checked against keystone.
+        """
+        from openstack.identity.v3 import endpoint as _endpoint
+
+        attrs = _read_discovery_snapshot('endpoint')
+        if isinstance(attrs, dict):
+            return _endpoint.Endpoint(**attrs), True
+
+        endpoint = self._get_endpoint()
+        _write_discovery_snapshot('endpoint', _endpoint_attrs(endpoint))
+        return endpoint, False
+
+    def _verify_endpoint(self, endpoint: '_endpoint.Endpoint') -> None:
+        """Check that the endpoint of the snapshot is current."""
+        current = self._get_endpoint()
+        _write_discovery_snapshot('endpoint', _endpoint_attrs(current))
+        if (current.service_id, current.region_id) != (
+            endpoint.service_id,
+            endpoint.region_id,
+        ):
+            LOG.warning(
+                "The service or region of the endpoint changed since it was "
+                "saved in the discovery snapshot, dropping cached limits."
+            )
+            self._endpoint = current
+            self._service_id = current.service_id
+            self._region_id = current.region_id
+            self._plimit_snapshot = None
+            self.plimit_cache.clear()
+            self.rlimit_cache.clear()
+
+    def _get_endpoint(self) -> '_endpoint.Endpoint':
         endpoint = self._get_endpoint_by_id()
         if endpoint is not None:
             return endpoint
 
         return self._get_endpoint_by_service_lookup()
 
-    def _get_endpoint_by_id(self) -> _endpoint.Endpoint | None:
+    def _get_endpoint_by_id(self) -> '_endpoint.Endpoint | None':
+        from openstack import exceptions as os_exceptions
+
         endpoint_id = CONF.oslo_limit.endpoint_id
         if endpoint_id is None:
             return None
@@ -365,7 +3167,9 @@ class _EnforcerUtils:
         except os_exceptions.ResourceNotFound:
             raise ValueError(f"Can't find endpoint for {endpoint_id}")
 
-    def _get_endpoint_by_service_lookup(self) -> _endpoint.Endpoint:
+    def _get_endpoint_by_service_lookup(self) -> '_endpoint.Endpoint':
+        from openstack import exceptions as os_exceptions
+
         service_type = CONF.oslo_limit.endpoint_service_type
         service_name = CONF.oslo_limit.endpoint_service_name
 
@@ -469,18 +3273,178 @@ class _EnforcerUtils:
             LOG.debug("hit limit for project: %s", over_limit_list)
             raise exception.ProjectOverLimit(project_id, over_limit_list)
 
-    def _get_registered_limits(self) -> list[tuple[str, int]]:
-        registered_limits = []
-        reg_limits = self.connection.registered_limits(
-            service_id=self._service_id, region_id=self._region_id
+    def _get_executor(self) -> futures.ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = futures.ThreadPoolExecutor(
+                    max_workers=_KEYSTONE_WORKERS,
+                    thread_name_prefix='oslo-limit-keystone',
+                )
+            return self._executor
+
+    def _call_keystone(
+        self,
+        calls: _SingleFlight[_T],
+        key: Hashable,
+        func: Callable[[], _T],
+    ) -> _T:
+        """Call keystone, waiting for at most keystone_timeout seconds
+
+        The wait is also bounded by what is left of keystone_enforce_budget
+        for the check being made. A call which takes longer goes on in the
+        background, so that the limits it fetches are cached once it
+        completes.
+
+        :raises exception.KeystoneUnavailable: if the circuit breaker is open
+        :raises TimeoutError: if the call takes longer than keystone_timeout
+        """
+        timeout = self._keystone_timeout or None
+        deadline = _KEYSTONE_DEADLINE.get()
+        if deadline is not None:
+            time_left = deadline - time.monotonic()
+            if time_left <= 0:
+                raise TimeoutError('the keystone budget of the check is spent')
+            timeout = time_left if timeout is None else min(timeout, time_left)
+
+        self.breaker.check()
+        if timeout is None:
+            return calls.do(key, lambda: self.breaker.call(func))
+
+        # The call is made in the context of the check, so that its spans
+        # are part of the trace of the check, but not bound by its budget
+        # since it goes on once the check stops waiting for it.
+        context = contextvars.copy_context()
+        context.run(_KEYSTONE_DEADLINE.set, None)
+        call = calls.submit(
+            key,
+            lambda: context.run(func),
+            self._get_executor(),
+            on_submit=self.breaker.watch,
         )
-        for reg_limit in reg_limits:
-            name, limit = reg_limit.resource_name, reg_limit.default_limit
-            registered_limits.append((name, limit))
-            if self.should_cache:
-                self.rlimit_cache[name] = reg_limit
+        try:
+            return call.result(timeout=timeout)
+        except futures.TimeoutError:
+            self.breaker.record_timeout(call)
+            raise
+
+    def _revalidate(
+        self,
+        calls: _SingleFlight[_T],
+        key: Hashable,
+        func: Callable[[], _T],
+    ) -> None:
+        """Fetch expired limits again in the background"""
+        try:
+            self.breaker.check()
+        except exception.KeystoneUnavailable:
+            return
+
+        call = calls.submit(
+            key, func, self._get_executor(), on_submit=self.breaker.watch
+        )
+        call.add_done_callback(_log_revalidation_failure)
+
+    def _limits_unavailable(self, error: Exception, registered: bool) -> None:
+        """Apply keystone_unavailable_policy to limits which can't be fetched
+
+        :raises _LimitsUnavailable: when the policy gives the limits a value
+        """
+        LOG.warning(
+            "Unable to get %(limits)s limits from keystone, applying the "
+            "%(policy)s policy: %(error)s",
+            {
+                "limits": "registered" if registered else "project",
+                "policy": self._unavailable_policy,
+                "error": error or type(error).__name__,
+            },
+        )
+        if self._unavailable_policy == 'fail-open':
+            raise _LimitsUnavailable(error, -1) from error
+        if self._unavailable_policy == 'fail-closed':
+            raise _LimitsUnavailable(error, 0) from error
+        # Projects have no project limits with registered-defaults, while the
+        # registered limits have no default.
+        if registered or self._unavailable_policy == 'raise':
+            raise error
+
+    def _get_cached_registered_limits(self) -> dict[str, int] | None:
+        registered_limits = self.rlimit_cache.get(_REGISTERED_LIMITS)
+        if registered_limits is None and self._stale_while_revalidate:
+            registered_limits = self.rlimit_cache.get_stale(_REGISTERED_LIMITS)
+            if registered_limits is not None:
+                self._revalidate(
+                    self._rlimit_calls,
+                    _REGISTERED_LIMITS,
+                    self._fetch_registered_limits,
+                )
+        return registered_limits
+
+    def _load_registered_limits(self, fresh_for: float = 0) -> dict[str, int]:
+        _LIMITS_LOADED.set(True)
+        try:
+            return self._call_keystone(
+                self._rlimit_calls,
+                _REGISTERED_LIMITS,
+                lambda: self._fetch_registered_limits(fresh_for),
+            )
+        except Exception as e:
+            if self._unavailable_policy == 'raise':
+                raise
+            registered_limits = self.rlimit_cache.get_stale(_REGISTERED_LIMITS)
+            if registered_limits is not None:
+                LOG.warning(
+                    "Unable to get registered limits from keystone, using "
+                    "the last known ones: %s",
+                    e or type(e).__name__,
+                )
+                return registered_limits
+            self._limits_unavailable(e, registered=True)
+            raise  # unreachable, for type checking
+
+    def _fetch_registered_limits(self, fresh_for: float = 0) -> dict[str, int]:
+        shared = self._get_shared(_REGISTERED_LIMITS, fresh_for)
+        if shared is not None:
+            expires_in, value = shared
+            registered_limits = _intern_limits(value)
+            self.rlimit_cache.set(
+                _REGISTERED_LIMITS, registered_limits, expires_in
+            )
+            return registered_limits
+
+        # Get the limits from keystone.
+        with _keystone_request(self.metrics, 'registered_limits'):
+            reg_limits = list(
+                self.connection.registered_limits(
+                    service_id=self._service_id, region_id=self._region_id
+                )
+            )
+        registered_limits = {
+            sys.intern(rl.resource_name): int(rl.default_limit)
+            for rl in reg_limits
+        }
+
+        # Cache the limits if configured. This is a complete snapshot of the
+        # registered limits, so a resource missing from it has none.
+        if self.should_cache:
+            limit_owners = {rl.id: _REGISTERED_LIMITS for rl in reg_limits}
+            self._own_limits(limit_owners, [_REGISTERED_LIMITS])
+            self.rlimit_cache.set(_REGISTERED_LIMITS, registered_limits)
+            self._set_shared(
+                _REGISTERED_LIMITS,
+                registered_limits,
+                self.rlimit_cache.expiration_time,
+                limit_owners,
+            )
+
         return registered_limits
 
+    def _get_registered_limits(self) -> list[tuple[str, int]]:
+        registered_limits = self._get_cached_registered_limits()
+        if registered_limits is None:
+            registered_limits = self._load_registered_limits()
+
+        return list(registered_limits.items())
+
     def get_registered_limits(
         self, resource_names: Collection[str] | None
     ) -> list[tuple[str, int]]:
@@ -489,36 +3453,127 @@ class _EnforcerUtils:
         :param resource_names: list of resource_name strings
         :return: list of (resource_name, limit) pairs
         """
-        # If None was passed for resource_names, get and return all of the
-        # registered limits.
-        if resource_names is None:
-            return self._get_registered_limits()
+        try:
+            # If None was passed for resource_names, get and return all of
+            # the registered limits.
+            if resource_names is None:
+                return self._get_registered_limits()
+
+            # Using a list to preserve the resource_name order
+            registered_limits = []
+            for resource_name in resource_names:
+                limit = self._get_registered_limit(resource_name)
+                if limit is None:
+                    limit = 0
+                registered_limits.append((resource_name, limit))
+
+            return registered_limits
+        except _LimitsUnavailable as e:
+            if resource_names is None:
+                raise e.error
+            return [
+                (resource_name, e.limit) for resource_name in resource_names
+            ]
+
+    def _get_cached_project_limits(
+        self, project_id: str
+    ) -> dict[str, int] | None:
+        project_limits = self.plimit_cache.get(project_id)
+        if project_limits is None and self._stale_while_revalidate:
+            project_limits = self.plimit_cache.get_stale(project_id)
+            if project_limits is not None:
+                self._revalidate(
+                    self._plimit_calls,
+                    project_id,
+                    lambda: self._fetch_project_limits(project_id),
+                )
+        return project_limits
 
-        # Using a list to preserve the resource_name order
-        registered_limits = []
-        for resource_name in resource_names:
-            reg_limit = self._get_registered_limit(resource_name)
-            if reg_limit:
-                limit = reg_limit.default_limit
+    def _load_project_limits(
+        self, project_id: str, fresh_for: float = 0
+    ) -> dict[str, int]:
+        _LIMITS_LOADED.set(True)
+        try:
+            return self._call_keystone(
+                self._plimit_calls,
+                project_id,
+                lambda: self._fetch_project_limits(project_id, fresh_for),
+            )
+        except Exception as e:
+            if self._unavailable_policy == 'raise':
+                raise
+            return self._project_limits_unavailable(project_id, e)
+
+    def _project_limits_unavailable(
+        self, project_id: str, error: Exception
+    ) -> dict[str, int]:
+        project_limits = self.plimit_cache.get_stale(project_id)
+        if project_limits is not None:
+            LOG.warning(
+                "Unable to get the project limits of %(project)s from "
+                "keystone, using the last known ones: %(error)s",
+                {
+                    "project": project_id,
+                    "error": error or type(error).__name__,
+                },
+            )
+            return project_limits
+
+        self._limits_unavailable(error, registered=False)
+        return {}
+
+    def _fetch_project_limits(
+        self, project_id: str, fresh_for: float = 0
+    ) -> dict[str, int]:
+        shared_name = f'{_PROJECT_LIMITS}:{project_id}'
+        shared = self._get_shared(shared_name, fresh_for)
+        if shared is not None:
+            expires_in, value = shared
+            shared_limits = _intern_limits(value)
+            self.plimit_cache.set(project_id, shared_limits, expires_in)
+            return shared_limits
+
+        # Get the limits from keystone.
+        with _keystone_request(self.metrics, 'limits'):
+            limits = list(
+                self.connection.limits(
+                    service_id=self._service_id,
+                    region_id=self._region_id,
+                    project_id=project_id,
+                )
+            )
+        project_limits: dict[str, int] = {}
+        limit_owners = {}
+        for pl in limits:
+            # NOTE(melwitt): If project_id None was passed in, it's possible
+            # there will be multiple limits for the same resource (from various
+            # projects), so keep the existing oslo.limit behavior and return
+            # the first one we find. This could be considered to be a bug.
+            project_limits.setdefault(
+                sys.intern(pl.resource_name), int(pl.resource_limit)
+            )
+            limit_owners[pl.id] = project_id
+
+        # Cache the limits if configured. Most projects have no limits of their
+        # own, so cache that too in order to avoid querying keystone for them
+        # on every lookup.
+        if self.should_cache:
+            if project_limits:
+                expiration_time = self.plimit_cache.expiration_time
             else:
-                limit = 0
-            registered_limits.append((resource_name, limit))
+                expiration_time = self._negative_expiration_time
+            self._own_limits(limit_owners, [project_id])
+            self.plimit_cache.set(
+                project_id, project_limits, expiration_time=expiration_time
+            )
+            self._set_shared(
+                shared_name, project_limits, expiration_time, limit_owners
+            )
 
-        return registered_limits
+        return project_limits
 
     def _get_project_limits(self, project_id: str) -> list[tuple[str, int]]:
-        project_limits = []
-        proj_limits = self.connection.limits(
-            service_id=self._service_id,
-            region_id=self._region_id,
-            project_id=project_id,
-        )
-        for proj_limit in proj_limits:
-            name, limit = proj_limit.resource_name, proj_limit.resource_limit
-            project_limits.append((name, limit))
-            if self.should_cache:
-                self.plimit_cache[project_id][name] = proj_limit
-        return project_limits
+        return list(self._load_project_limits(project_id).items())
 
     def get_project_limits(
         self, project_id: str | None, resource_names: Collection[str] | None
@@ -542,7 +3597,10 @@ class _EnforcerUtils:
                 # format of the other methods.
                 raise ValueError('project_id must not be None')
 
-            return self._get_project_limits(project_id)
+            try:
+                return self._get_project_limits(project_id)
+            except _LimitsUnavailable as e:
+                raise e.error
 
         # Using a list to preserver the resource_name order
         project_limits = []
@@ -551,11 +3609,171 @@ class _EnforcerUtils:
                 limit = self._get_limit(project_id, resource_name)
             except _LimitNotFound:
                 limit = 0
+            except _LimitsUnavailable as e:
+                # Only this limit is unavailable, the others may be cached
+                limit = e.limit
             project_limits.append((resource_name, limit))
 
         return project_limits
 
+    def get_projects_limits(
+        self,
+        project_ids: Collection[str | None],
+        resource_names: Collection[str],
+    ) -> dict[str | None, list[tuple[str, int]]]:
+        """Get all the limits for several projects and a resource_name list
+
+        The project limits of the projects which are not cached are looked up
+        together where there are enough of them, by listing the project
+        limits of all projects at once.
+
+        If a limit is not found, it will be considered to be zero
+        (i.e. no quota)
+
+        :param project_ids: projects being checked, or None
+        :param resource_names: list of resource_name strings
+        :return: dict of project_id to list of (resource_name,limit) pairs
+        """
+        # The policy for unavailable limits applies to the limits which are
+        # unavailable only, not to the other limits of the batch.
+        registered_unavailable: int | None = None
+        try:
+            registered_limits = self._get_cached_registered_limits()
+            if registered_limits is None:
+                registered_limits = self._load_registered_limits()
+        except _LimitsUnavailable as e:
+            registered_limits = {}
+            registered_unavailable = e.limit
+        all_project_limits, unavailable = self._get_all_project_limits(
+            project_ids
+        )
+
+        for resource_name in resource_names:
+            if (
+                registered_unavailable is None
+                and resource_name not in registered_limits
+            ):
+                LOG.error(
+                    "Unable to find registered limit for resource "
+                    "%(resource)s for %(service)s in region %(region)s.",
+                    {
+                        "resource": resource_name,
+                        "service": self._service_id,
+                        "region": self._region_id,
+                    },
+                )
+
+        limits: dict[str | None, list[tuple[str, int]]] = {}
+        for project_id in project_ids:
+            if project_id in unavailable:
+                unavailable_limit = unavailable[project_id]
+                limits[project_id] = [
+                    (resource_name, unavailable_limit)
+                    for resource_name in resource_names
+                ]
+                continue
+
+            project_limits = (
+                all_project_limits[project_id]
+                if project_id is not None
+                else {}
+            )
+            project_limit_list = []
+            for resource_name in resource_names:
+                limit = project_limits.get(resource_name)
+                if limit is None:
+                    if registered_unavailable is not None:
+                        limit = registered_unavailable
+                    else:
+                        limit = registered_limits.get(resource_name, 0)
+                project_limit_list.append((resource_name, limit))
+            limits[project_id] = project_limit_list
+
+        return limits
+
+    def _get_all_project_limits(
+        self, project_ids: Collection[str | None]
+    ) -> tuple[dict[str, dict[str, int]], dict[str | None, int]]:
+        """Get the project limits of several projects
+
+        :return: the project limits of each project, and the value given by
+                 the policy for unavailable limits to each project whose
+                 limits are unavailable.
+        """
+        all_project_limits = {}
+        unavailable: dict[str | None, int] = {}
+        missing = []
+        for project_id in set(project_ids):
+            if project_id is None:
+                continue
+            project_limits = self._get_cached_project_limits(project_id)
+            if project_limits is not None:
+                all_project_limits[project_id] = project_limits
+            elif self._has_all_project_limits():
+                all_project_limits[project_id] = {}
+            else:
+                missing.append(project_id)
+
+        if len(missing) < CONF.oslo_limit.bulk_fetch_threshold:
+            for project_id in missing:
+                try:
+                    all_project_limits[project_id] = self._load_project_limits(
+                        project_id
+                    )
+                except _LimitsUnavailable as e:
+                    unavailable[project_id] = e.limit
+        else:
+            fetch: Callable[[], dict[str, dict[str, int]]]
+            if self.should_cache:
+                fetch = self._load_all_project_limits
+            else:
+
+                def fetch() -> dict[str, dict[str, int]]:
+                    return self._fetch_all_project_limits()[0]
+
+            try:
+                loaded = self._call_keystone(
+                    self._all_plimit_calls, _PROJECT_LIMITS, fetch
+                )
+            except Exception as e:
+                if self._unavailable_policy == 'raise':
+                    raise
+                for project_id in missing:
+                    try:
+                        all_project_limits[project_id] = (
+                            self._project_limits_unavailable(project_id, e)
+                        )
+                    except _LimitsUnavailable as unavailable_error:
+                        unavailable[project_id] = unavailable_error.limit
+                return all_project_limits, unavailable
+
+            for project_id in missing:
+                all_project_limits[project_id] = loaded.get(project_id, {})
+
+        return all_project_limits, unavailable
+
     def _get_limit(self, project_id: str | None, resource_name: str) -> int:
+        with tracing.get_tracer().start_as_current_span(
+            'oslo_limit.get_limit'
+        ) as span:
+            if not span.is_recording():
+                return self._lookup_limit(project_id, resource_name)
+
+            tracing._set_attributes(
+                span, project_id=project_id, resource=resource_name
+            )
+            token = _LIMITS_LOADED.set(False)
+            try:
+                limit = self._lookup_limit(project_id, resource_name)
+                span.set_attribute('oslo_limit.limit', limit)
+            finally:
+                span.set_attribute(
+                    'oslo_limit.cache_hit', not _LIMITS_LOADED.get()
+                )
+                _LIMITS_LOADED.reset(token)
+        return limit
+
+    def _lookup_limit(self, project_id: str | None, resource_name: str) -> int:
         # If we are configured to cache limits, look in the cache first and use
         # the cached value if there is one. Else, retrieve the limit and add it
         # to the cache. Do this for both project limits and registered limits.
@@ -567,14 +3785,14 @@ class _EnforcerUtils:
             else None
         )
 
-        if project_limit:
-            return cast(int, project_limit.resource_limit)
+        if project_limit is not None:
+            return project_limit
 
         # If there is no project limit, look for a registered limit.
         registered_limit = self._get_registered_limit(resource_name)
 
-        if registered_limit:
-            return cast(int, registered_limit.default_limit)
+        if registered_limit is not None:
+            return registered_limit
 
         LOG.error(
             "Unable to find registered limit for resource "
@@ -590,50 +3808,21 @@ class _EnforcerUtils:
 
     def _get_project_limit(
         self, project_id: str, resource_name: str
-    ) -> _limit.Limit | None:
-        # Look in the cache first.
-        if (
-            project_id in self.plimit_cache
-            and resource_name in self.plimit_cache[project_id]
-        ):
-            return self.plimit_cache[project_id][resource_name]
-
-        # Get the limits from keystone.
-        limits = self.connection.limits(
-            service_id=self._service_id,
-            region_id=self._region_id,
-            project_id=project_id,
-        )
-        limit = None
-        for pl in limits:
-            # NOTE(melwitt): If project_id None was passed in, it's possible
-            # there will be multiple limits for the same resource (from various
-            # projects), so keep the existing oslo.limit behavior and return
-            # the first one we find. This could be considered to be a bug.
-            if limit is None and pl.resource_name == resource_name:
-                limit = pl
-            if self.should_cache:
-                self.plimit_cache[project_id][pl.resource_name] = pl
-
-        return limit
-
-    def _get_registered_limit(
-        self, resource_name: str
-    ) -> _registered_limit.RegisteredLimit | None:
+    ) -> int | None:
+        # Look in the cache first. A cached project holds all of its project
+        # limits, so there is no project limit for resources missing from it.
+        project_limits = self._get_cached_project_limits(project_id)
+        if project_limits is None:
+            if self._has_all_project_limits():
+                return None
+            project_limits = self._load_project_limits(project_id)
+
+        return project_limits.get(resource_name)
+
+    def _get_registered_limit(self, resource_name: str) -> int | None:
         # Look in the cache first.
-        if resource_name in self.rlimit_cache:
-            return self.rlimit_cache[resource_name]
-
-        # Get the limits from keystone.
-        reg_limits = self.connection.registered_limits(
-            service_id=self._service_id, region_id=self._region_id
-        )
-        reg_limit = None
-        for rl in reg_limits:
-            if rl.resource_name == resource_name:
-                reg_limit = rl
-            # Cache the limit if configured.
-            if self.should_cache:
-                self.rlimit_cache[rl.resource_name] = rl
+        registered_limits = self._get_cached_registered_limits()
+        if registered_limits is None:
+            registered_limits = self._load_registered_limits()
 
-        return reg_limit
+        return registered_limits.get(resource_name)
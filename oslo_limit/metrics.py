@@ -0,0 +1,204 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Metrics of enforcers
+
+Enforcers report what they do to a Metrics object given when they are
+created, which discards everything by default. The metrics are:
+
+``enforce.duration`` (timing)
+    Time spent by a check, with a ``phase`` tag: ``limits`` to look up the
+    limits, ``usage`` to count usage with the usage callbacks, ``check`` to
+    compare usage to the limits, and ``total`` for the whole check.
+``keystone.duration`` (timing)
+    Time spent by a request to keystone, with a ``request`` tag naming the
+    request, such as ``limits`` or ``registered_limits``.
+``keystone.requests`` (counter)
+    Requests made to keystone, with ``request`` and ``result`` tags, the
+    latter being ``success`` or ``failure``.
+``cache.hits``, ``cache.misses``, ``cache.evictions`` (counters)
+    Lookups of a cache, with a ``cache`` tag naming it as
+    ``Enforcer.get_cache_stats()`` does.
+``over_limit`` (counter)
+    Resources found over limit by checks, with a ``resource`` tag.
+"""
+
+from collections.abc import Iterator
+import contextlib
+import threading
+import time
+from typing import Any
+import weakref
+
+__all__ = [
+    'Metrics',
+    'PrometheusMetrics',
+    'StatsdMetrics',
+]
+
+
+# The collectors of PrometheusMetrics, shared by those with the same registry
+# since a registry rejects a second collector with the same name.
+# {registry: {(name, label names): metric}}
+_PROMETHEUS_METRICS: 'weakref.WeakKeyDictionary[Any, dict[Any, Any]]' = (
+    weakref.WeakKeyDictionary()
+)
+_PROMETHEUS_LOCK = threading.Lock()
+
+# The timer of metrics which discard timings, which saves timing blocks
+_NULL_TIMER = contextlib.nullcontext()
+
+
+class Metrics:
+    """Receive the metrics of enforcers
+
+    This discards them, and is subclassed to send them somewhere. Blocks are
+    only timed by timer() in subclasses which override timing(). Enforcers
+    log failures to report metrics rather than fail checks.
+    """
+
+    def increment(
+        self, name: str, value: int = 1, tags: dict[str, str] | None = None
+    ) -> None:
+        """Add value to a counter."""
+
+    def timing(
+        self, name: str, seconds: float, tags: dict[str, str] | None = None
+    ) -> None:
+        """Record a duration, as an observation of a histogram."""
+
+    def timer(
+        self, name: str, tags: dict[str, str] | None = None
+    ) -> contextlib.AbstractContextManager[None]:
+        """Record the duration of a block, even if it raises."""
+        if not self._records_timings():
+            return _NULL_TIMER
+        return self._timer(name, tags)
+
+    def _records_timings(self) -> bool:
+        """Whether timings are recorded rather than discarded."""
+        return type(self).timing is not Metrics.timing
+
+    @contextlib.contextmanager
+    def _timer(
+        self, name: str, tags: dict[str, str] | None = None
+    ) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timing(name, time.perf_counter() - start, tags)
+
+
+class StatsdMetrics(Metrics):
+    """Send metrics to statsd
+
+    The values of tags are appended to the names of metrics, in the order of
+    the tags, since statsd has no tags. For instance, the duration of the
+    usage phase of checks is sent as ``oslo_limit.enforce.duration.usage``.
+
+    :param client: a statsd client, such as a ``statsd.StatsClient``, with
+                   ``incr(stat, count)`` and ``timing(stat, milliseconds)``
+                   methods.
+    :param prefix: the prefix of the names of metrics.
+    """
+
+    def __init__(self, client: Any, prefix: str = 'oslo_limit') -> None:
+        self.client = client
+        self.prefix = prefix
+
+    def _stat(self, name: str, tags: dict[str, str] | None) -> str:
+        parts = [self.prefix, name] if self.prefix else [name]
+        if tags:
+            # statsd separates the parts of names with dots
+            parts.extend(value.replace('.', '_') for value in tags.values())
+        return '.'.join(parts)
+
+    def increment(
+        self, name: str, value: int = 1, tags: dict[str, str] | None = None
+    ) -> None:
+        self.client.incr(self._stat(name, tags), value)
+
+    def timing(
+        self, name: str, seconds: float, tags: dict[str, str] | None = None
+    ) -> None:
+        self.client.timing(self._stat(name, tags), seconds * 1000)
+
+
+class PrometheusMetrics(Metrics):
+    """Record metrics with prometheus_client
+
+    Timings are histograms, in seconds, and counters have a ``_total``
+    suffix, as usual with Prometheus. Dots in the names of metrics become
+    underscores, so the durations of checks are the
+    ``oslo_limit_enforce_duration_seconds`` histogram, with a ``phase``
+    label. Instances with the same registry share their metrics, so that
+    several enforcers can report to the same registry.
+
+    :param registry: the registry of the metrics. Defaults to the default
+                     registry of prometheus_client.
+    :param namespace: the prefix of the names of metrics.
+    """
+
+    def __init__(
+        self, registry: Any = None, namespace: str = 'oslo_limit'
+    ) -> None:
+        import prometheus_client
+
+        self._prometheus_client = prometheus_client
+        if registry is None:
+            registry = prometheus_client.REGISTRY
+        self.registry = registry
+        self.namespace = namespace
+        with _PROMETHEUS_LOCK:
+            # {(namespace, name, label names): metric}
+            self._metrics = _PROMETHEUS_METRICS.setdefault(registry, {})
+
+    def _get_metric(
+        self,
+        kind: Any,
+        name: str,
+        tags: dict[str, str] | None,
+        unit: str = '',
+    ) -> Any:
+        labels = tuple(tags) if tags else ()
+        key = (self.namespace, name, labels)
+        metric = self._metrics.get(key)
+        if metric is None:
+            with _PROMETHEUS_LOCK:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = self._metrics[key] = kind(
+                        name.replace('.', '_'),
+                        f'oslo.limit {name}',
+                        labels,
+                        namespace=self.namespace,
+                        unit=unit,
+                        registry=self.registry,
+                    )
+        if tags:
+            return metric.labels(**tags)
+        return metric
+
+    def increment(
+        self, name: str, value: int = 1, tags: dict[str, str] | None = None
+    ) -> None:
+        counter = self._get_metric(self._prometheus_client.Counter, name, tags)
+        counter.inc(value)
+
+    def timing(
+        self, name: str, seconds: float, tags: dict[str, str] | None = None
+    ) -> None:
+        histogram = self._get_metric(
+            self._prometheus_client.Histogram, name, tags, unit='seconds'
+        )
+        histogram.observe(seconds)
@@ -0,0 +1,142 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Evict cached limits when keystone notifies that limits changed
+
+Keystone sends notifications when limits and registered limits are created,
+updated or deleted, in the basic or the CADF format. A listener consuming
+them from the notification transport of the service evicts the limits
+affected by each change from the cache of enforcers, so that limit changes
+apply right away, even with long cache expiration times.
+"""
+
+from collections.abc import Iterable
+import os
+import socket
+from typing import Any, TYPE_CHECKING
+
+from oslo_log import log
+
+if TYPE_CHECKING:
+    import oslo_messaging
+
+    from oslo_limit import limit
+
+__all__ = [
+    'LimitNotificationEndpoint',
+    'get_notification_listener',
+]
+
+LOG = log.getLogger(__name__)
+
+# {event_type: (registered, deleted)}
+_EVENT_TYPES = {
+    'identity.limit.created': (False, False),
+    'identity.limit.updated': (False, False),
+    'identity.limit.deleted': (False, True),
+    'identity.registered_limit.created': (True, False),
+    'identity.registered_limit.updated': (True, False),
+    'identity.registered_limit.deleted': (True, True),
+}
+
+
+def _get_limit_id(payload: Any) -> str | None:
+    if not isinstance(payload, dict):
+        return None
+
+    # Both formats have the id in resource_info, and CADF events have it as
+    # the id of their target too.
+    limit_id = payload.get('resource_info')
+    if limit_id is None:
+        target = payload.get('target')
+        if isinstance(target, dict):
+            limit_id = target.get('id')
+    return limit_id if isinstance(limit_id, str) else None
+
+
+class LimitNotificationEndpoint:
+    """An oslo.messaging notification endpoint for limit changes
+
+    :param enforcers: The enforcers whose cached limits are evicted.
+    """
+
+    def __init__(
+        self, *enforcers: 'limit.Enforcer | limit.AsyncEnforcer'
+    ) -> None:
+        self.enforcers = enforcers
+
+    def info(
+        self,
+        ctxt: dict[str, Any],
+        publisher_id: str,
+        event_type: str,
+        payload: Any,
+        metadata: dict[str, Any],
+    ) -> None:
+        event = _EVENT_TYPES.get(event_type)
+        if event is None:
+            return
+
+        limit_id = _get_limit_id(payload)
+        if limit_id is None:
+            LOG.warning(
+                "Ignoring %s notification without a limit id", event_type
+            )
+            return
+
+        registered, deleted = event
+        for enforcer in self.enforcers:
+            try:
+                enforcer.invalidate_limit(
+                    limit_id, registered=registered, deleted=deleted
+                )
+            except Exception:
+                # The limits expire from the cache eventually
+                LOG.exception(
+                    "Failed to evict the cached limits affected by %s of "
+                    "limit %s",
+                    event_type,
+                    limit_id,
+                )
+
+
+def get_notification_listener(
+    transport: 'oslo_messaging.Transport',
+    enforcers: Iterable['limit.Enforcer | limit.AsyncEnforcer'],
+    topics: Iterable[str] = ('notifications',),
+    pool: str | None = None,
+) -> 'oslo_messaging.MessageHandlingServer':
+    """Create a listener evicting cached limits when limits change
+
+    The listener must be started by the caller, and uses the threading
+    executor, as evicting limits may query keystone.
+
+    :param transport: The notification transport on which keystone sends
+                      notifications, as returned by
+                      oslo_messaging.get_notification_transport().
+    :param enforcers: The enforcers whose cached limits are evicted.
+    :param topics: The topics of the notifications of keystone. Defaults to
+                   keystone's default of 'notifications'.
+    :param pool: The pool of the listener. Each process must receive every
+                 notification, so this defaults to a pool of its own, named
+                 after the host and the process.
+    :returns: An oslo_messaging.MessageHandlingServer
+    """
+    import oslo_messaging
+
+    if pool is None:
+        pool = f'oslo_limit-{socket.gethostname()}-{os.getpid()}'
+    targets = [oslo_messaging.Target(topic=topic) for topic in topics]
+    endpoint = LimitNotificationEndpoint(*enforcers)
+    return oslo_messaging.get_notification_listener(
+        transport, targets, [endpoint], executor='threading', pool=pool
+    )
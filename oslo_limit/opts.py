@@ -52,6 +52,248 @@ _options = [
         ],
         help=_("The interface for endpoint discovery"),
     ),
+    cfg.IntOpt(
+        'cache_expiration_time',
+        default=0,
+        min=0,
+        help=_(
+            "Time in seconds for which limits cached by an enforcer remain "
+            "valid. A value of 0 means that cached limits never expire. "
+            "Only used by enforcers created with caching enabled."
+        ),
+    ),
+    cfg.IntOpt(
+        'cache_negative_expiration_time',
+        min=0,
+        help=_(
+            "Time in seconds for which an enforcer caches the fact that a "
+            "project has no project limits, so that the registered limits "
+            "apply to it. A value of 0 means that this is cached until the "
+            "enforcer is destroyed. Defaults to the value of "
+            "cache_expiration_time."
+        ),
+    ),
+    cfg.IntOpt(
+        'cache_max_projects',
+        default=0,
+        min=0,
+        help=_(
+            "Maximum number of projects for which an enforcer caches project "
+            "limits. Once reached, the limits of the least recently used "
+            "project are evicted from the cache. A value of 0 means that the "
+            "number of cached projects is not bounded."
+        ),
+    ),
+    cfg.BoolOpt(
+        'cache_prefetch',
+        default=False,
+        help=_(
+            "Load the registered limits and the project limits of every "
+            "project for the endpoint into the cache when an enforcer is "
+            "created, instead of loading the limits of each project when it "
+            "is first checked. When cached limits expire, they are all "
+            "reloaded at once by the background refresh if it is enabled."
+        ),
+    ),
+    cfg.BoolOpt(
+        'cache_keep_after_fork',
+        default=True,
+        help=_(
+            "Keep the limits cached by enforcers when the process is forked, "
+            "so that servers which create an enforcer and warm its cache "
+            "before forking their workers share the cached limits with them. "
+            "Otherwise, enforcers start with empty caches in forked "
+            "processes. The connection to keystone is never shared with "
+            "forked processes."
+        ),
+    ),
+    cfg.BoolOpt(
+        'cache_stale_while_revalidate',
+        default=False,
+        help=_(
+            "Use cached limits which expired while they are fetched again "
+            "from keystone in the background, so that checks do not wait "
+            "for keystone once limits were cached."
+        ),
+    ),
+    cfg.FloatOpt(
+        'keystone_timeout',
+        default=0,
+        min=0,
+        help=_(
+            "Maximum time in seconds for which a check waits for keystone to "
+            "return limits. Limits which keystone does not return in time are "
+            "considered unavailable, and are still cached once returned. A "
+            "value of 0 means that checks wait until the requests to keystone "
+            "time out."
+        ),
+    ),
+    cfg.FloatOpt(
+        'keystone_enforce_budget',
+        default=0,
+        min=0,
+        help=_(
+            "Maximum total time in seconds for which a check waits for "
+            "keystone, over all the requests it makes to look up limits. "
+            "Limits which are not returned within the budget are considered "
+            "unavailable. A value of 0 means that checks have no budget, and "
+            "only keystone_timeout applies to each request."
+        ),
+    ),
+    cfg.IntOpt(
+        'keystone_failure_threshold',
+        default=0,
+        min=0,
+        help=_(
+            "Number of requests to keystone in a row which fail or time out "
+            "after which an enforcer stops querying keystone for "
+            "keystone_recovery_time seconds, so that checks do not all wait "
+            "for a keystone which is down. Limits are then unavailable. A "
+            "value of 0 means that enforcers always query keystone."
+        ),
+    ),
+    cfg.FloatOpt(
+        'keystone_recovery_time',
+        default=30,
+        min=0,
+        help=_(
+            "Time in seconds for which an enforcer stops querying keystone "
+            "once keystone_failure_threshold is reached. A single request is "
+            "then made to check whether keystone is back, and enforcers query "
+            "keystone again if it succeeds."
+        ),
+    ),
+    cfg.StrOpt(
+        'keystone_unavailable_policy',
+        default='raise',
+        choices=[
+            ('raise', _('Raise the error of the request to keystone.')),
+            (
+                'fail-open',
+                _('Consider resources to be unlimited, so checks pass.'),
+            ),
+            (
+                'fail-closed',
+                _('Consider resources to have a limit of 0, so checks fail.'),
+            ),
+            (
+                'registered-defaults',
+                _(
+                    'Consider projects to have no project limits, so that '
+                    'registered limits apply to them. The error is raised '
+                    'if registered limits are unavailable too.'
+                ),
+            ),
+        ],
+        help=_(
+            "What to do when limits can't be fetched from keystone, because "
+            "it fails or does not return them within keystone_timeout. Except "
+            "with raise, the last known limits are used if they were cached, "
+            "even if they expired, and the policy only applies to limits "
+            "which were never cached."
+        ),
+    ),
+    cfg.IntOpt(
+        'bulk_fetch_threshold',
+        default=10,
+        min=1,
+        help=_(
+            "Minimum number of projects whose project limits are not cached "
+            "for the limits of several projects checked at once to be looked "
+            "up by listing the project limits of all projects, rather than "
+            "those of each project separately."
+        ),
+    ),
+    cfg.IntOpt(
+        'cache_refresh_interval',
+        default=0,
+        min=0,
+        help=_(
+            "Interval in seconds at which a background thread reloads cached "
+            "limits that are due to expire before the next run, so that they "
+            "are refreshed before requests find them expired. A value of 0 "
+            "disables the background refresh. Only used when "
+            "cache_expiration_time is set."
+        ),
+    ),
+    cfg.StrOpt(
+        'discovery_cache_file',
+        help=_(
+            "Path of a file in which enforcers save the enforcement model and "
+            "the endpoint they look up in keystone. Enforcers created later, "
+            "including by other processes of the service, use them rather "
+            "than waiting for keystone, and only check them against keystone "
+            "in the background. The directory of the file must be writable "
+            "by the service. Not used if unset."
+        ),
+    ),
+    cfg.IntOpt(
+        'discovery_cache_expiration_time',
+        default=86400,
+        min=0,
+        help=_(
+            "Time in seconds for which the enforcement model and the endpoint "
+            "saved in discovery_cache_file are used. A value of 0 means that "
+            "they are used until they are found to be outdated."
+        ),
+    ),
+    cfg.StrOpt(
+        'shared_cache_file',
+        help=_(
+            "Path of a file in which enforcers cache limits for all the "
+            "processes of the service on the host, so that limits are queried "
+            "from keystone once per host rather than once per process. Cached "
+            "limits expire as set by cache_expiration_time, which must be set "
+            "too since the file is kept when the service restarts. The "
+            "directory of the file must be writable by the service. Not used "
+            "if unset, or by enforcers given a shared cache by the service."
+        ),
+    ),
+    cfg.IntOpt(
+        'shared_cache_file_slots',
+        default=4096,
+        min=1,
+        help=_(
+            "Number of slots of shared_cache_file, each of which caches the "
+            "limits of a project or the registered limits. Only used when "
+            "the file is created."
+        ),
+    ),
+    cfg.IntOpt(
+        'shared_cache_file_slot_size',
+        default=16384,
+        min=64,
+        help=_(
+            "Size in bytes of each slot of shared_cache_file. Limits which do "
+            "not fit in a slot are not cached in the file, such as the limits "
+            "of all projects loaded with cache_prefetch when there are many "
+            "projects with limits. Only used when the file is created, so the "
+            "file must be removed for a new size to apply."
+        ),
+    ),
+    cfg.IntOpt(
+        'usage_cache_expiration_time',
+        default=0,
+        min=0,
+        help=_(
+            "Time in seconds for which an enforcer caches the usage returned "
+            "by the usage callback for each project and resource, so that "
+            "checks made in quick succession do not each count usage. A "
+            "value of 0 disables the usage cache. Services should keep this "
+            "short, and call invalidate_usage on the enforcer when usage "
+            "changes."
+        ),
+    ),
+    cfg.BoolOpt(
+        'usage_cache_apply_deltas',
+        default=False,
+        help=_(
+            "Add the deltas of a successful enforcement to the cached usage "
+            "of the project, for services which consume the resources they "
+            "enforce limits for. Only used when usage_cache_expiration_time "
+            "is set."
+        ),
+    ),
 ]
 
 _option_group = 'oslo_limit'
@@ -77,16 +319,26 @@ def list_opts() -> list[tuple[str, list[cfg.Opt]]]:
 
 
 def register_opts(conf: cfg.ConfigOpts) -> None:
-    loading.register_session_conf_options(CONF, _option_group)
-    loading.register_adapter_conf_options(
-        CONF, _option_group, include_deprecated=False
-    )
+    _register_base_opts(conf)
 
-    loading.register_auth_conf_options(CONF, _option_group)
     plugin_name = CONF.oslo_limit.auth_type
     if plugin_name:
         plugin_loader: loading.BaseLoader[Any]
         plugin_loader = loading.get_plugin_loader(plugin_name)
         plugin_opts = loading.get_auth_plugin_conf_options(plugin_loader)
         CONF.register_opts(plugin_opts, group=_option_group)
+
+
+def _register_base_opts(conf: cfg.ConfigOpts) -> None:
+    """Register the options of the library, except for the auth plugin.
+
+    Loading the auth plugin is slow, and its options are registered when it
+    is loaded to connect to keystone anyway.
+    """
+    loading.register_session_conf_options(CONF, _option_group)
+    loading.register_adapter_conf_options(
+        CONF, _option_group, include_deprecated=False
+    )
+
+    loading.register_auth_conf_options(CONF, _option_group)
     conf.register_opts(_options, group=_option_group)
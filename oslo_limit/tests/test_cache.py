@@ -0,0 +1,132 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+from typing import TYPE_CHECKING
+
+from dogpile.cache import region as dogpile_region
+import fixtures
+from oslotest import base
+
+from oslo_limit import cache
+
+if TYPE_CHECKING:
+    _TestCase = base.BaseTestCase
+else:
+    _TestCase = object
+
+
+class _SharedCacheTests(_TestCase):
+    def _create_cache(self) -> cache.SharedCache:
+        raise NotImplementedError()
+
+    def test_get_set_delete(self):
+        shared_cache = self._create_cache()
+
+        self.assertIsNone(shared_cache.get('key'))
+        shared_cache.set('key', b'value')
+        self.assertEqual(b'value', shared_cache.get('key'))
+        shared_cache.set('key', b'other value')
+        self.assertEqual(b'other value', shared_cache.get('key'))
+
+        shared_cache.delete('key')
+        self.assertIsNone(shared_cache.get('key'))
+        shared_cache.delete('key')
+
+
+class TestMemoryCache(_SharedCacheTests, base.BaseTestCase):
+    def _create_cache(self):
+        return cache.MemoryCache()
+
+
+class TestRegionCache(_SharedCacheTests, base.BaseTestCase):
+    def _create_cache(self):
+        region = dogpile_region.make_region().configure('dogpile.cache.memory')
+        return cache.RegionCache(region)
+
+
+class TestFileCache(_SharedCacheTests, base.BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'limits'
+        )
+
+    def _create_cache(self, slots=16, slot_size=64):
+        shared_cache = cache.FileCache(
+            self.path, slots=slots, slot_size=slot_size
+        )
+        self.addCleanup(shared_cache.close)
+        return shared_cache
+
+    def test_shared(self):
+        shared_cache = self._create_cache()
+        # The size of the file is kept from when it was created
+        other = self._create_cache(slots=32, slot_size=128)
+
+        self.assertEqual(16, other.slots)
+        self.assertEqual(64, other.slot_size)
+        self.assertEqual(16 + 16 * 64, os.path.getsize(self.path))
+
+        shared_cache.set('key', b'value')
+        self.assertEqual(b'value', other.get('key'))
+        other.delete('key')
+        self.assertIsNone(shared_cache.get('key'))
+
+    def test_slot_collision(self):
+        shared_cache = self._create_cache(slots=1)
+
+        shared_cache.set('key', b'value')
+        shared_cache.set('other key', b'other value')
+
+        self.assertIsNone(shared_cache.get('key'))
+        self.assertEqual(b'other value', shared_cache.get('other key'))
+        # Other keys in the slot are not deleted
+        shared_cache.delete('key')
+        self.assertEqual(b'other value', shared_cache.get('other key'))
+
+    def test_value_too_large(self):
+        shared_cache = self._create_cache()
+
+        shared_cache.set('key', b'value')
+        with self.assertLogs('oslo.limit.cache', 'DEBUG') as logs:
+            shared_cache.set('key', b'x' * 64)
+            shared_cache.set('key', b'x' * 64)
+
+        self.assertIsNone(shared_cache.get('key'))
+        # Only the first value too large is a warning
+        self.assertEqual(
+            ['WARNING', 'DEBUG'], [r.levelname for r in logs.records]
+        )
+        self.assertIn('needs 77 bytes', logs.records[0].getMessage())
+
+    def test_corrupted_slot(self):
+        shared_cache = self._create_cache(slots=1)
+        shared_cache.set('key', b'value')
+
+        with open(self.path, 'r+b') as f:
+            # Overwrite the first byte of the value
+            f.seek(16 + 10 + 3)
+            f.write(b'V')
+
+        self.assertIsNone(shared_cache.get('key'))
+
+    def test_not_a_cache_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'{"key": "value"}')
+
+        self.assertRaises(ValueError, cache.FileCache, self.path)
+
+    def test_invalid_size(self):
+        self.assertRaises(ValueError, cache.FileCache, self.path, slots=0)
+        self.assertRaises(ValueError, cache.FileCache, self.path, slot_size=10)
+        self.assertFalse(os.path.exists(self.path))
@@ -106,3 +106,50 @@ class TestFixture(base.BaseTestCase):
         # registered limit values
         self.assertEqual(50, u['sprockets'].limit)
         self.assertEqual(100, u['widgets'].limit)
+
+
+class TestFixtureHierarchy(base.BaseTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.config_fixture = self.useFixture(config_fixture.Config(CONF))
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_id='ENDPOINT_ID'
+        )
+        opts.register_opts(CONF)
+
+        reglimits = {'widgets': 100}
+        projlimits = {'project2': {'widgets': 10}}
+        hierarchy = {'project1': ['project2', 'project3']}
+        self.useFixture(fixture.LimitFixture(reglimits, projlimits, hierarchy))
+
+        self.usage = {
+            'project1': {'widgets': 50},
+            'project2': {'widgets': 5},
+            'project3': {'widgets': 40},
+        }
+
+        def proj_usage(project_id, resource_names):
+            return self.usage[project_id]
+
+        self.enforcer = limit.Enforcer(proj_usage)
+
+    def test_project_under_limits(self):
+        self.enforcer.enforce('project3', {'widgets': 5})
+
+    def test_project_over_parent_limit(self):
+        # The usage of the tree is 95 out of the 100 of project1
+        self.assertRaises(
+            exception.ProjectOverLimit,
+            self.enforcer.enforce,
+            'project3',
+            {'widgets': 6},
+        )
+
+    def test_project_over_own_limit(self):
+        self.assertRaises(
+            exception.ProjectOverLimit,
+            self.enforcer.enforce,
+            'project2',
+            {'widgets': 6},
+        )
@@ -16,11 +16,19 @@ test_limit
 Tests for `limit` module.
 """
 
+import asyncio
 from collections.abc import Iterable
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
 from typing import Any
 from unittest import mock
 import uuid
 
+import fixtures
 from openstack import exceptions as os_exceptions
 from openstack.identity.v3 import endpoint
 from openstack.identity.v3 import limit as klimit
@@ -30,7 +38,9 @@ from openstack.identity.v3 import service
 from oslo_config import cfg
 from oslo_config import fixture as config_fixture
 from oslotest import base
+import testtools
 
+from oslo_limit import cache as limit_cache
 from oslo_limit import exception
 from oslo_limit import fixture
 from oslo_limit import limit
@@ -39,6 +49,25 @@ from oslo_limit import opts
 CONF = cfg.CONF
 
 
+class TestImport(base.BaseTestCase):
+    def test_import_does_not_load_sdk(self):
+        # openstacksdk takes about as long to import as the rest of the
+        # dependencies together, so it is only imported when an enforcer
+        # first connects to keystone. Import in a new interpreter, as other
+        # tests have imported it in this one already.
+        code = (
+            'import sys\n'
+            'import oslo_limit.limit\n'
+            'print(sorted(m for m in sys.modules if m == "openstack" '
+            'or m.startswith("openstack.")))\n'
+        )
+        output = subprocess.check_output(
+            [sys.executable, '-c', code], text=True
+        )
+
+        self.assertEqual('[]', output.strip())
+
+
 class TestEnforcer(base.BaseTestCase):
     def setUp(self):
         super().setUp()
@@ -66,6 +95,12 @@ class TestEnforcer(base.BaseTestCase):
 
         for invalid_callback in invalid_callback_types:
             self.assertRaises(ValueError, limit.Enforcer, invalid_callback)
+            self.assertRaises(
+                ValueError,
+                limit.Enforcer,
+                self._get_usage_for_project,
+                batch_usage_callback=invalid_callback,
+            )
 
     def test_deltas_must_be_a_dictionary(self):
         project_id = uuid.uuid4().hex
@@ -142,11 +177,8 @@ class TestEnforcer(base.BaseTestCase):
         self, mock_get_reglimit, mock_get_limit
     ):
         # Registered and project limits for a and b, c is unregistered
-        reg_limits = {
-            'a': mock.MagicMock(default_limit=10),
-            'b': mock.MagicMock(default_limit=10),
-        }
-        prj_limits = {('bar', 'b'): mock.MagicMock(resource_limit=6)}
+        reg_limits = {'a': 10, 'b': 10}
+        prj_limits = {('bar', 'b'): 6}
         mock_get_reglimit.side_effect = lambda r: reg_limits.get(r)
         mock_get_limit.side_effect = lambda p, r: prj_limits.get((p, r))
 
@@ -237,13 +269,12 @@ class TestEnforcer(base.BaseTestCase):
             enforcer.calculate_usage(project_id, ['a', 'b', 'c', 'd']),
         )
 
-        # If caching is enabled, there should be three calls to the GET /limits
-        # API: one for 'a' and 'b' and two because of cache misses for 'c' and
-        # 'd' (the project_id has not set a per-project limit for 'c' or 'd',
-        # so they will not be cached for the project).
+        # If caching is enabled, there should be one call to the GET /limits
+        # API: the project's limits for 'a' and 'b' are cached along with the
+        # fact that it has not set a per-project limit for 'c' or 'd'.
         # If caching is disabled, there should be four calls to the GET
         # /limits API, one for each of 'a', 'b', 'c', and 'd'.
-        expected_count = 3 if cache else 4
+        expected_count = 1 if cache else 4
         self.assertEqual(expected_count, fix.mock_conn.limits.call_count)
 
         # If caching is enabled, there should be one call to the GET
@@ -258,707 +289,3196 @@ class TestEnforcer(base.BaseTestCase):
     def test_calculate_usage_no_cache(self):
         self.test_calculate_usage_cache(cache=False)
 
-
-class TestFlatEnforcer(base.BaseTestCase):
-    def setUp(self):
-        super().setUp()
-        self.config_fixture = self.useFixture(config_fixture.Config(CONF))
-        self.config_fixture.config(
-            group='oslo_limit', endpoint_id='ENDPOINT_ID'
+    def test_enforce_many(self):
+        self.config_fixture.config(group='oslo_limit', bulk_fetch_threshold=2)
+        fix = self.useFixture(
+            fixture.LimitFixture(
+                {'a': 5, 'b': 7}, {'project1': {'a': 2}, 'other': {'a': 1}}
+            )
         )
-        opts.register_opts(CONF)
-        self.mock_conn = mock.MagicMock()
-        limit._SDK_CONNECTION = self.mock_conn
-
-    @mock.patch.object(limit._EnforcerUtils, "get_registered_limits")
-    def test_get_registered_limits(self, mock_get_limits):
-        mock_get_limits.return_value = [("a", 1), ("b", 0), ("c", 2)]
+        usage = {
+            'project1': {'a': 2, 'b': 0},
+            'project2': {'a': 2, 'b': 7},
+            'project3': {'a': 0, 'b': 0},
+        }
+        mock_usage = mock.MagicMock(side_effect=lambda p, r: usage[p])
+        enforcer = limit.Enforcer(mock_usage)
 
-        enforcer = limit._FlatEnforcer(lambda: None)  # type: ignore
-        limits = enforcer.get_registered_limits(["a", "b", "c"])
+        results = enforcer.enforce_many(
+            {
+                'project1': {'a': 1},
+                'project2': {'a': 1, 'b': 1},
+                'project3': {'b': 7},
+            }
+        )
 
-        mock_get_limits.assert_called_once_with(["a", "b", "c"])
-        self.assertEqual(mock_get_limits.return_value, limits)
+        self.assertEqual(
+            {'project1', 'project2', 'project3'}, set(results.keys())
+        )
+        self.assertIsNone(results['project3'])
+        over = results['project1']
+        assert over is not None  # narrow type
+        self.assertEqual('project1', over.project_id)
+        self.assertEqual(
+            [('a', 2, 2, 1)],
+            [
+                (i.resource_name, i.limit, i.current_usage, i.delta)
+                for i in over.over_limit_info_list
+            ],
+        )
+        over = results['project2']
+        assert over is not None  # narrow type
+        self.assertEqual(
+            [('b', 7, 7, 1)],
+            [
+                (i.resource_name, i.limit, i.current_usage, i.delta)
+                for i in over.over_limit_info_list
+            ],
+        )
 
-    @mock.patch.object(limit._EnforcerUtils, "get_project_limits")
-    def test_get_project_limits(self, mock_get_limits):
-        project_id = uuid.uuid4().hex
-        mock_get_limits.return_value = [("a", 1), ("b", 0), ("c", 2)]
+        # The limits of all projects are looked up at once
+        fix.mock_conn.limits.assert_called_once_with(
+            service_id='service_id', region_id='region_id'
+        )
+        fix.mock_conn.registered_limits.assert_called_once()
+        # Usage is only counted for the resources being checked
+        self.assertEqual(3, mock_usage.call_count)
+        mock_usage.assert_any_call('project1', ['a'])
+        mock_usage.assert_any_call('project2', ['a', 'b'])
+        mock_usage.assert_any_call('project3', ['b'])
 
-        enforcer = limit._FlatEnforcer(lambda: None)  # type: ignore
-        limits = enforcer.get_project_limits(project_id, ["a", "b", "c"])
+    def test_enforce_many_bad_params(self):
+        enforcer = limit.Enforcer(mock.MagicMock())
 
-        mock_get_limits.assert_called_once_with(project_id, ["a", "b", "c"])
-        self.assertEqual(mock_get_limits.return_value, limits)
+        self.assertRaises(ValueError, enforcer.enforce_many, {})
+        self.assertRaises(ValueError, enforcer.enforce_many, ['project'])
+        self.assertRaises(ValueError, enforcer.enforce_many, {'project': {}})
+        self.assertRaises(ValueError, enforcer.enforce_many, {'': {'a': 1}})
+        self.assertRaises(
+            ValueError, enforcer.enforce_many, {'project': {'a': '1'}}
+        )
 
-    @mock.patch.object(limit._EnforcerUtils, "get_project_limits")
-    def test_enforce(self, mock_get_limits):
-        mock_usage = mock.MagicMock()
+    def test_calculate_usage_many(self):
+        fix = self.useFixture(
+            fixture.LimitFixture({'a': 5, 'b': 7}, {'project1': {'a': 2}})
+        )
+        enforcer = limit.Enforcer(lambda p, r: {'a': 1, 'b': 3})
 
-        project_id = uuid.uuid4().hex
-        deltas = {"a": 1, "b": 1}
-        mock_get_limits.return_value = [("a", 1), ("b", 2)]
-        mock_usage.return_value = {"a": 0, "b": 1}
+        self.assertEqual(
+            {
+                'project1': {
+                    'a': limit.ProjectUsage(2, 1),
+                    'b': limit.ProjectUsage(7, 3),
+                },
+                'project2': {
+                    'a': limit.ProjectUsage(5, 1),
+                    'b': limit.ProjectUsage(7, 3),
+                },
+                None: {
+                    'a': limit.ProjectUsage(5, 1),
+                    'b': limit.ProjectUsage(7, 3),
+                },
+            },
+            enforcer.calculate_usage_many(
+                ['project1', 'project2', None], ['a', 'b']
+            ),
+        )
+        # Below the bulk fetch threshold, projects are looked up separately
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+        fix.mock_conn.registered_limits.assert_called_once()
 
-        enforcer = limit._FlatEnforcer(mock_usage)
-        enforcer.enforce(project_id, deltas)
+    def test_calculate_usage_many_bad_params(self):
+        enforcer = limit.Enforcer(mock.MagicMock())
 
-        self.mock_conn.get_endpoint.assert_called_once_with('ENDPOINT_ID')
-        mock_get_limits.assert_called_once_with(project_id, ["a", "b"])
-        mock_usage.assert_called_once_with(project_id, ["a", "b"])
+        self.assertRaises(ValueError, enforcer.calculate_usage_many, [], ['a'])
+        self.assertRaises(
+            ValueError, enforcer.calculate_usage_many, 'project', ['a']
+        )
+        self.assertRaises(
+            ValueError, enforcer.calculate_usage_many, [123], ['a']
+        )
+        self.assertRaises(
+            ValueError, enforcer.calculate_usage_many, ['project'], []
+        )
 
-    @mock.patch.object(limit._EnforcerUtils, "get_project_limits")
-    def test_enforce_raises_on_over(self, mock_get_limits):
+    def test_calculate_usage_many_batch_callback(self):
+        self.useFixture(
+            fixture.LimitFixture({'a': 5, 'b': 7}, {'project1': {'a': 2}})
+        )
         mock_usage = mock.MagicMock()
+        mock_batch_usage = mock.MagicMock()
+        mock_batch_usage.return_value = {
+            'project1': {'a': 1, 'b': 3},
+            'project2': {'a': 4, 'b': 0},
+        }
+        enforcer = limit.Enforcer(
+            mock_usage, batch_usage_callback=mock_batch_usage
+        )
 
-        project_id = uuid.uuid4().hex
-        deltas = {"a": 2, "b": 1}
-        mock_get_limits.return_value = [("a", 1), ("b", 2)]
-        mock_usage.return_value = {"a": 0, "b": 1}
-
-        enforcer = limit._FlatEnforcer(mock_usage)
-        e = self.assertRaises(
-            exception.ProjectOverLimit, enforcer.enforce, project_id, deltas
+        self.assertEqual(
+            {
+                'project1': {
+                    'a': limit.ProjectUsage(2, 1),
+                    'b': limit.ProjectUsage(7, 3),
+                },
+                'project2': {
+                    'a': limit.ProjectUsage(5, 4),
+                    'b': limit.ProjectUsage(7, 0),
+                },
+            },
+            enforcer.calculate_usage_many(
+                ['project1', 'project2'], ['a', 'b']
+            ),
         )
-        expected = (
-            "Project %s is over a limit for "
-            "[Resource a is over limit of 1 due to current usage 0 "
-            "and delta 2]"
+        mock_batch_usage.assert_called_once_with(
+            ['project1', 'project2'], ['a', 'b']
         )
-        self.assertEqual(expected % project_id, str(e))
-        self.assertEqual(project_id, e.project_id)
-        self.assertEqual(1, len(e.over_limit_info_list))
-        over_a = e.over_limit_info_list[0]
-        self.assertEqual("a", over_a.resource_name)
-        self.assertEqual(1, over_a.limit)
-        self.assertEqual(0, over_a.current_usage)
-        self.assertEqual(2, over_a.delta)
-
-    @mock.patch.object(limit._EnforcerUtils, "get_project_limits")
-    def test_enforce_unlimited_limit(self, mock_get_limits):
-        mock_usage = mock.MagicMock()
+        mock_usage.assert_not_called()
 
-        project_id = uuid.uuid4().hex
-        deltas = {"a": 1}
-        mock_get_limits.return_value = [("a", -1)]
-        mock_usage.return_value = {"a": 0}
+        results = enforcer.enforce_many(
+            {'project1': {'a': 1}, 'project2': {'a': 2}}
+        )
+        self.assertIsNone(results['project1'])
+        self.assertIsInstance(results['project2'], exception.ProjectOverLimit)
+        self.assertEqual(2, mock_batch_usage.call_count)
+        mock_usage.assert_not_called()
+
+        # A single project is still checked with the usage callback
+        mock_usage.return_value = {'a': 1}
+        enforcer.enforce('project1', {'a': 1})
+        mock_usage.assert_called_once_with('project1', ['a'])
+        self.assertEqual(2, mock_batch_usage.call_count)
+
+    def test_calculate_usage_many_batch_callback_missing_project(self):
+        self.useFixture(fixture.LimitFixture({'a': 5}, {}))
+        enforcer = limit.Enforcer(
+            mock.MagicMock(),
+            batch_usage_callback=lambda p, r: {'project1': {'a': 1}},
+        )
 
-        enforcer = limit._FlatEnforcer(mock_usage)
-        enforcer.enforce(project_id, deltas)
+        self.assertRaises(
+            ValueError,
+            enforcer.calculate_usage_many,
+            ['project1', 'project2'],
+            ['a'],
+        )
 
-        mock_get_limits.assert_called_once_with(project_id, ["a"])
-        mock_usage.assert_called_once_with(project_id, ["a"])
+    @mock.patch('time.monotonic')
+    def test_usage_cache(self, mock_monotonic):
+        self.config_fixture.config(
+            group='oslo_limit', usage_cache_expiration_time=5
+        )
+        self.useFixture(fixture.LimitFixture({'a': 5, 'b': 7}, {}))
+        mock_monotonic.return_value = 1000
+        mock_usage = mock.MagicMock(return_value={'a': 1, 'b': 2})
+        enforcer = limit.Enforcer(mock_usage)
 
-    @mock.patch.object(limit._EnforcerUtils, "_get_project_limit")
-    @mock.patch.object(limit._EnforcerUtils, "_get_registered_limit")
-    def test_enforce_raises_on_missing_limit(
-        self, mock_get_reglimit, mock_get_limit
-    ):
-        def mock_usage(*a):
-            return {'a': 1, 'b': 1}
+        enforcer.enforce('project1', {'a': 1, 'b': 1})
+        enforcer.enforce('project1', {'a': 4})
+        self.assertEqual(
+            {'a': limit.ProjectUsage(5, 1), 'b': limit.ProjectUsage(7, 2)},
+            enforcer.calculate_usage('project1', ['a', 'b']),
+        )
+        mock_usage.assert_called_once_with('project1', ['a', 'b'])
 
-        project_id = uuid.uuid4().hex
-        deltas = {"a": 0, "b": 0}
-        mock_get_reglimit.return_value = None
-        mock_get_limit.return_value = None
+        # Only the usage which is not cached is looked up
+        mock_usage.return_value = {'c': 3}
+        enforcer.calculate_usage('project1', ['a', 'c'])
+        self.assertEqual(2, mock_usage.call_count)
+        mock_usage.assert_called_with('project1', ['c'])
 
-        enforcer = limit._FlatEnforcer(mock_usage)
-        self.assertRaises(
-            exception.ProjectOverLimit, enforcer.enforce, project_id, deltas
+        self.assertEqual(
+            limit.CacheStats(3, 4, 3, 0), enforcer.get_cache_stats()['usage']
         )
 
+        # Usage is looked up again once it expires
+        mock_monotonic.return_value = 1005
+        mock_usage.return_value = {'a': 5}
         self.assertRaises(
-            exception.ProjectOverLimit, enforcer.enforce, None, deltas
+            exception.ProjectOverLimit, enforcer.enforce, 'project1', {'a': 1}
         )
+        self.assertEqual(3, mock_usage.call_count)
+        mock_usage.assert_called_with('project1', ['a'])
 
-
-class TestEnforcerUtils(base.BaseTestCase):
-    def setUp(self):
-        super().setUp()
-        self.config_fixture = self.useFixture(config_fixture.Config(CONF))
+    def test_usage_cache_invalidate(self):
         self.config_fixture.config(
-            group='oslo_limit', endpoint_id='ENDPOINT_ID'
+            group='oslo_limit', usage_cache_expiration_time=60
         )
-        opts.register_opts(CONF)
-        self.mock_conn = mock.MagicMock()
-        limit._SDK_CONNECTION = self.mock_conn
+        self.useFixture(fixture.LimitFixture({'a': 5, 'b': 7}, {}))
+        mock_usage = mock.MagicMock(return_value={'a': 1, 'b': 2})
+        enforcer = limit.Enforcer(mock_usage)
 
-    def test_get_endpoint(self):
-        fake_endpoint = endpoint.Endpoint()
-        self.mock_conn.get_endpoint.return_value = fake_endpoint
+        enforcer.enforce('project1', {'a': 1, 'b': 1})
+        enforcer.enforce('project2', {'a': 1, 'b': 1})
+        self.assertEqual(2, mock_usage.call_count)
 
-        utils = limit._EnforcerUtils()
+        enforcer.invalidate_usage('project1', ['a'])
+        enforcer.enforce('project1', {'a': 1, 'b': 1})
+        mock_usage.assert_called_with('project1', ['a'])
 
-        self.assertEqual(fake_endpoint, utils._endpoint)
-        self.mock_conn.get_endpoint.assert_called_once_with('ENDPOINT_ID')
-        self.mock_conn.services.assert_not_called()
-        self.mock_conn.endpoints.assert_not_called()
+        enforcer.invalidate_usage('project1')
+        enforcer.enforce('project1', {'a': 1, 'b': 1})
+        mock_usage.assert_called_with('project1', ['a', 'b'])
 
-    def test_enforce_limits_unlimited(self):
-        limit._EnforcerUtils.enforce_limits(
-            'project',
-            [('a', -1)],
-            {'a': 0},
-            {'a': 1},
+        # The usage of other projects is still cached
+        enforcer.enforce('project2', {'a': 1, 'b': 1})
+        self.assertEqual(4, mock_usage.call_count)
+
+    def test_usage_cache_apply_deltas(self):
+        self.config_fixture.config(
+            group='oslo_limit',
+            usage_cache_expiration_time=60,
+            usage_cache_apply_deltas=True,
         )
+        self.useFixture(fixture.LimitFixture({'a': 5, 'b': 7}, {}))
+        mock_usage = mock.MagicMock(return_value={'a': 1, 'b': 2})
+        enforcer = limit.Enforcer(mock_usage)
 
-    def test_enforce_limits_unlimited_with_usage(self):
-        limit._EnforcerUtils.enforce_limits(
-            'project',
-            [('a', -1)],
-            {'a': 1000},
-            {'a': 500},
+        enforcer.enforce('project1', {'a': 2, 'b': 1})
+        self.assertEqual(
+            {'a': limit.ProjectUsage(5, 3), 'b': limit.ProjectUsage(7, 3)},
+            enforcer.calculate_usage('project1', ['a', 'b']),
         )
 
-    def test_enforce_limits_still_enforces_finite_limits(self):
+        # Deltas are not applied when over limit
         self.assertRaises(
             exception.ProjectOverLimit,
-            limit._EnforcerUtils.enforce_limits,
-            'project',
-            [('a', 10)],
-            {'a': 9},
-            {'a': 2},
+            enforcer.enforce,
+            'project1',
+            {'a': 3, 'b': 1},
+        )
+        enforcer.enforce('project1', {'a': 2})
+        e = self.assertRaises(
+            exception.ProjectOverLimit, enforcer.enforce, 'project1', {'a': 1}
         )
+        self.assertEqual(5, e.over_limit_info_list[0].current_usage)
 
-    def test_get_endpoint_no_id(self):
-        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
-        self.mock_conn.get_endpoint.side_effect = (
-            os_exceptions.ResourceNotFound
+        results = enforcer.enforce_many(
+            {'project1': {'b': 1}, 'project2': {'a': 6}}
+        )
+        self.assertIsNone(results['project1'])
+        self.assertEqual(
+            {'b': limit.ProjectUsage(7, 4)},
+            enforcer.calculate_usage('project1', ['b']),
+        )
+        self.assertEqual(
+            {'a': limit.ProjectUsage(5, 1)},
+            enforcer.calculate_usage('project2', ['a']),
         )
+        self.assertEqual(2, mock_usage.call_count)
 
-        self.assertRaises(ValueError, limit._EnforcerUtils)
-        self.mock_conn.get_endpoint.assert_not_called()
-        self.mock_conn.services.assert_not_called()
-        self.mock_conn.endpoints.assert_not_called()
+    def test_usage_cache_batch_callback(self):
+        self.config_fixture.config(
+            group='oslo_limit', usage_cache_expiration_time=60
+        )
+        self.useFixture(fixture.LimitFixture({'a': 5, 'b': 7}, {}))
+        mock_usage = mock.MagicMock(return_value={'a': 1})
+        mock_batch_usage = mock.MagicMock()
+        mock_batch_usage.side_effect = lambda p, r: {
+            project_id: {resource: 1 for resource in r} for project_id in p
+        }
+        enforcer = limit.Enforcer(
+            mock_usage, batch_usage_callback=mock_batch_usage
+        )
 
-    def test_get_endpoint_missing(self):
-        self.mock_conn.get_endpoint.side_effect = (
-            os_exceptions.ResourceNotFound
+        enforcer.enforce('project1', {'a': 1})
+        usage = enforcer.calculate_usage_many(
+            ['project1', 'project2'], ['a', 'b']
         )
 
-        self.assertRaises(ValueError, limit._EnforcerUtils)
-        self.mock_conn.get_endpoint.assert_called_once_with('ENDPOINT_ID')
-        self.mock_conn.services.assert_not_called()
-        self.mock_conn.endpoints.assert_not_called()
+        self.assertEqual(
+            {
+                project_id: {
+                    'a': limit.ProjectUsage(5, 1),
+                    'b': limit.ProjectUsage(7, 1),
+                }
+                for project_id in ('project1', 'project2')
+            },
+            usage,
+        )
+        mock_batch_usage.assert_called_once_with(
+            ['project1', 'project2'], ['a', 'b']
+        )
 
-    def test_get_endpoint_lookup_without_service_opts(self):
-        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
+        enforcer.calculate_usage_many(['project1', 'project2'], ['a', 'b'])
+        mock_batch_usage.assert_called_once()
+        mock_usage.assert_called_once()
 
-        self.assertRaises(ValueError, limit._EnforcerUtils)
+    def test_usage_cache_disabled(self):
+        self.useFixture(fixture.LimitFixture({'a': 5}, {}))
+        mock_usage = mock.MagicMock(return_value={'a': 1})
+        enforcer = limit.Enforcer(mock_usage)
 
-        self.mock_conn.get_endpoint.assert_not_called()
-        self.mock_conn.services.assert_not_called()
-        self.mock_conn.endpoints.assert_not_called()
+        enforcer.enforce('project1', {'a': 1})
+        enforcer.invalidate_usage('project1')
+        enforcer.enforce('project1', {'a': 1})
 
-    def test_get_endpoint_lookup(self):
-        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
-        self.config_fixture.config(
-            group='oslo_limit', endpoint_service_type='SERVICE_TYPE'
+        self.assertEqual(2, mock_usage.call_count)
+        self.assertNotIn('usage', enforcer.get_cache_stats())
+
+    def test_claim(self):
+        self.useFixture(fixture.LimitFixture({'a': 5, 'b': 7}, {}))
+        mock_usage = mock.MagicMock(return_value={'a': 1, 'b': 2})
+        enforcer = limit.Enforcer(mock_usage)
+
+        claim1 = enforcer.claim('project1', {'a': 2, 'b': 1})
+        self.assertTrue(claim1.outstanding)
+        claim2 = enforcer.claim('project1', {'a': 2})
+
+        # Outstanding claims are counted as usage
+        e = self.assertRaises(
+            exception.ProjectOverLimit, enforcer.claim, 'project1', {'a': 1}
         )
-        self.config_fixture.config(
-            group='oslo_limit', endpoint_service_name='SERVICE_NAME'
+        self.assertEqual(5, e.over_limit_info_list[0].current_usage)
+        self.assertRaises(
+            exception.ProjectOverLimit, enforcer.enforce, 'project1', {'a': 1}
         )
-        fake_service = service.Service(id='SERVICE_ID')
-        self.mock_conn.services.return_value = [fake_service]
-        fake_endpoint = endpoint.Endpoint()
-        self.mock_conn.endpoints.return_value = [fake_endpoint]
+        self.assertEqual(
+            {'a': limit.ProjectUsage(5, 5), 'b': limit.ProjectUsage(7, 3)},
+            enforcer.calculate_usage('project1', ['a', 'b']),
+        )
+        # The claims of other projects are not
+        enforcer.enforce('project2', {'a': 4})
 
-        utils = limit._EnforcerUtils()
+        claim2.rollback()
+        self.assertFalse(claim2.outstanding)
+        enforcer.enforce('project1', {'a': 2})
 
-        self.assertEqual(fake_endpoint, utils._endpoint)
-        self.mock_conn.get_endpoint.assert_not_called()
-        self.mock_conn.services.assert_called_once_with(
-            type='SERVICE_TYPE', name='SERVICE_NAME'
+        claim1.commit()
+        self.assertFalse(claim1.outstanding)
+        self.assertEqual(
+            {'a': limit.ProjectUsage(5, 1)},
+            enforcer.calculate_usage('project1', ['a']),
         )
-        self.mock_conn.endpoints.assert_called_once_with(
-            service_id='SERVICE_ID', region_id=None, interface='public'
+
+        # Claims are only released once
+        claim1.commit()
+        claim1.rollback()
+        self.assertEqual(
+            {'a': limit.ProjectUsage(5, 1)},
+            enforcer.calculate_usage('project1', ['a']),
         )
 
-    def test_get_endpoint_lookup_multiple_endpoints(self):
-        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
-        self.config_fixture.config(
-            group='oslo_limit', endpoint_service_type='SERVICE_TYPE'
+    def test_claim_context_manager(self):
+        self.useFixture(fixture.LimitFixture({'a': 5}, {}))
+        enforcer = limit.Enforcer(lambda p, r: {'a': 1})
+
+        with enforcer.claim('project1', {'a': 1}) as claim:
+            self.assertTrue(claim.outstanding)
+            self.assertEqual(
+                {'a': limit.ProjectUsage(5, 2)},
+                enforcer.calculate_usage('project1', ['a']),
+            )
+        self.assertFalse(claim.outstanding)
+
+        try:
+            with enforcer.claim('project1', {'a': 4}) as claim:
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        self.assertFalse(claim.outstanding)
+        self.assertEqual(
+            {'a': limit.ProjectUsage(5, 1)},
+            enforcer.calculate_usage('project1', ['a']),
         )
+
+    def test_claim_usage_cache(self):
         self.config_fixture.config(
-            group='oslo_limit', endpoint_service_name='SERVICE_NAME'
+            group='oslo_limit', usage_cache_expiration_time=60
         )
-        fake_service = service.Service(id='SERVICE_ID')
-        self.mock_conn.services.return_value = [fake_service]
-        self.mock_conn.endpoints.return_value = [
-            endpoint.Endpoint(),
-            endpoint.Endpoint(),
-        ]
-
-        self.assertRaises(ValueError, limit._EnforcerUtils)
+        self.useFixture(fixture.LimitFixture({'a': 5}, {}))
+        mock_usage = mock.MagicMock(return_value={'a': 1})
+        enforcer = limit.Enforcer(mock_usage)
 
-        self.mock_conn.get_endpoint.assert_not_called()
-        self.mock_conn.services.assert_called_once_with(
-            type='SERVICE_TYPE', name='SERVICE_NAME'
-        )
-        self.mock_conn.endpoints.assert_called_once_with(
-            service_id='SERVICE_ID', region_id=None, interface='public'
+        enforcer.claim('project1', {'a': 2}).commit()
+        claim = enforcer.claim('project1', {'a': 1})
+        self.assertRaises(
+            exception.ProjectOverLimit, enforcer.claim, 'project1', {'a': 2}
         )
+        claim.rollback()
+        enforcer.claim('project1', {'a': 2})
 
-    def test_get_endpoint_lookup_endpoint_not_found(self):
-        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
-        self.config_fixture.config(
-            group='oslo_limit', endpoint_service_type='SERVICE_TYPE'
+        # Committed claims are added to the cached usage
+        self.assertRaises(
+            exception.ProjectOverLimit, enforcer.claim, 'project1', {'a': 1}
         )
+        mock_usage.assert_called_once_with('project1', ['a'])
+
+    def test_claim_commit_concurrent(self):
         self.config_fixture.config(
-            group='oslo_limit', endpoint_service_name='SERVICE_NAME'
+            group='oslo_limit', usage_cache_expiration_time=60
         )
-        fake_service = service.Service(id='SERVICE_ID')
-        self.mock_conn.services.return_value = [fake_service]
-        self.mock_conn.endpoints.return_value = []
+        self.useFixture(fixture.LimitFixture({'a': 5}, {}))
+        enforcer = limit.Enforcer(lambda p, r: {'a': 1})
+        claim = enforcer.claim('project1', {'a': 3})
+        results: list[object] = []
+
+        def claim_more():
+            try:
+                results.append(enforcer.claim('project1', {'a': 2}))
+            except exception.ProjectOverLimit as e:
+                results.append(e)
+
+        thread = threading.Thread(target=claim_more)
+        assert enforcer._usage_cache is not None  # narrow type
+        usage_cache_add = enforcer._usage_cache.add
+
+        def add(project_id, deltas):
+            # A claim made while the claim is committed waits for it
+            thread.start()
+            thread.join(0.05)
+            self.assertTrue(thread.is_alive())
+            usage_cache_add(project_id, deltas)
+
+        with mock.patch.object(enforcer._usage_cache, 'add', side_effect=add):
+            claim.commit()
+        thread.join(5)
+
+        self.assertIsInstance(results[0], exception.ProjectOverLimit)
+
+    def test_claim_concurrent(self):
+        self.useFixture(fixture.LimitFixture({'a': 5}, {}))
+        started = threading.Event()
+        release = threading.Event()
+        usage_calls = []
+
+        def usage(project_id, resource_names):
+            usage_calls.append(project_id)
+            started.set()
+            release.wait(5)
+            return {'a': 3}
+
+        enforcer = limit.Enforcer(usage)
+        results: list[object] = []
+
+        def claim():
+            try:
+                results.append(enforcer.claim('project1', {'a': 2}))
+            except exception.ProjectOverLimit as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=claim) for _ in range(2)]
+        threads[0].start()
+        started.wait(5)
+        threads[1].start()
+        # The second claim waits for the first one to be checked
+        time.sleep(0.05)
+        self.assertEqual(['project1'], usage_calls)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertIsInstance(results[0], limit.Claim)
+        self.assertIsInstance(results[1], exception.ProjectOverLimit)
+
+    def test_claim_bad_params(self):
+        enforcer = limit.Enforcer(mock.MagicMock())
 
-        self.assertRaises(ValueError, limit._EnforcerUtils)
+        self.assertRaises(ValueError, enforcer.claim, '', {'a': 1})
+        self.assertRaises(ValueError, enforcer.claim, 'project', {})
+
+    def test_lazy(self):
+        fix = self.useFixture(fixture.LimitFixture({'a': 5}, {}))
+        mock_gem = limit.Enforcer._get_enforcement_model
+        limit._SDK_CONNECTION = None
+
+        with mock.patch.object(limit, '_get_keystone_connection') as mock_gkc:
+            mock_gkc.return_value = fix.mock_conn
+            enforcer = limit.Enforcer(lambda p, r: {'a': 1}, lazy=True)
+            # Invalid calls do not need keystone
+            self.assertRaises(ValueError, enforcer.enforce, 'project1', {})
+
+            mock_gkc.assert_not_called()
+            mock_gem.assert_not_called()  # type: ignore
+            fix.mock_conn.get_endpoint.assert_not_called()
+
+            enforcer.enforce('project1', {'a': 1})
+            enforcer.enforce('project1', {'a': 1})
+
+        mock_gkc.assert_called()
+        mock_gem.assert_called_once()  # type: ignore
+        fix.mock_conn.get_endpoint.assert_called_once()
+
+    def test_lazy_concurrent_first_use(self):
+        fix = self.useFixture(fixture.LimitFixture({'a': 5}, {}))
+        mock_gem: Any = limit.Enforcer._get_enforcement_model
+        started = threading.Event()
+        release = threading.Event()
+
+        def get_enforcement_model():
+            started.set()
+            release.wait(5)
+            return 'flat'
+
+        mock_gem.side_effect = get_enforcement_model
+        enforcer = limit.Enforcer(lambda p, r: {'a': 1}, lazy=True)
+        threads = [
+            threading.Thread(
+                target=enforcer.enforce, args=('project1', {'a': 1})
+            )
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+        release.set()
+        for thread in threads:
+            thread.join(5)
 
-        self.mock_conn.get_endpoint.assert_not_called()
-        self.mock_conn.services.assert_called_once_with(
-            type='SERVICE_TYPE', name='SERVICE_NAME'
-        )
-        self.mock_conn.endpoints.assert_called_once_with(
-            service_id='SERVICE_ID', region_id=None, interface='public'
-        )
+        mock_gem.assert_called_once()
+        fix.mock_conn.get_endpoint.assert_called_once()
 
-    def test_get_endpoint_lookup_multiple_service(self):
-        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
-        self.config_fixture.config(
-            group='oslo_limit', endpoint_service_type='SERVICE_TYPE'
+    def test_lazy_prewarm(self):
+        fix = self.useFixture(
+            fixture.LimitFixture({'a': 5}, {'project1': {'a': 2}})
         )
-        self.config_fixture.config(
-            group='oslo_limit', endpoint_service_name='SERVICE_NAME'
+
+        enforcer = limit.Enforcer(
+            lambda p, r: {'a': 1}, lazy=True, prewarm=True
         )
-        self.mock_conn.services.side_effect = [
-            service.Service(id='SERVICE_ID1'),
-            service.Service(id='SERVICE_ID2'),
+        assert enforcer._prewarm_thread is not None  # narrow type
+        enforcer._prewarm_thread.join(5)
+
+        fix.mock_conn.get_endpoint.assert_called_once()
+        fix.mock_conn.registered_limits.assert_called_once()
+        fix.mock_conn.limits.assert_called_once()
+
+        # Limits were loaded into the cache by the prewarm
+        enforcer.enforce('project1', {'a': 1})
+        enforcer.enforce('project2', {'a': 1})
+        fix.mock_conn.registered_limits.assert_called_once()
+        fix.mock_conn.limits.assert_called_once()
+
+    def test_lazy_prewarm_failure(self):
+        fix = self.useFixture(fixture.LimitFixture({'a': 5}, {}))
+        fix.mock_conn.get_endpoint.side_effect = [
+            os_exceptions.SDKException('keystone unavailable'),
+            fix.mock_conn.get_endpoint.return_value,
         ]
 
-        self.assertRaises(ValueError, limit._EnforcerUtils)
+        enforcer = limit.Enforcer(
+            lambda p, r: {'a': 1}, lazy=True, prewarm=True
+        )
+        assert enforcer._prewarm_thread is not None  # narrow type
+        enforcer._prewarm_thread.join(5)
 
-        self.mock_conn.get_endpoint.assert_not_called()
-        self.mock_conn.services.assert_called_once_with(
-            type='SERVICE_TYPE', name='SERVICE_NAME'
+        # Initialization is retried on first use
+        enforcer.enforce('project1', {'a': 1})
+        self.assertEqual(2, fix.mock_conn.get_endpoint.call_count)
+
+    def test_warm_cache(self):
+        fix = self.useFixture(
+            fixture.LimitFixture({'a': 5, 'b': 7}, {'project1': {'a': 2}})
         )
-        self.mock_conn.endpoints.assert_not_called()
+        enforcer = limit.Enforcer(lambda p, r: {'a': 0, 'b': 0})
 
-    def test_get_endpoint_lookup_service_not_found(self):
-        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
-        self.config_fixture.config(
-            group='oslo_limit', endpoint_service_type='SERVICE_TYPE'
+        enforcer.warm_cache()
+        fix.mock_conn.limits.assert_called_once_with(
+            service_id='service_id', region_id='region_id'
         )
-        self.config_fixture.config(
-            group='oslo_limit', endpoint_service_name='SERVICE_NAME'
+        fix.mock_conn.registered_limits.assert_called_once_with(
+            service_id='service_id', region_id='region_id'
         )
-        self.mock_conn.services.return_value = []
 
-        self.assertRaises(ValueError, limit._EnforcerUtils)
+        self.assertEqual(
+            [('a', 2), ('b', 7)],
+            enforcer.get_project_limits('project1', ['a', 'b']),
+        )
+        self.assertEqual(
+            [('a', 5), ('b', 7)],
+            enforcer.get_project_limits('project2', ['a', 'b']),
+        )
+        fix.mock_conn.limits.assert_called_once()
+        fix.mock_conn.registered_limits.assert_called_once()
 
-        self.mock_conn.get_endpoint.assert_not_called()
-        self.mock_conn.services.assert_called_once_with(
-            type='SERVICE_TYPE', name='SERVICE_NAME'
+    def test_warm_cache_no_cache(self):
+        fix = self.useFixture(fixture.LimitFixture({'a': 5}, {}))
+        enforcer = limit.Enforcer(lambda p, r: {'a': 0}, cache=False)
+
+        enforcer.warm_cache()
+        fix.mock_conn.limits.assert_not_called()
+        fix.mock_conn.registered_limits.assert_not_called()
+
+    def test_get_cache_stats(self):
+        self.useFixture(
+            fixture.LimitFixture({'a': 5, 'b': 7}, {'project1': {'a': 2}})
         )
-        self.mock_conn.endpoints.assert_not_called()
+        enforcer = limit.Enforcer(lambda p, r: {'a': 0, 'b': 0})
 
-    def test_get_endpoint_lookup_with_region(self):
-        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
-        self.config_fixture.config(
-            group='oslo_limit', endpoint_service_type='SERVICE_TYPE'
+        enforcer.enforce('project1', {'a': 1, 'b': 1})
+        enforcer.enforce('project1', {'a': 1, 'b': 1})
+
+        self.assertEqual(
+            {
+                'project_limits': limit.CacheStats(1, 3, 1, 0),
+                'registered_limits': limit.CacheStats(1, 1, 1, 0),
+            },
+            enforcer.get_cache_stats(),
         )
+
+    def test_get_circuit_breaker_stats(self):
         self.config_fixture.config(
-            group='oslo_limit', endpoint_service_name='SERVICE_NAME'
+            group='oslo_limit', keystone_failure_threshold=1
         )
-        self.config_fixture.config(
-            group='oslo_limit', endpoint_region_name='regionOne'
+        fix = self.useFixture(fixture.LimitFixture({'a': 5}, {}))
+        enforcer = limit.Enforcer(lambda p, r: {'a': 0})
+        self.assertEqual(
+            limit.CircuitBreakerStats('closed', 0, 0, 0),
+            enforcer.get_circuit_breaker_stats(),
         )
-        fake_service = service.Service(id='SERVICE_ID')
-        self.mock_conn.services.return_value = [fake_service]
-        fake_endpoint = endpoint.Endpoint()
-        self.mock_conn.endpoints.return_value = [fake_endpoint]
-        fake_region = region.Region(id='REGION_ID')
-        self.mock_conn.get_region.return_value = fake_region
-
-        utils = limit._EnforcerUtils()
 
-        self.assertEqual(fake_endpoint, utils._endpoint)
-        self.mock_conn.get_endpoint.assert_not_called()
-        self.mock_conn.services.assert_called_once_with(
-            type='SERVICE_TYPE', name='SERVICE_NAME'
+        fix.mock_conn.limits.side_effect = os_exceptions.SDKException('down')
+        self.assertRaises(
+            os_exceptions.SDKException, enforcer.enforce, 'project1', {'a': 1}
         )
-        self.mock_conn.get_region.assert_called_once_with('regionOne')
-        self.mock_conn.endpoints.assert_called_once_with(
-            service_id='SERVICE_ID', region_id='REGION_ID', interface='public'
+        self.assertRaises(
+            exception.KeystoneUnavailable,
+            enforcer.enforce,
+            'project2',
+            {'a': 1},
         )
-
-    def test_get_endpoint_lookup_with_region_not_found(self):
-        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
-        self.config_fixture.config(
-            group='oslo_limit', endpoint_service_type='SERVICE_TYPE'
+        self.assertEqual(
+            limit.CircuitBreakerStats('open', 1, 1, 1),
+            enforcer.get_circuit_breaker_stats(),
         )
-        self.config_fixture.config(
-            group='oslo_limit', endpoint_service_name='SERVICE_NAME'
+
+    @mock.patch('os.getpid')
+    @mock.patch('openstack.utils.ensure_service_version')
+    @mock.patch('openstack.connection.Connection')
+    def test_connection_after_fork(self, mock_conn, mock_esv, mock_getpid):
+        self.addCleanup(setattr, limit, '_SDK_CONNECTION_PID', None)
+        limit._SDK_CONNECTION = None
+        mock_esv.side_effect = [mock.sentinel.parent, mock.sentinel.child]
+        mock_getpid.return_value = 100
+
+        self.assertEqual(
+            mock.sentinel.parent, limit._get_keystone_connection()
         )
-        self.config_fixture.config(
-            group='oslo_limit', endpoint_region_name='regionOne'
+        self.assertEqual(
+            mock.sentinel.parent, limit._get_keystone_connection()
         )
-        fake_service = service.Service(id='SERVICE_ID')
-        self.mock_conn.services.return_value = [fake_service]
-        fake_endpoint = endpoint.Endpoint()
-        self.mock_conn.endpoints.return_value = [fake_endpoint]
-        self.mock_conn.get_region.side_effect = os_exceptions.ResourceNotFound
+        self.assertEqual(1, mock_conn.call_count)
 
-        self.assertRaises(ValueError, limit._EnforcerUtils)
+        # A forked process does not use the connection of its parent
+        mock_getpid.return_value = 101
+        self.assertEqual(mock.sentinel.child, limit._get_keystone_connection())
+        self.assertEqual(mock.sentinel.child, limit._get_keystone_connection())
+        self.assertEqual(2, mock_conn.call_count)
 
-        self.mock_conn.get_endpoint.assert_not_called()
-        self.mock_conn.services.assert_called_once_with(
-            type='SERVICE_TYPE', name='SERVICE_NAME'
+    def test_connection_after_fork_not_owned(self):
+        # A connection which was not created by the library is kept
+        limit._after_fork_in_child()
+
+        self.assertIsNotNone(limit._SDK_CONNECTION)
+
+    def _fork_enforcer(self, keep_cache):
+        self.config_fixture.config(
+            group='oslo_limit',
+            cache_keep_after_fork=keep_cache,
+            usage_cache_expiration_time=60,
         )
-        self.mock_conn.get_region.assert_called_once_with('regionOne')
-        self.mock_conn.endpoints.assert_not_called()
+        fix = self.useFixture(
+            fixture.LimitFixture({'a': 5}, {'project1': {'a': 2}})
+        )
+        enforcer = limit.Enforcer(lambda p, r: {'a': 0})
+        enforcer.enforce('project1', {'a': 1})
+        claim = enforcer.claim('project1', {'a': 2})
+        model_lock = enforcer._model_lock
 
-    def test_get_registered_limit_empty(self):
-        self.mock_conn.registered_limits.return_value = iter([])
+        limit._after_fork_in_child()
 
-        utils = limit._EnforcerUtils()
-        reg_limit = utils._get_registered_limit("foo")
+        self.assertIsNot(model_lock, enforcer._model_lock)
+        # Claims of the parent process are not outstanding in the child
+        self.assertFalse(claim.outstanding)
+        enforcer.enforce('project1', {'a': 2})
+        return fix, enforcer
 
-        self.assertIsNone(reg_limit)
+    def test_after_fork_keep_cache(self):
+        fix, enforcer = self._fork_enforcer(True)
 
-    def test_get_registered_limit(self):
-        foo = registered_limit.RegisteredLimit()
-        foo.resource_name = "foo"
-        self.mock_conn.registered_limits.return_value = iter([foo])
+        fix.mock_conn.limits.assert_called_once()
+        self.assertEqual(
+            limit.CacheStats(1, 2, 1, 0), enforcer.get_cache_stats()['usage']
+        )
 
-        utils = limit._EnforcerUtils()
-        reg_limit = utils._get_registered_limit("foo")
+    def test_after_fork_clear_cache(self):
+        fix, enforcer = self._fork_enforcer(False)
 
-        self.assertEqual(foo, reg_limit)
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+        self.assertEqual(
+            limit.CacheStats(1, 1, 2, 0), enforcer.get_cache_stats()['usage']
+        )
 
-    def test_get_registered_limits(self):
-        fake_endpoint = endpoint.Endpoint(
-            service_id='service_id', region_id='region_id'
+    def test_shared_cache_file(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path, 'cache')
+        self.config_fixture.config(
+            group='oslo_limit',
+            shared_cache_file=path,
+            cache_expiration_time=60,
+        )
+        fix = self.useFixture(
+            fixture.LimitFixture({'a': 5}, {'project1': {'a': 2}})
         )
-        self.mock_conn.get_endpoint.return_value = fake_endpoint
 
-        # a and c have limits, b doesn't have one
-        empty_iterator: Iterable[Any] = iter([])
+        for _ in range(2):
+            enforcer = limit.Enforcer(lambda p, r: {'a': 0})
+            self.assertIsInstance(
+                enforcer._shared_cache, limit_cache.FileCache
+            )
+            enforcer.enforce('project1', {'a': 1})
+            enforcer.enforce('project2', {'a': 1})
 
-        a = registered_limit.RegisteredLimit()
-        a.resource_name = "a"
-        a.default_limit = 1
-        a_iterator = iter([a])
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+        fix.mock_conn.registered_limits.assert_called_once()
 
-        c = registered_limit.RegisteredLimit()
-        c.resource_name = "c"
-        c.default_limit = 2
-        c_iterator = iter([c])
+    def test_shared_cache_file_no_expiration(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path, 'cache')
+        self.config_fixture.config(group='oslo_limit', shared_cache_file=path)
+        self.useFixture(fixture.LimitFixture({'a': 5}, {}))
 
-        self.mock_conn.registered_limits.side_effect = [
-            a_iterator,
-            empty_iterator,
-            c_iterator,
-        ]
+        # Limits cached in the file would outlive restarts of the service
+        self.assertRaises(ValueError, limit.Enforcer, lambda p, r: {'a': 0})
+        self.assertFalse(os.path.exists(path))
 
-        utils = limit._EnforcerUtils()
-        limits = utils.get_registered_limits(["a", "b", "c"])
-        self.assertEqual([('a', 1), ('b', 0), ('c', 2)], limits)
+        # The file is not used without caching
+        enforcer = limit.Enforcer(lambda p, r: {'a': 0}, cache=False)
+        enforcer.enforce('project1', {'a': 1})
 
-    def test_get_project_limits(self):
-        fake_endpoint = endpoint.Endpoint(
-            service_id='service_id', region_id='region_id'
+    def test_shared_cache_file_many_limits(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path, 'cache')
+        self.config_fixture.config(
+            group='oslo_limit',
+            shared_cache_file=path,
+            cache_expiration_time=60,
+        )
+        # As many limits as nova registers
+        resources = [
+            'servers',
+            'class:VCPU',
+            'class:MEMORY_MB',
+            'class:DISK_GB',
+            'class:PCPU',
+            'class:VGPU',
+            'server_metadata_items',
+            'server_injected_files',
+            'server_injected_file_content_bytes',
+            'server_injected_file_path_bytes',
+            'server_key_pairs',
+            'server_groups',
+            'server_group_members',
+        ]
+        fix = self.useFixture(
+            fixture.LimitFixture(
+                dict.fromkeys(resources, 10),
+                {'project1': dict.fromkeys(resources, 20)},
+            )
         )
-        self.mock_conn.get_endpoint.return_value = fake_endpoint
-        project_id = uuid.uuid4().hex
 
-        # a is a project limit, b, c and d don't have one
-        empty_iterator: Iterable[Any] = iter([])
+        for _ in range(2):
+            enforcer = limit.Enforcer(lambda p, r: dict.fromkeys(resources, 0))
+            enforcer.enforce('project1', dict.fromkeys(resources, 1))
+            enforcer.enforce('project2', dict.fromkeys(resources, 1))
 
-        a = klimit.Limit()
-        a.resource_name = "a"
-        a.resource_limit = 1
-        a_iterator = iter([a])
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+        fix.mock_conn.registered_limits.assert_called_once()
 
-        self.mock_conn.limits.side_effect = [
-            a_iterator,
-            empty_iterator,
-            empty_iterator,
-            empty_iterator,
-        ]
 
-        # b has a limit, but c and d doesn't, a isn't ever checked
-        b = registered_limit.RegisteredLimit()
-        b.resource_name = "b"
-        b.default_limit = 2
-        b_iterator = iter([b])
+class TestAsyncEnforcer(base.BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_fixture = self.useFixture(config_fixture.Config(CONF))
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_id='ENDPOINT_ID'
+        )
+        opts.register_opts(CONF)
+        self.fix = self.useFixture(
+            fixture.LimitFixture({'a': 5, 'b': 7}, {'project1': {'a': 2}})
+        )
 
-        self.mock_conn.registered_limits.side_effect = [
-            b_iterator,
-            empty_iterator,
-            empty_iterator,
-        ]
+    def test_usage_callback_must_be_callable(self):
+        self.assertRaises(ValueError, limit.AsyncEnforcer, 5)
 
-        utils = limit._EnforcerUtils()
-        limits = utils.get_project_limits(project_id, ["a", "b"])
-        self.assertEqual([('a', 1), ('b', 2)], limits)
+    def test_enforce_async_callback(self):
+        usage_threads = []
 
-        limits = utils.get_project_limits(project_id, ["c", "d"])
-        self.assertEqual([('c', 0), ('d', 0)], limits)
+        async def usage(project_id, resource_names):
+            usage_threads.append(threading.get_ident())
+            await asyncio.sleep(0)
+            return {'a': 1, 'b': 7}
 
-    def test__get_project_limit_cache(self, cache=True):
-        # Registered limit = 5 and project limit = 3
-        project_id = uuid.uuid4().hex
-        fix = self.useFixture(
-            fixture.LimitFixture({'foo': 5}, {project_id: {'foo': 3}})
-        )
+        enforcer = limit.AsyncEnforcer(usage)
 
-        utils = limit._EnforcerUtils(cache=cache)
-        foo_limit = utils._get_project_limit(project_id, 'foo')
+        async def run():
+            await enforcer.enforce('project1', {'a': 1})
+            with testtools.ExpectedException(exception.ProjectOverLimit):
+                await enforcer.enforce('project1', {'a': 2, 'b': 0})
+            return threading.get_ident()
 
-        assert foo_limit is not None  # narrow type
-        self.assertEqual(3, foo_limit.resource_limit)
-        self.assertEqual(1, fix.mock_conn.limits.call_count)
+        loop_thread = asyncio.run(run())
 
-        # Second call should be cached, so call_count for project limits should
-        # remain 1. When cache is disabled, it should increase to 2
-        foo_limit = utils._get_project_limit(project_id, 'foo')
-        count = 1 if cache else 2
-        self.assertEqual(count, fix.mock_conn.limits.call_count)
+        # The coroutine callback is run on the event loop
+        self.assertEqual([loop_thread, loop_thread], usage_threads)
 
-    def test__get_project_limit_cache_no_cache(self):
-        self.test__get_project_limit_cache(cache=False)
+    def test_enforce_sync_callback(self):
+        usage_threads = []
 
-    def test__get_registered_limit_cache(self, cache=True):
-        # Registered limit = 5 and project limit = 3
-        project_id = uuid.uuid4().hex
-        fix = self.useFixture(
-            fixture.LimitFixture({'foo': 5}, {project_id: {'foo': 3}})
-        )
-
-        utils = limit._EnforcerUtils(cache=cache)
-        foo_limit = utils._get_registered_limit('foo')
+        def usage(project_id, resource_names):
+            usage_threads.append(threading.get_ident())
+            return {'a': 1}
 
-        assert foo_limit is not None  # narrow type
-        self.assertEqual(5, foo_limit.default_limit)
-        self.assertEqual(1, fix.mock_conn.registered_limits.call_count)
+        enforcer = limit.AsyncEnforcer(usage)
+        asyncio.run(enforcer.enforce('project2', {'a': 4}))
 
-        # Second call should be cached, so call_count for project limits should
-        # remain 1. When cache is disabled, it should increase to 2
-        foo_limit = utils._get_registered_limit('foo')
-        count = 1 if cache else 2
-        self.assertEqual(count, fix.mock_conn.registered_limits.call_count)
+        # The plain callback is run in a worker thread
+        self.assertEqual(1, len(usage_threads))
+        self.assertNotEqual(threading.get_ident(), usage_threads[0])
 
-    def test__get_registered_limit_cache_no_cache(self):
-        self.test__get_registered_limit_cache(cache=False)
+    def test_calculate_usage(self):
+        async def usage(project_id, resource_names):
+            return {'a': 1, 'b': 3}
 
-    def test_get_limit_cache(self, cache=True):
-        # No project limit and registered limit = 5
-        fix = self.useFixture(fixture.LimitFixture({'foo': 5}, {}))
-        project_id = uuid.uuid4().hex
+        enforcer = limit.AsyncEnforcer(usage)
+        self.assertEqual(
+            {'a': limit.ProjectUsage(2, 1), 'b': limit.ProjectUsage(7, 3)},
+            asyncio.run(enforcer.calculate_usage('project1', ['a', 'b'])),
+        )
+        self.assertEqual(
+            [('a', 5), ('b', 7)],
+            asyncio.run(enforcer.get_registered_limits(['a', 'b'])),
+        )
+        self.assertEqual(
+            [('a', 2)],
+            asyncio.run(enforcer.get_project_limits('project1', ['a'])),
+        )
 
-        utils = limit._EnforcerUtils(cache=cache)
-        foo_limit = utils._get_limit(project_id, 'foo')
+    def test_enforce_many(self):
+        async def usage(project_id, resource_names):
+            return {'a': 2}
 
-        self.assertEqual(5, foo_limit)
-        self.assertEqual(1, fix.mock_conn.registered_limits.call_count)
+        enforcer = limit.AsyncEnforcer(usage)
+        results = asyncio.run(
+            enforcer.enforce_many({'project1': {'a': 1}, 'project2': {'a': 1}})
+        )
+        self.assertIsInstance(results['project1'], exception.ProjectOverLimit)
+        self.assertIsNone(results['project2'])
+        self.assertEqual(
+            {'project1': {'a': limit.ProjectUsage(2, 2)}},
+            asyncio.run(enforcer.calculate_usage_many(['project1'], ['a'])),
+        )
 
-        # Second call should be cached, so call_count for registered limits
-        # should remain 1. When cache is disabled, it should increase to 2
-        foo_limit = utils._get_limit(project_id, 'foo')
-        self.assertEqual(5, foo_limit)
-        count = 1 if cache else 2
-        self.assertEqual(count, fix.mock_conn.registered_limits.call_count)
+    def test_enforce_many_async_batch_callback(self):
+        calls = []
 
-        # Add a project limit = 1
-        fix.projlimits[project_id] = {'foo': 1}
+        async def usage(project_id, resource_names):
+            raise AssertionError('usage callback should not be called')
 
-        foo_limit = utils._get_limit(project_id, 'foo')
+        async def batch_usage(project_ids, resource_names):
+            calls.append(list(project_ids))
+            return {project_id: {'a': 2} for project_id in project_ids}
 
-        self.assertEqual(1, foo_limit)
-        # Project limits should have been queried 3 times total, once per
-        # _get_limit call
-        self.assertEqual(3, fix.mock_conn.limits.call_count)
+        enforcer = limit.AsyncEnforcer(usage, batch_usage_callback=batch_usage)
+        results = asyncio.run(
+            enforcer.enforce_many({'project1': {'a': 1}, 'project2': {'a': 1}})
+        )
+        self.assertIsInstance(results['project1'], exception.ProjectOverLimit)
+        self.assertIsNone(results['project2'])
+        self.assertEqual([['project1', 'project2']], calls)
 
-        # Fourth call should be cached, so call_count for project limits should
-        # remain 3. When cache is disabled, it should increase to 4
-        foo_limit = utils._get_limit(project_id, 'foo')
-        self.assertEqual(1, foo_limit)
-        count = 3 if cache else 4
-        self.assertEqual(count, fix.mock_conn.limits.call_count)
+    def test_claim(self):
+        async def usage(project_id, resource_names):
+            return {'a': 1}
 
-    def test_get_limit_no_cache(self):
-        self.test_get_limit_cache(cache=False)
+        enforcer = limit.AsyncEnforcer(usage)
 
-    def test_get_limit(self):
-        utils = limit._EnforcerUtils(cache=False)
+        async def run():
+            with await enforcer.claim('project2', {'a': 3}):
+                with testtools.ExpectedException(exception.ProjectOverLimit):
+                    await enforcer.claim('project2', {'a': 2})
+            return await enforcer.claim('project2', {'a': 4})
 
-        mgpl = mock.MagicMock()
-        mgrl = mock.MagicMock()
-        with mock.patch.multiple(
-            utils, _get_project_limit=mgpl, _get_registered_limit=mgrl
-        ):
-            # With a project, we expect the project limit to be
-            # fetched. If present, we never check the registered limit.
-            utils._get_limit('project', 'foo')
-            mgrl.assert_not_called()
-            mgpl.assert_called_once_with('project', 'foo')
+        claim = asyncio.run(run())
+        self.assertTrue(claim.outstanding)
 
-            mgrl.reset_mock()
-            mgpl.reset_mock()
+    def test_lazy(self):
+        self.fix.mock_conn.get_endpoint.reset_mock()
 
-            # With a project, we expect the project limit to be
-            # fetched. If absent, we check the registered limit.
-            mgpl.return_value = None
-            utils._get_limit('project', 'foo')
-            mgrl.assert_called_once_with('foo')
-            mgpl.assert_called_once_with('project', 'foo')
+        async def usage(project_id, resource_names):
+            return {'a': 1}
 
-            mgrl.reset_mock()
-            mgpl.reset_mock()
+        enforcer = limit.AsyncEnforcer(usage, lazy=True)
+        self.fix.mock_conn.get_endpoint.assert_not_called()
 
-            # With no project, we expect to get registered limit but
-            # not project limit
-            utils._get_limit(None, 'foo')
-            mgrl.assert_called_once_with('foo')
-            mgpl.assert_not_called()
+        asyncio.run(enforcer.enforce('project2', {'a': 1}))
+        self.fix.mock_conn.get_endpoint.assert_called_once()
 
-    def test_get_registered_limits_resource_names_none(self):
-        fix = self.useFixture(fixture.LimitFixture({'foo': 5, 'bar': 7}, {}))
+    def test_keystone_does_not_block_event_loop(self):
+        ticked = threading.Event()
 
-        utils = limit._EnforcerUtils()
-        limits = utils.get_registered_limits(None)
+        def slow_limits(**query):
+            # The event loop sets this while we block, unless it is blocked
+            ticked.wait(10)
+            return self.fix.get_projlimit_objects(**query)
 
-        self.assertEqual([('foo', 5), ('bar', 7)], limits)
-        fix.mock_conn.registered_limits.assert_called_once()
+        self.fix.mock_conn.limits.side_effect = slow_limits
 
-        # Call again with resource names to test caching.
-        limits = utils.get_registered_limits(['foo', 'bar'])
+        async def usage(project_id, resource_names):
+            return {'a': 0}
 
-        self.assertEqual([('foo', 5), ('bar', 7)], limits)
-        fix.mock_conn.registered_limits.assert_called_once()
+        enforcer = limit.AsyncEnforcer(usage)
 
-    def test_get_registered_limits_resource_names_none_no_cache(self):
-        fix = self.useFixture(fixture.LimitFixture({'foo': 5, 'bar': 7}, {}))
+        async def tick():
+            await asyncio.sleep(0.01)
+            ticked.set()
 
-        utils = limit._EnforcerUtils(cache=False)
-        limits = utils.get_registered_limits(None)
+        async def run():
+            await asyncio.gather(
+                enforcer.enforce('project1', {'a': 1}), tick()
+            )
 
-        self.assertEqual([('foo', 5), ('bar', 7)], limits)
-        fix.mock_conn.registered_limits.assert_called_once()
+        asyncio.run(run())
+        self.assertTrue(ticked.is_set())
 
-        # Call again with resource names to test caching.
-        limits = utils.get_registered_limits(['foo', 'bar'])
 
-        self.assertEqual([('foo', 5), ('bar', 7)], limits)
-        # First call gets all limits, then one call per resource name.
-        self.assertEqual(3, fix.mock_conn.registered_limits.call_count)
+class TestFlatEnforcer(base.BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_fixture = self.useFixture(config_fixture.Config(CONF))
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_id='ENDPOINT_ID'
+        )
+        opts.register_opts(CONF)
+        self.mock_conn = mock.MagicMock()
+        limit._SDK_CONNECTION = self.mock_conn
 
-    def test_get_registered_limits_resource_names(self):
-        fix = self.useFixture(fixture.LimitFixture({'foo': 5, 'bar': 7}, {}))
+    @mock.patch.object(limit._EnforcerUtils, "get_registered_limits")
+    def test_get_registered_limits(self, mock_get_limits):
+        mock_get_limits.return_value = [("a", 1), ("b", 0), ("c", 2)]
 
-        utils = limit._EnforcerUtils()
-        limits = utils.get_registered_limits(['foo', 'bar'])
+        enforcer = limit._FlatEnforcer(lambda: None)  # type: ignore
+        limits = enforcer.get_registered_limits(["a", "b", "c"])
 
-        self.assertEqual([('foo', 5), ('bar', 7)], limits)
-        fix.mock_conn.registered_limits.assert_called_once()
+        mock_get_limits.assert_called_once_with(["a", "b", "c"])
+        self.assertEqual(mock_get_limits.return_value, limits)
 
-    def test_get_registered_limits_resource_names_no_cache(self):
-        fix = self.useFixture(fixture.LimitFixture({'foo': 5, 'bar': 7}, {}))
+    @mock.patch.object(limit._EnforcerUtils, "get_project_limits")
+    def test_get_project_limits(self, mock_get_limits):
+        project_id = uuid.uuid4().hex
+        mock_get_limits.return_value = [("a", 1), ("b", 0), ("c", 2)]
 
-        utils = limit._EnforcerUtils(cache=False)
-        limits = utils.get_registered_limits(['foo', 'bar'])
+        enforcer = limit._FlatEnforcer(lambda: None)  # type: ignore
+        limits = enforcer.get_project_limits(project_id, ["a", "b", "c"])
 
-        self.assertEqual([('foo', 5), ('bar', 7)], limits)
-        self.assertEqual(2, fix.mock_conn.registered_limits.call_count)
+        mock_get_limits.assert_called_once_with(project_id, ["a", "b", "c"])
+        self.assertEqual(mock_get_limits.return_value, limits)
 
-    def test_get_project_limits_resource_names_none_project_id_none(self):
-        # We consider project_id None to be invalid for "get_project_limits"
-        # because it would require us to make the return format for getting
-        # project limits different than the format for registered limits.
-        # [(name, limit), (name, limit), ...]
-        utils = limit._EnforcerUtils()
-        self.assertRaises(ValueError, utils.get_project_limits, None, None)
+    @mock.patch.object(limit._EnforcerUtils, "get_project_limits")
+    def test_enforce(self, mock_get_limits):
+        mock_usage = mock.MagicMock()
 
-    def test_get_project_limits_resource_names_none(self):
         project_id = uuid.uuid4().hex
-        fix = self.useFixture(
-            fixture.LimitFixture(
-                {'foo': 5, 'bar': 7},
-                {
-                    project_id: {'foo': 2, 'bar': 4},
-                    'other': {'foo': 1, 'bar': 2},
-                },
-            )
-        )
-
-        utils = limit._EnforcerUtils()
-        limits = utils.get_project_limits(project_id, None)
+        deltas = {"a": 1, "b": 1}
+        mock_get_limits.return_value = [("a", 1), ("b", 2)]
+        mock_usage.return_value = {"a": 0, "b": 1}
 
-        self.assertEqual([('foo', 2), ('bar', 4)], limits)
-        fix.mock_conn.limits.assert_called_once()
+        enforcer = limit._FlatEnforcer(mock_usage)
+        enforcer.enforce(project_id, deltas)
 
-        # Call again with resource names to test caching.
-        limits = utils.get_project_limits(project_id, ['foo', 'bar'])
+        self.mock_conn.get_endpoint.assert_called_once_with('ENDPOINT_ID')
+        mock_get_limits.assert_called_once_with(project_id, ["a", "b"])
+        mock_usage.assert_called_once_with(project_id, ["a", "b"])
 
-        self.assertEqual([('foo', 2), ('bar', 4)], limits)
-        fix.mock_conn.limits.assert_called_once()
+    @mock.patch.object(limit._EnforcerUtils, "get_project_limits")
+    def test_enforce_raises_on_over(self, mock_get_limits):
+        mock_usage = mock.MagicMock()
 
-    def test_get_project_limits_resource_names_none_no_cache(self):
         project_id = uuid.uuid4().hex
-        fix = self.useFixture(
-            fixture.LimitFixture(
-                {'foo': 5, 'bar': 7},
-                {
-                    project_id: {'foo': 2, 'bar': 4},
-                    'other': {'foo': 1, 'bar': 2},
-                },
-            )
+        deltas = {"a": 2, "b": 1}
+        mock_get_limits.return_value = [("a", 1), ("b", 2)]
+        mock_usage.return_value = {"a": 0, "b": 1}
+
+        enforcer = limit._FlatEnforcer(mock_usage)
+        e = self.assertRaises(
+            exception.ProjectOverLimit, enforcer.enforce, project_id, deltas
+        )
+        expected = (
+            "Project %s is over a limit for "
+            "[Resource a is over limit of 1 due to current usage 0 "
+            "and delta 2]"
         )
+        self.assertEqual(expected % project_id, str(e))
+        self.assertEqual(project_id, e.project_id)
+        self.assertEqual(1, len(e.over_limit_info_list))
+        over_a = e.over_limit_info_list[0]
+        self.assertEqual("a", over_a.resource_name)
+        self.assertEqual(1, over_a.limit)
+        self.assertEqual(0, over_a.current_usage)
+        self.assertEqual(2, over_a.delta)
 
-        utils = limit._EnforcerUtils(cache=False)
-        limits = utils.get_project_limits(project_id, None)
+    @mock.patch.object(limit._EnforcerUtils, "get_project_limits")
+    def test_enforce_unlimited_limit(self, mock_get_limits):
+        mock_usage = mock.MagicMock()
 
-        self.assertEqual([('foo', 2), ('bar', 4)], limits)
-        fix.mock_conn.limits.assert_called_once()
+        project_id = uuid.uuid4().hex
+        deltas = {"a": 1}
+        mock_get_limits.return_value = [("a", -1)]
+        mock_usage.return_value = {"a": 0}
 
-        # Call again with resource names to test caching.
-        limits = utils.get_project_limits(project_id, ['foo', 'bar'])
+        enforcer = limit._FlatEnforcer(mock_usage)
+        enforcer.enforce(project_id, deltas)
 
-        self.assertEqual([('foo', 2), ('bar', 4)], limits)
-        # First call gets all limits, then one call per resource name.
-        self.assertEqual(3, fix.mock_conn.limits.call_count)
+        mock_get_limits.assert_called_once_with(project_id, ["a"])
+        mock_usage.assert_not_called()
 
-    def test_get_project_limits_resource_names(self):
-        project_id = uuid.uuid4().hex
-        fix = self.useFixture(
-            fixture.LimitFixture(
-                {'foo': 5, 'bar': 7},
-                {
-                    project_id: {'foo': 2, 'bar': 4},
-                    'other': {'foo': 1, 'bar': 2},
-                },
-            )
-        )
+    @mock.patch.object(limit._EnforcerUtils, "get_project_limits")
+    def test_enforce_some_unlimited_limits(self, mock_get_limits):
+        mock_usage = mock.MagicMock()
 
-        utils = limit._EnforcerUtils()
-        limits = utils.get_project_limits(project_id, ['foo', 'bar'])
+        project_id = uuid.uuid4().hex
+        deltas = {"a": 1, "b": 1, "c": 1}
+        mock_get_limits.return_value = [("a", -1), ("b", 2), ("c", -1)]
+        mock_usage.return_value = {"b": 2}
 
-        self.assertEqual([('foo', 2), ('bar', 4)], limits)
-        fix.mock_conn.limits.assert_called_once()
+        enforcer = limit._FlatEnforcer(mock_usage)
+        e = self.assertRaises(
+            exception.ProjectOverLimit, enforcer.enforce, project_id, deltas
+        )
 
-    def test_get_project_limits_resource_names_no_cache(self):
-        project_id = uuid.uuid4().hex
-        fix = self.useFixture(
-            fixture.LimitFixture(
-                {'foo': 5, 'bar': 7},
-                {
-                    project_id: {'foo': 2, 'bar': 4},
-                    'other': {'foo': 1, 'bar': 2},
-                },
-            )
+        mock_usage.assert_called_once_with(project_id, ["b"])
+        self.assertEqual(
+            ["b"], [i.resource_name for i in e.over_limit_info_list]
+        )
+
+    @mock.patch.object(limit._EnforcerUtils, "get_projects_limits")
+    def test_enforce_many_unlimited_limits(self, mock_get_limits):
+        mock_usage = mock.MagicMock()
+        mock_batch_usage = mock.MagicMock()
+        mock_get_limits.return_value = {
+            'project1': [("a", -1), ("b", -1)],
+            'project2': [("a", -1), ("b", 1)],
+        }
+        mock_batch_usage.return_value = {'project2': {"b": 1}}
+
+        enforcer = limit._FlatEnforcer(
+            mock_usage, batch_usage_callback=mock_batch_usage
+        )
+        results = enforcer.enforce_many(
+            {'project1': {"a": 1, "b": 1}, 'project2': {"a": 1, "b": 1}}
+        )
+
+        self.assertIsNone(results['project1'])
+        self.assertIsInstance(results['project2'], exception.ProjectOverLimit)
+        mock_batch_usage.assert_called_once_with(['project2'], ["b"])
+        mock_usage.assert_not_called()
+
+        # Nothing is counted when every resource is unlimited
+        mock_batch_usage.reset_mock()
+        results = enforcer.enforce_many({'project1': {"a": 1}})
+        self.assertEqual({'project1': None}, results)
+        mock_batch_usage.assert_not_called()
+
+    @mock.patch.object(limit._EnforcerUtils, "_get_project_limit")
+    @mock.patch.object(limit._EnforcerUtils, "_get_registered_limit")
+    def test_enforce_raises_on_missing_limit(
+        self, mock_get_reglimit, mock_get_limit
+    ):
+        def mock_usage(*a):
+            return {'a': 1, 'b': 1}
+
+        project_id = uuid.uuid4().hex
+        deltas = {"a": 0, "b": 0}
+        mock_get_reglimit.return_value = None
+        mock_get_limit.return_value = None
+
+        enforcer = limit._FlatEnforcer(mock_usage)
+        self.assertRaises(
+            exception.ProjectOverLimit, enforcer.enforce, project_id, deltas
+        )
+
+        self.assertRaises(
+            exception.ProjectOverLimit, enforcer.enforce, None, deltas
+        )
+
+
+class TestStrictTwoLevelEnforcer(base.BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_fixture = self.useFixture(config_fixture.Config(CONF))
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_id='ENDPOINT_ID'
+        )
+        opts.register_opts(CONF)
+        self.usage: dict[str | None, dict[str, int]] = {
+            'parent': {'a': 2, 'b': 0},
+            'child1': {'a': 5, 'b': 0},
+            'child2': {'a': 2, 'b': 0},
+            'other': {'a': 0, 'b': 0},
+        }
+        self.mock_usage = mock.MagicMock(
+            side_effect=lambda p, r: {x: self.usage[p][x] for x in r}
+        )
+
+    def _get_enforcer(self, projlimits=None, **kwargs):
+        self.fix = self.useFixture(
+            fixture.LimitFixture(
+                {'a': 10, 'b': -1},
+                projlimits or {'child1': {'a': 8}},
+                hierarchy={'parent': ['child1', 'child2']},
+            )
+        )
+        enforcer = limit.Enforcer(self.mock_usage, **kwargs)
+        self.assertIsInstance(enforcer.model, limit._StrictTwoLevelEnforcer)
+        return enforcer
+
+    def _assert_over_limit(self, enforcer, project_id, deltas, expected):
+        e = self.assertRaises(
+            exception.ProjectOverLimit, enforcer.enforce, project_id, deltas
+        )
+        self.assertEqual(project_id, e.project_id)
+        self.assertEqual(
+            expected,
+            [
+                (i.resource_name, i.limit, i.current_usage, i.delta)
+                for i in e.over_limit_info_list
+            ],
+        )
+
+    def test_enforce_child(self):
+        enforcer = self._get_enforcer()
+
+        # The usage of the tree is 9, within the limit of the parent
+        enforcer.enforce('child2', {'a': 1})
+        self._assert_over_limit(
+            enforcer, 'child2', {'a': 2}, [('a', 10, 9, 2)]
+        )
+
+        # The limit of the child applies to its own usage
+        self._assert_over_limit(enforcer, 'child1', {'a': 4}, [('a', 8, 5, 4)])
+        self.usage['child2']['a'] = 0
+        enforcer.enforce('child1', {'a': 3})
+
+    def test_enforce_parent(self):
+        enforcer = self._get_enforcer()
+
+        enforcer.enforce('parent', {'a': 1})
+        self._assert_over_limit(
+            enforcer, 'parent', {'a': 2}, [('a', 10, 9, 2)]
+        )
+
+    def test_enforce_project_without_children(self):
+        enforcer = self._get_enforcer()
+
+        enforcer.enforce('other', {'a': 10})
+        self._assert_over_limit(
+            enforcer, 'other', {'a': 11}, [('a', 10, 0, 11)]
+        )
+        self.mock_usage.assert_called_with('other', ['a'])
+
+    def test_enforce_no_project(self):
+        enforcer = self._get_enforcer()
+
+        self.usage[None] = {'a': 4}
+        enforcer.enforce(None, {'a': 6})
+        self._assert_over_limit(enforcer, None, {'a': 7}, [('a', 10, 4, 7)])
+        self.fix.mock_conn.get_project.assert_not_called()
+
+    def test_enforce_unlimited(self):
+        enforcer = self._get_enforcer(
+            {'child1': {'a': -1}, 'parent': {'a': 10}}
+        )
+
+        enforcer.enforce('child1', {'b': 100})
+        self.mock_usage.assert_not_called()
+
+        # The limit of the parent still applies to the tree
+        self._assert_over_limit(
+            enforcer, 'child1', {'a': 2}, [('a', 10, 9, 2)]
+        )
+
+    def test_enforce_hierarchy_cached(self):
+        enforcer = self._get_enforcer()
+
+        enforcer.enforce('child1', {'a': 1})
+        enforcer.enforce('child2', {'a': 1})
+        enforcer.enforce('parent', {'a': 1})
+
+        # The parent of each child is known from the tree of the parent
+        self.fix.mock_conn.get_project.assert_called_once_with('child1')
+        self.fix.mock_conn.projects.assert_called_once_with(parent_id='parent')
+        stats = enforcer.get_cache_stats()
+        self.assertEqual(3, stats['project_parents'].size)
+        self.assertEqual(1, stats['project_trees'].size)
+
+    def test_enforce_new_child(self):
+        enforcer = self._get_enforcer()
+        enforcer.enforce('child1', {'a': 1})
+
+        # The cached tree of the parent does not have the new child, whose
+        # usage counts towards the tree
+        assert self.fix.hierarchy is not None  # narrow type
+        self.fix.hierarchy['parent'].append('child3')
+        self.usage['child3'] = {'a': 1, 'b': 0}
+        self._assert_over_limit(
+            enforcer, 'child3', {'a': 1}, [('a', 10, 10, 1)]
+        )
+        self.assertEqual(2, self.fix.mock_conn.projects.call_count)
+
+        # The tree is cached with the new child
+        self.usage['child3'] = {'a': 0, 'b': 0}
+        enforcer.enforce('child3', {'a': 1})
+        self.assertEqual(2, self.fix.mock_conn.projects.call_count)
+
+    def test_enforce_no_cache(self):
+        enforcer = self._get_enforcer(cache=False)
+
+        enforcer.enforce('child1', {'a': 1})
+        enforcer.enforce('child1', {'a': 1})
+
+        self.assertEqual(2, self.fix.mock_conn.get_project.call_count)
+        self.assertEqual(2, self.fix.mock_conn.projects.call_count)
+
+    def test_enforce_batch_usage_callback(self):
+        mock_batch_usage = mock.MagicMock(
+            side_effect=lambda p, r: {
+                x: {y: self.usage[x][y] for y in r} for x in p
+            }
+        )
+        enforcer = self._get_enforcer(batch_usage_callback=mock_batch_usage)
+
+        self._assert_over_limit(
+            enforcer, 'child2', {'a': 2}, [('a', 10, 9, 2)]
+        )
+
+        mock_batch_usage.assert_called_once()
+        self.assertEqual(
+            {'parent', 'child1', 'child2'},
+            set(mock_batch_usage.call_args[0][0]),
+        )
+        self.mock_usage.assert_not_called()
+
+    def test_enforce_many(self):
+        enforcer = self._get_enforcer()
+
+        results = enforcer.enforce_many(
+            {
+                'child1': {'a': 1},
+                'child2': {'a': 2},
+                'other': {'a': 2},
+            }
+        )
+
+        self.assertIsNone(results['child1'])
+        self.assertIsInstance(results['child2'], exception.ProjectOverLimit)
+        self.assertIsNone(results['other'])
+        # The usage of each project is counted once
+        self.assertEqual(4, self.mock_usage.call_count)
+
+    def test_calculate_usage(self):
+        enforcer = self._get_enforcer()
+
+        self.assertEqual(
+            {'a': limit.ProjectUsage(8, 5)},
+            enforcer.calculate_usage('child1', ['a']),
+        )
+        # The limit of a top-level project applies to the usage of its tree,
+        # as enforced
+        self.assertEqual(
+            {'a': limit.ProjectUsage(10, 9), 'b': limit.ProjectUsage(-1, 0)},
+            enforcer.calculate_usage('parent', ['a', 'b']),
+        )
+        self._assert_over_limit(
+            enforcer, 'parent', {'a': 2}, [('a', 10, 9, 2)]
+        )
+
+    def test_calculate_usage_many(self):
+        enforcer = self._get_enforcer()
+
+        self.assertEqual(
+            {
+                'parent': {'a': limit.ProjectUsage(10, 9)},
+                'child2': {'a': limit.ProjectUsage(10, 2)},
+                'other': {'a': limit.ProjectUsage(10, 0)},
+            },
+            enforcer.calculate_usage_many(
+                ['parent', 'child2', 'other'], ['a']
+            ),
+        )
+
+    def test_claim_tree(self):
+        enforcer = self._get_enforcer()
+
+        claim = enforcer.claim('child2', {'a': 1})
+        self._assert_over_limit(
+            enforcer, 'child1', {'a': 1}, [('a', 10, 10, 1)]
+        )
+        claim.rollback()
+        enforcer.claim('child1', {'a': 1})
+
+        self.assertEqual('parent', enforcer.model.get_claim_key('child1'))
+        self.assertEqual('parent', enforcer.model.get_claim_key('parent'))
+
+
+class TestDiscoverySnapshot(base.BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_fixture = self.useFixture(config_fixture.Config(CONF))
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_id='ENDPOINT_ID'
+        )
+        opts.register_opts(CONF)
+        self.path = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'discovery.json'
+        )
+        self.config_fixture.config(
+            group='oslo_limit', discovery_cache_file=self.path
+        )
+        self.fix = self.useFixture(fixture.LimitFixture({'a': 5}, {}))
+        self.mock_gem: mock.MagicMock
+        self.mock_gem = limit.Enforcer._get_enforcement_model  # type: ignore
+
+    def _create_enforcer(self):
+        enforcer = limit.Enforcer(lambda p, r: {'a': 1})
+        self.addCleanup(self._join_verifiers, enforcer)
+        return enforcer
+
+    def _join_verifiers(self, enforcer):
+        for verifier in (
+            enforcer._discovery_verifier,
+            enforcer.model._utils._discovery_verifier,
+        ):
+            if verifier is not None:
+                verifier.join(5)
+
+    def test_snapshot_saved(self):
+        self._create_enforcer()
+
+        with open(self.path) as f:
+            snapshot = json.load(f)
+        self.assertEqual('ENDPOINT_ID', snapshot['key']['endpoint_id'])
+        self.assertEqual('flat', snapshot['entries']['model'][1])
+        endpoint = snapshot['entries']['endpoint'][1]
+        self.assertEqual('service_id', endpoint['service_id'])
+        self.assertEqual('region_id', endpoint['region_id'])
+        # No temporary file is left behind
+        self.assertEqual(
+            ['discovery.json'], os.listdir(os.path.dirname(self.path))
+        )
+
+    def test_snapshot_used(self):
+        self._create_enforcer()
+        self.assertEqual(1, self.mock_gem.call_count)
+        self.fix.mock_conn.get_endpoint.reset_mock()
+
+        # Keystone is only queried in the background
+        verifying = threading.Event()
+        release = threading.Event()
+
+        def get_endpoint(endpoint_id):
+            verifying.set()
+            release.wait(5)
+            return self.fix.mock_conn.get_endpoint.return_value
+
+        self.fix.mock_conn.get_endpoint.side_effect = get_endpoint
+        enforcer = self._create_enforcer()
+        release.set()
+        self._join_verifiers(enforcer)
+
+        self.assertTrue(verifying.is_set())
+        self.assertEqual(2, self.mock_gem.call_count)
+        self.fix.mock_conn.get_endpoint.assert_called_once_with('ENDPOINT_ID')
+        enforcer.enforce('project1', {'a': 4})
+        self.assertEqual('service_id', enforcer.model._utils._service_id)
+
+    @mock.patch('time.time')
+    def test_snapshot_expired(self, mock_time):
+        self.config_fixture.config(
+            group='oslo_limit', discovery_cache_expiration_time=60
+        )
+        mock_time.return_value = 1000
+        self._create_enforcer()
+
+        mock_time.return_value = 1060
+        enforcer = self._create_enforcer()
+
+        self.assertIsNone(enforcer._discovery_verifier)
+        self.assertIsNone(enforcer.model._utils._discovery_verifier)
+        self.assertEqual(2, self.mock_gem.call_count)
+        self.assertEqual(2, self.fix.mock_conn.get_endpoint.call_count)
+
+    def test_snapshot_other_endpoint(self):
+        self._create_enforcer()
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_id='OTHER_ENDPOINT_ID'
+        )
+
+        enforcer = self._create_enforcer()
+
+        self.assertIsNone(enforcer._discovery_verifier)
+        self.fix.mock_conn.get_endpoint.assert_called_with('OTHER_ENDPOINT_ID')
+        with open(self.path) as f:
+            snapshot = json.load(f)
+        self.assertEqual('OTHER_ENDPOINT_ID', snapshot['key']['endpoint_id'])
+
+    def test_snapshot_unreadable(self):
+        with open(self.path, 'w') as f:
+            f.write('{not json')
+
+        enforcer = self._create_enforcer()
+
+        self.assertIsNone(enforcer._discovery_verifier)
+        with open(self.path) as f:
+            self.assertEqual('flat', json.load(f)['entries']['model'][1])
+
+    def test_snapshot_outdated_endpoint(self):
+        self._create_enforcer()
+        self.fix.mock_conn.get_endpoint.return_value = endpoint.Endpoint(
+            service_id='new_service_id', region_id='region_id'
+        )
+
+        enforcer = self._create_enforcer()
+        self._join_verifiers(enforcer)
+
+        utils = enforcer.model._utils
+        self.assertEqual('new_service_id', utils._service_id)
+        with open(self.path) as f:
+            snapshot = json.load(f)
+        self.assertEqual(
+            'new_service_id', snapshot['entries']['endpoint'][1]['service_id']
+        )
+
+    def test_snapshot_outdated_model(self):
+        self._create_enforcer()
+        self.mock_gem.return_value = 'strict-two-level'
+
+        enforcer = self._create_enforcer()
+        self._join_verifiers(enforcer)
+
+        self.assertIsInstance(enforcer.model, limit._StrictTwoLevelEnforcer)
+
+    def test_snapshot_outdated_model_slow_initialize(self):
+        self._create_enforcer()
+        self.mock_gem.return_value = 'strict-two-level'
+        verifiers: list[threading.Thread] = []
+
+        def start_discovery_verifier(verify, value):
+            verifier = start(verify, value)
+            verifiers.append(verifier)
+            return verifier
+
+        def discover_endpoint(utils):
+            # The model is checked before the enforcer is initialized
+            for verifier in verifiers:
+                if verifier is not threading.current_thread():
+                    verifier.join(0.5)
+            return discover(utils)
+
+        start = limit._start_discovery_verifier
+        discover = limit._EnforcerUtils._discover_endpoint
+        with (
+            mock.patch.object(
+                limit,
+                '_start_discovery_verifier',
+                side_effect=start_discovery_verifier,
+            ),
+            mock.patch.object(
+                limit._EnforcerUtils,
+                '_discover_endpoint',
+                autospec=True,
+                side_effect=discover_endpoint,
+            ),
+        ):
+            enforcer = self._create_enforcer()
+            self._join_verifiers(enforcer)
+
+        self.assertIsInstance(enforcer.model, limit._StrictTwoLevelEnforcer)
+
+    def test_snapshot_not_writable(self):
+        self.config_fixture.config(
+            group='oslo_limit',
+            discovery_cache_file=os.path.join(self.path, 'missing', 'file'),
+        )
+
+        enforcer = self._create_enforcer()
+
+        enforcer.enforce('project1', {'a': 1})
+
+
+class TestEnforcerUtils(base.BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_fixture = self.useFixture(config_fixture.Config(CONF))
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_id='ENDPOINT_ID'
+        )
+        opts.register_opts(CONF)
+        self.mock_conn = mock.MagicMock()
+        limit._SDK_CONNECTION = self.mock_conn
+
+    def test_get_endpoint(self):
+        fake_endpoint = endpoint.Endpoint()
+        self.mock_conn.get_endpoint.return_value = fake_endpoint
+
+        utils = limit._EnforcerUtils()
+
+        self.assertEqual(fake_endpoint, utils._endpoint)
+        self.mock_conn.get_endpoint.assert_called_once_with('ENDPOINT_ID')
+        self.mock_conn.services.assert_not_called()
+        self.mock_conn.endpoints.assert_not_called()
+
+    def test_enforce_limits_unlimited(self):
+        limit._EnforcerUtils.enforce_limits(
+            'project',
+            [('a', -1)],
+            {'a': 0},
+            {'a': 1},
+        )
+
+    def test_enforce_limits_unlimited_with_usage(self):
+        limit._EnforcerUtils.enforce_limits(
+            'project',
+            [('a', -1)],
+            {'a': 1000},
+            {'a': 500},
+        )
+
+    def test_enforce_limits_still_enforces_finite_limits(self):
+        self.assertRaises(
+            exception.ProjectOverLimit,
+            limit._EnforcerUtils.enforce_limits,
+            'project',
+            [('a', 10)],
+            {'a': 9},
+            {'a': 2},
+        )
+
+    def test_get_endpoint_no_id(self):
+        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
+        self.mock_conn.get_endpoint.side_effect = (
+            os_exceptions.ResourceNotFound
+        )
+
+        self.assertRaises(ValueError, limit._EnforcerUtils)
+        self.mock_conn.get_endpoint.assert_not_called()
+        self.mock_conn.services.assert_not_called()
+        self.mock_conn.endpoints.assert_not_called()
+
+    def test_get_endpoint_missing(self):
+        self.mock_conn.get_endpoint.side_effect = (
+            os_exceptions.ResourceNotFound
+        )
+
+        self.assertRaises(ValueError, limit._EnforcerUtils)
+        self.mock_conn.get_endpoint.assert_called_once_with('ENDPOINT_ID')
+        self.mock_conn.services.assert_not_called()
+        self.mock_conn.endpoints.assert_not_called()
+
+    def test_get_endpoint_lookup_without_service_opts(self):
+        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
+
+        self.assertRaises(ValueError, limit._EnforcerUtils)
+
+        self.mock_conn.get_endpoint.assert_not_called()
+        self.mock_conn.services.assert_not_called()
+        self.mock_conn.endpoints.assert_not_called()
+
+    def test_get_endpoint_lookup(self):
+        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_service_type='SERVICE_TYPE'
+        )
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_service_name='SERVICE_NAME'
+        )
+        fake_service = service.Service(id='SERVICE_ID')
+        self.mock_conn.services.return_value = [fake_service]
+        fake_endpoint = endpoint.Endpoint()
+        self.mock_conn.endpoints.return_value = [fake_endpoint]
+
+        utils = limit._EnforcerUtils()
+
+        self.assertEqual(fake_endpoint, utils._endpoint)
+        self.mock_conn.get_endpoint.assert_not_called()
+        self.mock_conn.services.assert_called_once_with(
+            type='SERVICE_TYPE', name='SERVICE_NAME'
+        )
+        self.mock_conn.endpoints.assert_called_once_with(
+            service_id='SERVICE_ID', region_id=None, interface='public'
+        )
+
+    def test_get_endpoint_lookup_multiple_endpoints(self):
+        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_service_type='SERVICE_TYPE'
+        )
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_service_name='SERVICE_NAME'
+        )
+        fake_service = service.Service(id='SERVICE_ID')
+        self.mock_conn.services.return_value = [fake_service]
+        self.mock_conn.endpoints.return_value = [
+            endpoint.Endpoint(),
+            endpoint.Endpoint(),
+        ]
+
+        self.assertRaises(ValueError, limit._EnforcerUtils)
+
+        self.mock_conn.get_endpoint.assert_not_called()
+        self.mock_conn.services.assert_called_once_with(
+            type='SERVICE_TYPE', name='SERVICE_NAME'
+        )
+        self.mock_conn.endpoints.assert_called_once_with(
+            service_id='SERVICE_ID', region_id=None, interface='public'
+        )
+
+    def test_get_endpoint_lookup_endpoint_not_found(self):
+        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_service_type='SERVICE_TYPE'
+        )
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_service_name='SERVICE_NAME'
+        )
+        fake_service = service.Service(id='SERVICE_ID')
+        self.mock_conn.services.return_value = [fake_service]
+        self.mock_conn.endpoints.return_value = []
+
+        self.assertRaises(ValueError, limit._EnforcerUtils)
+
+        self.mock_conn.get_endpoint.assert_not_called()
+        self.mock_conn.services.assert_called_once_with(
+            type='SERVICE_TYPE', name='SERVICE_NAME'
+        )
+        self.mock_conn.endpoints.assert_called_once_with(
+            service_id='SERVICE_ID', region_id=None, interface='public'
+        )
+
+    def test_get_endpoint_lookup_multiple_service(self):
+        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_service_type='SERVICE_TYPE'
+        )
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_service_name='SERVICE_NAME'
+        )
+        self.mock_conn.services.side_effect = [
+            service.Service(id='SERVICE_ID1'),
+            service.Service(id='SERVICE_ID2'),
+        ]
+
+        self.assertRaises(ValueError, limit._EnforcerUtils)
+
+        self.mock_conn.get_endpoint.assert_not_called()
+        self.mock_conn.services.assert_called_once_with(
+            type='SERVICE_TYPE', name='SERVICE_NAME'
+        )
+        self.mock_conn.endpoints.assert_not_called()
+
+    def test_get_endpoint_lookup_service_not_found(self):
+        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_service_type='SERVICE_TYPE'
+        )
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_service_name='SERVICE_NAME'
+        )
+        self.mock_conn.services.return_value = []
+
+        self.assertRaises(ValueError, limit._EnforcerUtils)
+
+        self.mock_conn.get_endpoint.assert_not_called()
+        self.mock_conn.services.assert_called_once_with(
+            type='SERVICE_TYPE', name='SERVICE_NAME'
+        )
+        self.mock_conn.endpoints.assert_not_called()
+
+    def test_get_endpoint_lookup_with_region(self):
+        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_service_type='SERVICE_TYPE'
+        )
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_service_name='SERVICE_NAME'
+        )
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_region_name='regionOne'
+        )
+        fake_service = service.Service(id='SERVICE_ID')
+        self.mock_conn.services.return_value = [fake_service]
+        fake_endpoint = endpoint.Endpoint()
+        self.mock_conn.endpoints.return_value = [fake_endpoint]
+        fake_region = region.Region(id='REGION_ID')
+        self.mock_conn.get_region.return_value = fake_region
+
+        utils = limit._EnforcerUtils()
+
+        self.assertEqual(fake_endpoint, utils._endpoint)
+        self.mock_conn.get_endpoint.assert_not_called()
+        self.mock_conn.services.assert_called_once_with(
+            type='SERVICE_TYPE', name='SERVICE_NAME'
+        )
+        self.mock_conn.get_region.assert_called_once_with('regionOne')
+        self.mock_conn.endpoints.assert_called_once_with(
+            service_id='SERVICE_ID', region_id='REGION_ID', interface='public'
+        )
+
+    def test_get_endpoint_lookup_with_region_not_found(self):
+        self.config_fixture.config(group='oslo_limit', endpoint_id=None)
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_service_type='SERVICE_TYPE'
+        )
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_service_name='SERVICE_NAME'
+        )
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_region_name='regionOne'
+        )
+        fake_service = service.Service(id='SERVICE_ID')
+        self.mock_conn.services.return_value = [fake_service]
+        fake_endpoint = endpoint.Endpoint()
+        self.mock_conn.endpoints.return_value = [fake_endpoint]
+        self.mock_conn.get_region.side_effect = os_exceptions.ResourceNotFound
+
+        self.assertRaises(ValueError, limit._EnforcerUtils)
+
+        self.mock_conn.get_endpoint.assert_not_called()
+        self.mock_conn.services.assert_called_once_with(
+            type='SERVICE_TYPE', name='SERVICE_NAME'
+        )
+        self.mock_conn.get_region.assert_called_once_with('regionOne')
+        self.mock_conn.endpoints.assert_not_called()
+
+    def test_get_registered_limit_empty(self):
+        self.mock_conn.registered_limits.return_value = iter([])
+
+        utils = limit._EnforcerUtils()
+        reg_limit = utils._get_registered_limit("foo")
+
+        self.assertIsNone(reg_limit)
+
+    def test_get_registered_limit(self):
+        foo = registered_limit.RegisteredLimit()
+        foo.resource_name = "foo"
+        foo.default_limit = 0
+        self.mock_conn.registered_limits.return_value = iter([foo])
+
+        utils = limit._EnforcerUtils()
+        reg_limit = utils._get_registered_limit("foo")
+
+        self.assertEqual(0, reg_limit)
+
+    def test_get_registered_limits(self):
+        fake_endpoint = endpoint.Endpoint(
+            service_id='service_id', region_id='region_id'
+        )
+        self.mock_conn.get_endpoint.return_value = fake_endpoint
+
+        # a and c have limits, b doesn't have one
+        empty_iterator: Iterable[Any] = iter([])
+
+        a = registered_limit.RegisteredLimit()
+        a.resource_name = "a"
+        a.default_limit = 1
+        a_iterator = iter([a])
+
+        c = registered_limit.RegisteredLimit()
+        c.resource_name = "c"
+        c.default_limit = 2
+        c_iterator = iter([c])
+
+        self.mock_conn.registered_limits.side_effect = [
+            a_iterator,
+            empty_iterator,
+            c_iterator,
+        ]
+
+        utils = limit._EnforcerUtils(cache=False)
+        limits = utils.get_registered_limits(["a", "b", "c"])
+        self.assertEqual([('a', 1), ('b', 0), ('c', 2)], limits)
+
+    def test_get_project_limits(self):
+        fake_endpoint = endpoint.Endpoint(
+            service_id='service_id', region_id='region_id'
+        )
+        self.mock_conn.get_endpoint.return_value = fake_endpoint
+        project_id = uuid.uuid4().hex
+
+        # a is a project limit, b, c and d don't have one
+        empty_iterator: Iterable[Any] = iter([])
+
+        a = klimit.Limit()
+        a.resource_name = "a"
+        a.resource_limit = 1
+        a_iterator = iter([a])
+
+        self.mock_conn.limits.side_effect = [
+            a_iterator,
+            empty_iterator,
+            empty_iterator,
+            empty_iterator,
+        ]
+
+        # b has a limit, but c and d doesn't, a isn't ever checked
+        b = registered_limit.RegisteredLimit()
+        b.resource_name = "b"
+        b.default_limit = 2
+        b_iterator = iter([b])
+
+        self.mock_conn.registered_limits.side_effect = [
+            b_iterator,
+            empty_iterator,
+            empty_iterator,
+        ]
+
+        utils = limit._EnforcerUtils()
+        limits = utils.get_project_limits(project_id, ["a", "b"])
+        self.assertEqual([('a', 1), ('b', 2)], limits)
+
+        limits = utils.get_project_limits(project_id, ["c", "d"])
+        self.assertEqual([('c', 0), ('d', 0)], limits)
+
+    def test__get_project_limit_cache(self, cache=True):
+        # Registered limit = 5 and project limit = 3
+        project_id = uuid.uuid4().hex
+        fix = self.useFixture(
+            fixture.LimitFixture({'foo': 5}, {project_id: {'foo': 3}})
+        )
+
+        utils = limit._EnforcerUtils(cache=cache)
+        foo_limit = utils._get_project_limit(project_id, 'foo')
+
+        self.assertEqual(3, foo_limit)
+        self.assertEqual(1, fix.mock_conn.limits.call_count)
+
+        # Second call should be cached, so call_count for project limits should
+        # remain 1. When cache is disabled, it should increase to 2
+        foo_limit = utils._get_project_limit(project_id, 'foo')
+        count = 1 if cache else 2
+        self.assertEqual(count, fix.mock_conn.limits.call_count)
+
+    def test__get_project_limit_cache_no_cache(self):
+        self.test__get_project_limit_cache(cache=False)
+
+    def test__get_registered_limit_cache(self, cache=True):
+        # Registered limit = 5 and project limit = 3
+        project_id = uuid.uuid4().hex
+        fix = self.useFixture(
+            fixture.LimitFixture({'foo': 5}, {project_id: {'foo': 3}})
+        )
+
+        utils = limit._EnforcerUtils(cache=cache)
+        foo_limit = utils._get_registered_limit('foo')
+
+        self.assertEqual(5, foo_limit)
+        self.assertEqual(1, fix.mock_conn.registered_limits.call_count)
+
+        # Second call should be cached, so call_count for project limits should
+        # remain 1. When cache is disabled, it should increase to 2
+        foo_limit = utils._get_registered_limit('foo')
+        count = 1 if cache else 2
+        self.assertEqual(count, fix.mock_conn.registered_limits.call_count)
+
+    def test__get_registered_limit_cache_no_cache(self):
+        self.test__get_registered_limit_cache(cache=False)
+
+    def test_get_limit_cache(self, cache=True):
+        # No project limit and registered limit = 5
+        fix = self.useFixture(fixture.LimitFixture({'foo': 5}, {}))
+        project_id = uuid.uuid4().hex
+
+        utils = limit._EnforcerUtils(cache=cache)
+        foo_limit = utils._get_limit(project_id, 'foo')
+
+        self.assertEqual(5, foo_limit)
+        self.assertEqual(1, fix.mock_conn.registered_limits.call_count)
+
+        # Second call should be cached, so call_count for registered limits
+        # should remain 1. When cache is disabled, it should increase to 2
+        foo_limit = utils._get_limit(project_id, 'foo')
+        self.assertEqual(5, foo_limit)
+        count = 1 if cache else 2
+        self.assertEqual(count, fix.mock_conn.registered_limits.call_count)
+
+        # The project has no limit of its own, which is cached too. When cache
+        # is disabled, project limits are queried once per _get_limit call
+        count = 1 if cache else 2
+        self.assertEqual(count, fix.mock_conn.limits.call_count)
+
+        # Add a project limit = 1
+        fix.projlimits[project_id] = {'foo': 1}
+
+        # The cached registered limit is still used until the cached absence
+        # of a project limit expires. When cache is disabled, the new project
+        # limit is found straight away
+        foo_limit = utils._get_limit(project_id, 'foo')
+        self.assertEqual(5 if cache else 1, foo_limit)
+        count = 1 if cache else 3
+        self.assertEqual(count, fix.mock_conn.limits.call_count)
+
+    def test_get_limit_no_cache(self):
+        self.test_get_limit_cache(cache=False)
+
+    def test_get_limit(self):
+        utils = limit._EnforcerUtils(cache=False)
+
+        mgpl = mock.MagicMock()
+        mgrl = mock.MagicMock()
+        with mock.patch.multiple(
+            utils, _get_project_limit=mgpl, _get_registered_limit=mgrl
+        ):
+            # With a project, we expect the project limit to be
+            # fetched. If present, we never check the registered limit.
+            utils._get_limit('project', 'foo')
+            mgrl.assert_not_called()
+            mgpl.assert_called_once_with('project', 'foo')
+
+            mgrl.reset_mock()
+            mgpl.reset_mock()
+
+            # With a project, we expect the project limit to be
+            # fetched. If absent, we check the registered limit.
+            mgpl.return_value = None
+            utils._get_limit('project', 'foo')
+            mgrl.assert_called_once_with('foo')
+            mgpl.assert_called_once_with('project', 'foo')
+
+            mgrl.reset_mock()
+            mgpl.reset_mock()
+
+            # With no project, we expect to get registered limit but
+            # not project limit
+            utils._get_limit(None, 'foo')
+            mgrl.assert_called_once_with('foo')
+            mgpl.assert_not_called()
+
+    def test_get_registered_limits_resource_names_none(self):
+        fix = self.useFixture(fixture.LimitFixture({'foo': 5, 'bar': 7}, {}))
+
+        utils = limit._EnforcerUtils()
+        limits = utils.get_registered_limits(None)
+
+        self.assertEqual([('foo', 5), ('bar', 7)], limits)
+        fix.mock_conn.registered_limits.assert_called_once()
+
+        # Call again with resource names to test caching.
+        limits = utils.get_registered_limits(['foo', 'bar'])
+
+        self.assertEqual([('foo', 5), ('bar', 7)], limits)
+        fix.mock_conn.registered_limits.assert_called_once()
+
+    def test_get_registered_limits_resource_names_none_no_cache(self):
+        fix = self.useFixture(fixture.LimitFixture({'foo': 5, 'bar': 7}, {}))
+
+        utils = limit._EnforcerUtils(cache=False)
+        limits = utils.get_registered_limits(None)
+
+        self.assertEqual([('foo', 5), ('bar', 7)], limits)
+        fix.mock_conn.registered_limits.assert_called_once()
+
+        # Call again with resource names to test caching.
+        limits = utils.get_registered_limits(['foo', 'bar'])
+
+        self.assertEqual([('foo', 5), ('bar', 7)], limits)
+        # First call gets all limits, then one call per resource name.
+        self.assertEqual(3, fix.mock_conn.registered_limits.call_count)
+
+    def test_get_registered_limits_resource_names(self):
+        fix = self.useFixture(fixture.LimitFixture({'foo': 5, 'bar': 7}, {}))
+
+        utils = limit._EnforcerUtils()
+        limits = utils.get_registered_limits(['foo', 'bar'])
+
+        self.assertEqual([('foo', 5), ('bar', 7)], limits)
+        fix.mock_conn.registered_limits.assert_called_once()
+
+    def test_get_registered_limits_resource_names_no_cache(self):
+        fix = self.useFixture(fixture.LimitFixture({'foo': 5, 'bar': 7}, {}))
+
+        utils = limit._EnforcerUtils(cache=False)
+        limits = utils.get_registered_limits(['foo', 'bar'])
+
+        self.assertEqual([('foo', 5), ('bar', 7)], limits)
+        self.assertEqual(2, fix.mock_conn.registered_limits.call_count)
+
+    def test_get_project_limits_resource_names_none_project_id_none(self):
+        # We consider project_id None to be invalid for "get_project_limits"
+        # because it would require us to make the return format for getting
+        # project limits different than the format for registered limits.
+        # [(name, limit), (name, limit), ...]
+        utils = limit._EnforcerUtils()
+        self.assertRaises(ValueError, utils.get_project_limits, None, None)
+
+    def test_get_project_limits_resource_names_none(self):
+        project_id = uuid.uuid4().hex
+        fix = self.useFixture(
+            fixture.LimitFixture(
+                {'foo': 5, 'bar': 7},
+                {
+                    project_id: {'foo': 2, 'bar': 4},
+                    'other': {'foo': 1, 'bar': 2},
+                },
+            )
+        )
+
+        utils = limit._EnforcerUtils()
+        limits = utils.get_project_limits(project_id, None)
+
+        self.assertEqual([('foo', 2), ('bar', 4)], limits)
+        fix.mock_conn.limits.assert_called_once()
+
+        # Call again with resource names to test caching.
+        limits = utils.get_project_limits(project_id, ['foo', 'bar'])
+
+        self.assertEqual([('foo', 2), ('bar', 4)], limits)
+        fix.mock_conn.limits.assert_called_once()
+
+    def test_get_project_limits_resource_names_none_no_cache(self):
+        project_id = uuid.uuid4().hex
+        fix = self.useFixture(
+            fixture.LimitFixture(
+                {'foo': 5, 'bar': 7},
+                {
+                    project_id: {'foo': 2, 'bar': 4},
+                    'other': {'foo': 1, 'bar': 2},
+                },
+            )
+        )
+
+        utils = limit._EnforcerUtils(cache=False)
+        limits = utils.get_project_limits(project_id, None)
+
+        self.assertEqual([('foo', 2), ('bar', 4)], limits)
+        fix.mock_conn.limits.assert_called_once()
+
+        # Call again with resource names to test caching.
+        limits = utils.get_project_limits(project_id, ['foo', 'bar'])
+
+        self.assertEqual([('foo', 2), ('bar', 4)], limits)
+        # First call gets all limits, then one call per resource name.
+        self.assertEqual(3, fix.mock_conn.limits.call_count)
+
+    def test_get_project_limits_resource_names(self):
+        project_id = uuid.uuid4().hex
+        fix = self.useFixture(
+            fixture.LimitFixture(
+                {'foo': 5, 'bar': 7},
+                {
+                    project_id: {'foo': 2, 'bar': 4},
+                    'other': {'foo': 1, 'bar': 2},
+                },
+            )
+        )
+
+        utils = limit._EnforcerUtils()
+        limits = utils.get_project_limits(project_id, ['foo', 'bar'])
+
+        self.assertEqual([('foo', 2), ('bar', 4)], limits)
+        fix.mock_conn.limits.assert_called_once()
+
+    def test_get_project_limits_resource_names_no_cache(self):
+        project_id = uuid.uuid4().hex
+        fix = self.useFixture(
+            fixture.LimitFixture(
+                {'foo': 5, 'bar': 7},
+                {
+                    project_id: {'foo': 2, 'bar': 4},
+                    'other': {'foo': 1, 'bar': 2},
+                },
+            )
+        )
+
+        utils = limit._EnforcerUtils(cache=False)
+        limits = utils.get_project_limits(project_id, ['foo', 'bar'])
+
+        self.assertEqual([('foo', 2), ('bar', 4)], limits)
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+
+    @mock.patch('time.monotonic')
+    def test_get_limit_cache_expiration(self, mock_monotonic):
+        self.config_fixture.config(
+            group='oslo_limit', cache_expiration_time=60
+        )
+        project_id = uuid.uuid4().hex
+        fix = self.useFixture(
+            fixture.LimitFixture({'foo': 5}, {project_id: {'foo': 3}})
+        )
+        mock_monotonic.return_value = 1000
+
+        utils = limit._EnforcerUtils()
+        self.assertEqual(3, utils._get_limit(project_id, 'foo'))
+        self.assertEqual(5, utils._get_limit(None, 'foo'))
+        self.assertEqual(1, fix.mock_conn.limits.call_count)
+        self.assertEqual(1, fix.mock_conn.registered_limits.call_count)
+
+        # Still within the expiration time, so the cache is used
+        mock_monotonic.return_value = 1059
+        self.assertEqual(3, utils._get_limit(project_id, 'foo'))
+        self.assertEqual(5, utils._get_limit(None, 'foo'))
+        self.assertEqual(1, fix.mock_conn.limits.call_count)
+        self.assertEqual(1, fix.mock_conn.registered_limits.call_count)
+
+        # Once expired, the limits are fetched again and pick up changes
+        fix.projlimits[project_id]['foo'] = 4
+        fix.reglimits['foo'] = 6
+        mock_monotonic.return_value = 1060
+        self.assertEqual(4, utils._get_limit(project_id, 'foo'))
+        self.assertEqual(6, utils._get_limit(None, 'foo'))
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+        self.assertEqual(2, fix.mock_conn.registered_limits.call_count)
+
+    @mock.patch('time.monotonic')
+    def test_refresh_cache(self, mock_monotonic):
+        self.config_fixture.config(
+            group='oslo_limit', cache_expiration_time=60
+        )
+        fix = self.useFixture(
+            fixture.LimitFixture(
+                {'foo': 5}, {'project1': {'foo': 1}, 'project2': {'foo': 2}}
+            )
+        )
+        mock_monotonic.return_value = 1000
+
+        utils = limit._EnforcerUtils()
+        utils._get_limit('project1', 'foo')
+        utils._get_limit(None, 'foo')
+        mock_monotonic.return_value = 1030
+        utils._get_limit('project2', 'foo')
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+
+        # Only project1 and the registered limits expire within 40 seconds
+        fix.projlimits['project1']['foo'] = 10
+        fix.projlimits['project2']['foo'] = 20
+        utils.refresh_cache(40)
+
+        fix.mock_conn.limits.assert_called_with(
+            service_id='service_id',
+            region_id='region_id',
+            project_id='project1',
+        )
+        self.assertEqual(3, fix.mock_conn.limits.call_count)
+        self.assertEqual(2, fix.mock_conn.registered_limits.call_count)
+
+        # The refreshed limit is served from the cache until its new expiry
+        mock_monotonic.return_value = 1089
+        self.assertEqual(10, utils._get_limit('project1', 'foo'))
+        self.assertEqual(3, fix.mock_conn.limits.call_count)
+
+    @mock.patch('time.monotonic')
+    def test_refresh_cache_idle(self, mock_monotonic):
+        self.config_fixture.config(
+            group='oslo_limit', cache_expiration_time=60
+        )
+        fix = self.useFixture(
+            fixture.LimitFixture(
+                {'foo': 5}, {'project1': {'foo': 1}, 'project2': {'foo': 2}}
+            )
+        )
+        mock_monotonic.return_value = 1000
+
+        utils = limit._EnforcerUtils()
+        utils._get_limit('project1', 'foo')
+        utils._get_limit('project2', 'foo')
+        utils.refresh_cache(70)
+        self.assertEqual(4, fix.mock_conn.limits.call_count)
+
+        # Only project2 was used since it was refreshed
+        mock_monotonic.return_value = 1030
+        utils._get_limit('project2', 'foo')
+        utils.refresh_cache(70)
+        fix.mock_conn.limits.assert_called_with(
+            service_id='service_id',
+            region_id='region_id',
+            project_id='project2',
+        )
+        self.assertEqual(5, fix.mock_conn.limits.call_count)
+
+        # Expired limits are reloaded when they are used, not refreshed
+        mock_monotonic.return_value = 1061
+        utils._get_limit('project1', 'foo')
+        mock_monotonic.return_value = 1200
+        utils._get_limit('project2', 'foo')
+        self.assertEqual(7, fix.mock_conn.limits.call_count)
+        utils.refresh_cache(70)
+        fix.mock_conn.limits.assert_called_with(
+            service_id='service_id',
+            region_id='region_id',
+            project_id='project2',
+        )
+        self.assertEqual(8, fix.mock_conn.limits.call_count)
+
+    @mock.patch('threading.Thread')
+    def test_refresh_thread(self, mock_thread):
+        self.useFixture(fixture.LimitFixture({'foo': 5}, {}))
+
+        # No refresh unless limits expire
+        self.config_fixture.config(
+            group='oslo_limit', cache_refresh_interval=30
+        )
+        limit._EnforcerUtils()
+        mock_thread.assert_not_called()
+
+        # No refresh without caching
+        self.config_fixture.config(
+            group='oslo_limit', cache_expiration_time=60
+        )
+        limit._EnforcerUtils(cache=False)
+        mock_thread.assert_not_called()
+
+        utils = limit._EnforcerUtils()
+        mock_thread.assert_called_once_with(
+            target=limit._refresh_cache_periodically,
+            args=(mock.ANY, 30, utils._refresh_stop),
+            name='oslo-limit-cache-refresh',
+            daemon=True,
+        )
+        mock_thread.return_value.start.assert_called_once_with()
+
+    @mock.patch('threading.Thread')
+    def test_refresh_thread_after_fork(self, mock_thread):
+        self.useFixture(fixture.LimitFixture({'foo': 5}, {}))
+        self.config_fixture.config(
+            group='oslo_limit',
+            cache_expiration_time=60,
+            cache_refresh_interval=30,
+        )
+        utils = limit._EnforcerUtils()
+        parent_stop = utils._refresh_stop
+
+        utils._reset_after_fork(True)
+
+        # The refresh thread of the parent process is restarted in the child
+        self.assertIsNot(parent_stop, utils._refresh_stop)
+        self.assertFalse(parent_stop.is_set())
+        self.assertEqual(2, mock_thread.return_value.start.call_count)
+        mock_thread.assert_called_with(
+            target=limit._refresh_cache_periodically,
+            args=(mock.ANY, 30, utils._refresh_stop),
+            name='oslo-limit-cache-refresh',
+            daemon=True,
+        )
+
+    def test_refresh_cache_periodically(self):
+        utils = mock.MagicMock()
+        stop = mock.MagicMock()
+        stop.wait.side_effect = [False, False, True]
+        utils.refresh_cache.side_effect = [Exception('boom'), None]
+
+        limit._refresh_cache_periodically(lambda: utils, 30, stop)
+
+        stop.wait.assert_called_with(30)
+        self.assertEqual(2, utils.refresh_cache.call_count)
+        utils.refresh_cache.assert_called_with(30)
+
+    def test_refresh_cache_periodically_enforcer_gone(self):
+        stop = mock.MagicMock()
+        stop.wait.return_value = False
+
+        limit._refresh_cache_periodically(lambda: None, 30, stop)
+
+        stop.wait.assert_called_once_with(30)
+
+    @mock.patch('time.monotonic')
+    def test_get_limit_negative_cache_expiration(self, mock_monotonic):
+        self.config_fixture.config(
+            group='oslo_limit',
+            cache_expiration_time=600,
+            cache_negative_expiration_time=60,
+        )
+        fix = self.useFixture(
+            fixture.LimitFixture({'foo': 5}, {'project1': {'foo': 1}})
+        )
+        mock_monotonic.return_value = 1000
+
+        utils = limit._EnforcerUtils()
+        self.assertEqual(1, utils._get_limit('project1', 'foo'))
+        self.assertEqual(5, utils._get_limit('project2', 'foo'))
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+
+        # project2 has no project limits, which is cached for a minute
+        fix.projlimits['project1']['foo'] = 2
+        fix.projlimits['project2'] = {'foo': 3}
+        mock_monotonic.return_value = 1059
+        self.assertEqual(1, utils._get_limit('project1', 'foo'))
+        self.assertEqual(5, utils._get_limit('project2', 'foo'))
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+
+        # Only the absence of project limits expires after a minute
+        mock_monotonic.return_value = 1060
+        self.assertEqual(1, utils._get_limit('project1', 'foo'))
+        self.assertEqual(3, utils._get_limit('project2', 'foo'))
+        self.assertEqual(3, fix.mock_conn.limits.call_count)
+
+    def test_get_project_limit_negative_cache(self):
+        fix = self.useFixture(
+            fixture.LimitFixture(
+                {'foo': 5, 'bar': 7}, {'project1': {'foo': 1}}
+            )
+        )
+
+        utils = limit._EnforcerUtils()
+        self.assertIsNone(utils._get_project_limit('project1', 'bar'))
+        self.assertIsNone(utils._get_project_limit('project2', 'foo'))
+        self.assertIsNone(utils._get_project_limit('project2', 'bar'))
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+
+    def test_get_registered_limit_negative_cache(self):
+        fix = self.useFixture(fixture.LimitFixture({'foo': 5}, {}))
+
+        utils = limit._EnforcerUtils()
+        self.assertIsNone(utils._get_registered_limit('bar'))
+        self.assertIsNone(utils._get_registered_limit('baz'))
+        foo_limit = utils._get_registered_limit('foo')
+
+        self.assertEqual(5, foo_limit)
+        fix.mock_conn.registered_limits.assert_called_once_with(
+            service_id='service_id', region_id='region_id'
+        )
+
+        # All registered limits are served from the same snapshot
+        self.assertEqual([('foo', 5)], utils.get_registered_limits(None))
+        fix.mock_conn.registered_limits.assert_called_once()
+
+    def test_project_limit_cache_max_projects(self):
+        self.config_fixture.config(group='oslo_limit', cache_max_projects=2)
+        fix = self.useFixture(
+            fixture.LimitFixture(
+                {'foo': 5},
+                {'project1': {'foo': 1}, 'project2': {'foo': 2}},
+            )
+        )
+
+        utils = limit._EnforcerUtils()
+        self.assertEqual(1, utils._get_limit('project1', 'foo'))
+        self.assertEqual(2, utils._get_limit('project2', 'foo'))
+        # project1 is now the most recently used project
+        self.assertEqual(1, utils._get_limit('project1', 'foo'))
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+
+        # Caching project3 evicts the least recently used project2
+        self.assertEqual(5, utils._get_limit('project3', 'foo'))
+        self.assertEqual(3, fix.mock_conn.limits.call_count)
+        self.assertEqual(1, utils._get_limit('project1', 'foo'))
+        self.assertEqual(3, fix.mock_conn.limits.call_count)
+        self.assertEqual(2, utils._get_limit('project2', 'foo'))
+        self.assertEqual(4, fix.mock_conn.limits.call_count)
+
+        self.assertEqual(
+            limit.CacheStats(size=2, hits=2, misses=4, evictions=2),
+            utils.plimit_cache.stats(),
+        )
+
+    @mock.patch('time.monotonic')
+    def test_project_limit_cache_max_projects_refresh(self, mock_monotonic):
+        self.config_fixture.config(
+            group='oslo_limit', cache_max_projects=2, cache_expiration_time=60
+        )
+        fix = self.useFixture(
+            fixture.LimitFixture(
+                {'foo': 5},
+                {'project1': {'foo': 1}, 'project2': {'foo': 2}},
+            )
+        )
+        mock_monotonic.return_value = 1000
+        utils = limit._EnforcerUtils()
+        self.assertEqual(1, utils._get_limit('project1', 'foo'))
+        mock_monotonic.return_value = 1030
+        self.assertEqual(2, utils._get_limit('project2', 'foo'))
+
+        # Refreshing project1 does not make it more recently used than
+        # project2, which is evicted when caching project3
+        utils.refresh_cache(40)
+        self.assertEqual(3, fix.mock_conn.limits.call_count)
+        self.assertEqual(5, utils._get_limit('project3', 'foo'))
+        self.assertEqual(2, utils._get_limit('project2', 'foo'))
+        self.assertEqual(4, fix.mock_conn.limits.call_count)
+        self.assertEqual(1, utils._get_limit('project1', 'foo'))
+        self.assertEqual(5, fix.mock_conn.limits.call_count)
+
+    def test_project_limit_cache_max_projects_limit_owners(self):
+        self.config_fixture.config(group='oslo_limit', cache_max_projects=2)
+        fix = self.useFixture(
+            fixture.LimitFixture(
+                {'foo': 5},
+                {f'project{i}': {'foo': i} for i in range(10)},
+            )
+        )
+
+        utils = limit._EnforcerUtils()
+        for i in range(10):
+            self.assertEqual(i, utils._get_limit(f'project{i}', 'foo'))
+
+        # Only the owners of the limits still cached are kept
+        self.assertEqual(
+            {
+                fix.get_limit_id('project8', 'foo'): 'project8',
+                fix.get_limit_id('project9', 'foo'): 'project9',
+            },
+            utils._limit_owners,
+        )
+
+    def test_get_limit_zero(self):
+        self.useFixture(
+            fixture.LimitFixture(
+                {'foo': 5, 'bar': 0}, {'project1': {'foo': 0}}
+            )
+        )
+
+        utils = limit._EnforcerUtils()
+        self.assertEqual(0, utils._get_limit('project1', 'foo'))
+        self.assertEqual(0, utils._get_limit('project1', 'bar'))
+        # Only the limit values are cached
+        self.assertEqual({'foo': 0}, utils.plimit_cache.get('project1'))
+
+    def test_cache_prefetch(self):
+        self.config_fixture.config(group='oslo_limit', cache_prefetch=True)
+        fix = self.useFixture(
+            fixture.LimitFixture({'foo': 5}, {'project1': {'foo': 1}})
+        )
+
+        utils = limit._EnforcerUtils()
+        fix.mock_conn.limits.assert_called_once_with(
+            service_id='service_id', region_id='region_id'
+        )
+        self.assertEqual(1, utils._get_limit('project1', 'foo'))
+        self.assertEqual(5, utils._get_limit('project2', 'foo'))
+        fix.mock_conn.limits.assert_called_once()
+
+        # Limits are not prefetched when caching is disabled
+        fix.mock_conn.limits.reset_mock()
+        limit._EnforcerUtils(cache=False)
+        fix.mock_conn.limits.assert_not_called()
+
+    @mock.patch('time.monotonic')
+    def test_warm_cache_expiration(self, mock_monotonic):
+        self.config_fixture.config(
+            group='oslo_limit',
+            cache_expiration_time=600,
+            cache_negative_expiration_time=60,
+        )
+        fix = self.useFixture(
+            fixture.LimitFixture({'foo': 5}, {'project1': {'foo': 1}})
+        )
+        mock_monotonic.return_value = 1000
+
+        utils = limit._EnforcerUtils()
+        utils.warm_cache()
+        self.assertEqual(5, utils._get_limit('project2', 'foo'))
+        self.assertEqual(1, fix.mock_conn.limits.call_count)
+
+        # Projects which were not found have no project limits until the
+        # cached absence of project limits expires
+        fix.projlimits['project2'] = {'foo': 2}
+        mock_monotonic.return_value = 1060
+        self.assertEqual(1, utils._get_limit('project1', 'foo'))
+        self.assertEqual(2, utils._get_limit('project2', 'foo'))
+        fix.mock_conn.limits.assert_called_with(
+            service_id='service_id',
+            region_id='region_id',
+            project_id='project2',
+        )
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+
+    @mock.patch('time.monotonic')
+    def test_warm_cache_refresh(self, mock_monotonic):
+        self.config_fixture.config(
+            group='oslo_limit', cache_expiration_time=60
+        )
+        fix = self.useFixture(
+            fixture.LimitFixture({'foo': 5}, {'project1': {'foo': 1}})
+        )
+        mock_monotonic.return_value = 1000
+
+        utils = limit._EnforcerUtils()
+        utils.warm_cache()
+        utils.refresh_cache(30)
+        self.assertEqual(1, fix.mock_conn.limits.call_count)
+
+        # Everything is reloaded at once when the snapshot is due to expire
+        mock_monotonic.return_value = 1040
+        utils.refresh_cache(30)
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+        fix.mock_conn.limits.assert_called_with(
+            service_id='service_id', region_id='region_id'
+        )
+        self.assertEqual(2, fix.mock_conn.registered_limits.call_count)
+
+    def test_warm_cache_evictions(self):
+        self.config_fixture.config(group='oslo_limit', cache_max_projects=1)
+        fix = self.useFixture(
+            fixture.LimitFixture(
+                {'foo': 5},
+                {'project1': {'foo': 1}, 'project2': {'foo': 2}},
+            )
+        )
+
+        utils = limit._EnforcerUtils()
+        utils.warm_cache()
+
+        # project1 was evicted while loading, so its limits must be looked up
+        # again rather than assumed not to exist
+        self.assertEqual(1, utils._get_limit('project1', 'foo'))
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+        self.assertEqual(5, utils._get_limit('project3', 'foo'))
+        self.assertEqual(3, fix.mock_conn.limits.call_count)
+
+    def test_get_limit_concurrent_misses(self):
+        fix = self.useFixture(fixture.LimitFixture({'foo': 5}, {}))
+        release = threading.Event()
+
+        def slow_limits(**query):
+            release.wait(10)
+            return fix.get_projlimit_objects(**query)
+
+        fix.mock_conn.limits.side_effect = slow_limits
+
+        utils = limit._EnforcerUtils()
+        results = []
+
+        def get_limit():
+            results.append(utils._get_limit('project1', 'foo'))
+
+        threads = [threading.Thread(target=get_limit) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        # Give all the threads the time to miss the cache
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([5] * 10, results)
+        fix.mock_conn.limits.assert_called_once_with(
+            service_id='service_id',
+            region_id='region_id',
+            project_id='project1',
+        )
+        fix.mock_conn.registered_limits.assert_called_once_with(
+            service_id='service_id', region_id='region_id'
+        )
+
+    def test_single_flight_shares_exception(self):
+        single_flight: limit._SingleFlight[int] = limit._SingleFlight()
+        release = threading.Event()
+        func = mock.Mock(side_effect=lambda: release.wait(10) and 1 / 0)
+        errors = []
+
+        def call():
+            try:
+                single_flight.do('key', func)
+            except ZeroDivisionError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        func.assert_called_once_with()
+        self.assertEqual(5, len(errors))
+        self.assertEqual(1, len({id(e) for e in errors}))
+        # Nothing is left in flight once the call has completed
+        self.assertEqual({}, single_flight._calls)
+
+    def test_get_projects_limits_no_cache(self):
+        self.config_fixture.config(group='oslo_limit', bulk_fetch_threshold=2)
+        fix = self.useFixture(
+            fixture.LimitFixture(
+                {'foo': 5}, {'project1': {'foo': 1}, 'project2': {'foo': 2}}
+            )
         )
 
         utils = limit._EnforcerUtils(cache=False)
-        limits = utils.get_project_limits(project_id, ['foo', 'bar'])
+        limits = utils.get_projects_limits(
+            ['project1', 'project2', 'project3'], ['foo', 'bar']
+        )
 
-        self.assertEqual([('foo', 2), ('bar', 4)], limits)
+        self.assertEqual(
+            {
+                'project1': [('foo', 1), ('bar', 0)],
+                'project2': [('foo', 2), ('bar', 0)],
+                'project3': [('foo', 5), ('bar', 0)],
+            },
+            limits,
+        )
+        fix.mock_conn.limits.assert_called_once_with(
+            service_id='service_id', region_id='region_id'
+        )
+        fix.mock_conn.registered_limits.assert_called_once()
+        self.assertEqual(0, len(utils.plimit_cache))
+
+    def test_get_projects_limits_cached(self):
+        self.config_fixture.config(group='oslo_limit', bulk_fetch_threshold=2)
+        fix = self.useFixture(
+            fixture.LimitFixture({'foo': 5}, {'project1': {'foo': 1}})
+        )
+
+        utils = limit._EnforcerUtils()
+        utils._get_limit('project1', 'foo')
+        utils._get_limit('project2', 'foo')
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+
+        # Only project3 is not cached, which is below the threshold
+        limits = utils.get_projects_limits(
+            ['project1', 'project2', 'project3'], ['foo']
+        )
+        self.assertEqual(
+            {
+                'project1': [('foo', 1)],
+                'project2': [('foo', 5)],
+                'project3': [('foo', 5)],
+            },
+            limits,
+        )
+        self.assertEqual(3, fix.mock_conn.limits.call_count)
+        fix.mock_conn.limits.assert_called_with(
+            service_id='service_id',
+            region_id='region_id',
+            project_id='project3',
+        )
+
+    @mock.patch('time.time')
+    @mock.patch('time.monotonic')
+    def test_shared_cache(self, mock_monotonic, mock_time):
+        self.config_fixture.config(
+            group='oslo_limit', cache_expiration_time=60
+        )
+        fix = self.useFixture(
+            fixture.LimitFixture({'foo': 5}, {'project1': {'foo': 1}})
+        )
+        mock_monotonic.return_value = 1000
+        mock_time.return_value = 5000
+        shared_cache = limit_cache.MemoryCache()
+
+        utils = limit._EnforcerUtils(shared_cache=shared_cache)
+        self.assertEqual(1, utils._get_limit('project1', 'foo'))
+        self.assertEqual(5, utils._get_limit('project2', 'foo'))
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+        self.assertEqual(1, fix.mock_conn.registered_limits.call_count)
+        self.assertEqual(
+            [5060, {'foo': 1}],
+            json.loads(
+                shared_cache.get(
+                    'oslo_limit:service_id:region_id:project_limits:project1'
+                )
+                or b''
+            )[:2],
+        )
+
+        # Another process finds the limits in the shared cache, until they
+        # expire
+        mock_time.return_value = 5030
+        other = limit._EnforcerUtils(shared_cache=shared_cache)
+        self.assertEqual(1, other._get_limit('project1', 'foo'))
+        self.assertEqual(5, other._get_limit('project2', 'foo'))
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+        self.assertEqual(1, fix.mock_conn.registered_limits.call_count)
+
+        mock_monotonic.return_value = 1030
+        self.assertEqual(1, other._get_limit('project1', 'foo'))
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+
+        fix.projlimits['project1']['foo'] = 2
+        mock_monotonic.return_value = 1060
+        mock_time.return_value = 5060
+        self.assertEqual(2, other._get_limit('project1', 'foo'))
+        self.assertEqual(3, fix.mock_conn.limits.call_count)
+        self.assertEqual(2, utils._get_limit('project1', 'foo'))
+        self.assertEqual(3, fix.mock_conn.limits.call_count)
+
+    def test_shared_cache_no_cache(self):
+        fix = self.useFixture(fixture.LimitFixture({'foo': 5}, {}))
+        shared_cache = limit_cache.MemoryCache()
+
+        utils = limit._EnforcerUtils(cache=False, shared_cache=shared_cache)
+        utils._get_limit('project1', 'foo')
+        utils._get_limit('project1', 'foo')
+
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+        self.assertIsNone(
+            shared_cache.get('oslo_limit:service_id:region_id:project_limits')
+        )
+
+    def test_shared_cache_failure(self):
+        fix = self.useFixture(fixture.LimitFixture({'foo': 5}, {}))
+        shared_cache = mock.MagicMock()
+        shared_cache.get.side_effect = Exception('unavailable')
+        shared_cache.set.side_effect = Exception('unavailable')
+
+        # Limits are fetched from keystone instead
+        utils = limit._EnforcerUtils(shared_cache=shared_cache)
+        self.assertEqual(5, utils._get_limit('project1', 'foo'))
+        self.assertEqual(1, fix.mock_conn.limits.call_count)
+        self.assertEqual(2, shared_cache.set.call_count)
+
+    @mock.patch('time.time')
+    @mock.patch('time.monotonic')
+    def test_shared_cache_warm_cache(self, mock_monotonic, mock_time):
+        self.config_fixture.config(
+            group='oslo_limit', cache_expiration_time=60
+        )
+        fix = self.useFixture(
+            fixture.LimitFixture({'foo': 5}, {'project1': {'foo': 1}})
+        )
+        mock_monotonic.return_value = 1000
+        mock_time.return_value = 5000
+        shared_cache = limit_cache.MemoryCache()
+
+        utils = limit._EnforcerUtils(shared_cache=shared_cache)
+        utils.warm_cache()
+        other = limit._EnforcerUtils(shared_cache=shared_cache)
+        other.warm_cache()
+
+        self.assertEqual(1, fix.mock_conn.limits.call_count)
+        self.assertEqual(1, fix.mock_conn.registered_limits.call_count)
+        self.assertEqual(1, other._get_limit('project1', 'foo'))
+        self.assertEqual(5, other._get_limit('project2', 'foo'))
+        self.assertEqual(1, fix.mock_conn.limits.call_count)
+
+        # The refresh does not reload limits which expire in the shared cache
+        # within its interval from it
+        mock_monotonic.return_value = 1040
+        mock_time.return_value = 5040
+        other.refresh_cache(30)
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+        self.assertEqual(2, fix.mock_conn.registered_limits.call_count)
+        utils.refresh_cache(30)
+        self.assertEqual(2, fix.mock_conn.limits.call_count)
+        self.assertEqual(2, fix.mock_conn.registered_limits.call_count)
+
+    @mock.patch('time.monotonic')
+    def test_keystone_unavailable_stale_limits(self, mock_monotonic):
+        self.config_fixture.config(
+            group='oslo_limit',
+            cache_expiration_time=60,
+            keystone_unavailable_policy='fail-closed',
+        )
+        fix = self.useFixture(
+            fixture.LimitFixture({'foo': 5}, {'project1': {'foo': 1}})
+        )
+        mock_monotonic.return_value = 1000
+        utils = limit._EnforcerUtils()
+        self.assertEqual(
+            [('foo', 1)], utils.get_project_limits('project1', ['foo'])
+        )
+        self.assertEqual(
+            [('foo', 5)], utils.get_project_limits('project2', ['foo'])
+        )
+
+        # The expired limits are used while keystone is unavailable
+        mock_monotonic.return_value = 1100
+        fix.mock_conn.limits.side_effect = os_exceptions.SDKException('down')
+        fix.mock_conn.registered_limits.side_effect = (
+            os_exceptions.SDKException('down')
+        )
+        self.assertEqual(
+            [('foo', 1)], utils.get_project_limits('project1', ['foo'])
+        )
+        self.assertEqual(
+            [('foo', 5)], utils.get_project_limits('project2', ['foo'])
+        )
+        self.assertEqual(
+            {'project1': [('foo', 1)], 'project2': [('foo', 5)]},
+            utils.get_projects_limits(['project1', 'project2'], ['foo']),
+        )
+        # Projects which were never cached get the limits of the policy
+        self.assertEqual(
+            [('foo', 0)], utils.get_project_limits('project3', ['foo'])
+        )
+
+        # Limits are fetched again once keystone is back
+        fix.mock_conn.limits.side_effect = fix.get_projlimit_objects
+        fix.mock_conn.registered_limits.side_effect = fix.get_reglimit_objects
+        fix.projlimits['project1']['foo'] = 2
+        self.assertEqual(
+            [('foo', 2)], utils.get_project_limits('project1', ['foo'])
+        )
+
+    def test_keystone_unavailable_policy(self):
+        fix = self.useFixture(
+            fixture.LimitFixture({'foo': 5}, {'project1': {'foo': 1}})
+        )
+        fix.mock_conn.limits.side_effect = os_exceptions.SDKException('down')
+
+        for policy, expected in [
+            ('fail-open', -1),
+            ('fail-closed', 0),
+            ('registered-defaults', 5),
+        ]:
+            self.config_fixture.config(
+                group='oslo_limit', keystone_unavailable_policy=policy
+            )
+            utils = limit._EnforcerUtils(cache=False)
+            self.assertEqual(
+                [('foo', expected)],
+                utils.get_project_limits('project1', ['foo']),
+            )
+            self.assertEqual(
+                {'project1': [('foo', expected)]},
+                utils.get_projects_limits(['project1'], ['foo']),
+            )
+
+        self.config_fixture.config(
+            group='oslo_limit', keystone_unavailable_policy='raise'
+        )
+        utils = limit._EnforcerUtils(cache=False)
+        self.assertRaises(
+            os_exceptions.SDKException,
+            utils.get_project_limits,
+            'project1',
+            ['foo'],
+        )
+
+    def test_keystone_unavailable_policy_mixed(self):
+        fix = self.useFixture(
+            fixture.LimitFixture({'cores': 10}, {'good': {'cores': 2}})
+        )
+
+        def limits(project_id=None, **kwargs):
+            if project_id == 'bad':
+                raise os_exceptions.SDKException('down')
+            return fix.get_projlimit_objects(project_id=project_id, **kwargs)
+
+        fix.mock_conn.limits.side_effect = limits
+
+        for policy, expected in [('fail-open', -1), ('fail-closed', 0)]:
+            self.config_fixture.config(
+                group='oslo_limit', keystone_unavailable_policy=policy
+            )
+            utils = limit._EnforcerUtils()
+            utils.get_project_limits('good', ['cores'])
+
+            # The policy applies to the project whose limits are unavailable
+            # only
+            self.assertEqual(
+                {'good': [('cores', 2)], 'bad': [('cores', expected)]},
+                utils.get_projects_limits(['good', 'bad'], ['cores']),
+            )
+
+            enforcer = limit.Enforcer(lambda p, r: {'cores': 5})
+            self.assertRaises(
+                exception.ProjectOverLimit,
+                enforcer.enforce,
+                'good',
+                {'cores': 1},
+            )
+            results = enforcer.enforce_many(
+                {'good': {'cores': 1}, 'bad': {'cores': 1}}
+            )
+            self.assertIsInstance(results['good'], exception.ProjectOverLimit)
+            if policy == 'fail-open':
+                self.assertIsNone(results['bad'])
+            else:
+                self.assertIsInstance(
+                    results['bad'], exception.ProjectOverLimit
+                )
+
+    def test_keystone_unavailable_registered_limits_mixed(self):
+        fix = self.useFixture(
+            fixture.LimitFixture({'a': 5, 'b': 5}, {'project1': {'a': 1}})
+        )
+        fix.mock_conn.registered_limits.side_effect = (
+            os_exceptions.SDKException('down')
+        )
+        self.config_fixture.config(
+            group='oslo_limit', keystone_unavailable_policy='fail-open'
+        )
+        utils = limit._EnforcerUtils()
+
+        # The project limit of a is found, while the registered limit of b
+        # is unavailable
+        self.assertEqual(
+            [('a', 1), ('b', -1)],
+            utils.get_project_limits('project1', ['a', 'b']),
+        )
+        self.assertEqual(
+            {
+                'project1': [('a', 1), ('b', -1)],
+                'project2': [('a', -1), ('b', -1)],
+            },
+            utils.get_projects_limits(['project1', 'project2'], ['a', 'b']),
+        )
+
+    def test_keystone_unavailable_registered_limits(self):
+        fix = self.useFixture(fixture.LimitFixture({'foo': 5}, {}))
+        fix.mock_conn.registered_limits.side_effect = (
+            os_exceptions.SDKException('down')
+        )
+
+        self.config_fixture.config(
+            group='oslo_limit', keystone_unavailable_policy='fail-open'
+        )
+        utils = limit._EnforcerUtils()
+        self.assertEqual([('foo', -1)], utils.get_registered_limits(['foo']))
+        self.assertEqual(
+            [('foo', -1)], utils.get_project_limits('project1', ['foo'])
+        )
+        # All the limits can't be listed
+        self.assertRaises(
+            os_exceptions.SDKException, utils.get_registered_limits, None
+        )
+        self.assertRaises(os_exceptions.SDKException, utils.warm_cache)
+
+        # Registered limits have no defaults
+        self.config_fixture.config(
+            group='oslo_limit',
+            keystone_unavailable_policy='registered-defaults',
+        )
+        utils = limit._EnforcerUtils()
+        self.assertRaises(
+            os_exceptions.SDKException,
+            utils.get_project_limits,
+            'project1',
+            ['foo'],
+        )
+
+    def test_keystone_timeout(self):
+        self.config_fixture.config(
+            group='oslo_limit',
+            keystone_timeout=0.01,
+            keystone_unavailable_policy='fail-closed',
+        )
+        fix = self.useFixture(
+            fixture.LimitFixture({'foo': 5}, {'project1': {'foo': 1}})
+        )
+        slow = threading.Event()
+
+        def get_projlimit_objects(*args, **kwargs):
+            slow.wait(5)
+            return fix.get_projlimit_objects(*args, **kwargs)
+
+        fix.mock_conn.limits.side_effect = get_projlimit_objects
+        utils = limit._EnforcerUtils()
+        self.assertEqual(
+            [('foo', 0)], utils.get_project_limits('project1', ['foo'])
+        )
+        self.assertEqual(
+            [('foo', 0)], utils.get_project_limits('project1', ['foo'])
+        )
+
+        # The call which timed out caches the limits once it completes, and
+        # was not made again while it was in flight.
+        slow.set()
+        assert utils._executor is not None
+        utils._executor.shutdown(wait=True)
+        self.assertEqual(
+            [('foo', 1)], utils.get_project_limits('project1', ['foo'])
+        )
+        self.assertEqual(1, fix.mock_conn.limits.call_count)
+
+    @mock.patch('time.monotonic')
+    def test_stale_while_revalidate(self, mock_monotonic):
+        self.config_fixture.config(
+            group='oslo_limit',
+            cache_expiration_time=60,
+            cache_stale_while_revalidate=True,
+        )
+        fix = self.useFixture(
+            fixture.LimitFixture({'foo': 5}, {'project1': {'foo': 1}})
+        )
+        mock_monotonic.return_value = 1000
+        utils = limit._EnforcerUtils()
+        self.assertEqual(
+            [('foo', 1)], utils.get_project_limits('project1', ['foo'])
+        )
+        self.assertEqual(
+            [('foo', 5)], utils.get_project_limits('project2', ['foo'])
+        )
+
+        # Expired limits are returned while they are fetched again
+        mock_monotonic.return_value = 1100
+        fix.projlimits['project1']['foo'] = 2
+        fix.reglimits['foo'] = 6
+        self.assertEqual(
+            [('foo', 1)], utils.get_project_limits('project1', ['foo'])
+        )
+        self.assertEqual(
+            [('foo', 5)], utils.get_project_limits('project2', ['foo'])
+        )
+        assert utils._executor is not None
+        utils._executor.shutdown(wait=True)
+
+        self.assertEqual(
+            [('foo', 2)], utils.get_project_limits('project1', ['foo'])
+        )
+        self.assertEqual(
+            [('foo', 6)], utils.get_project_limits('project2', ['foo'])
+        )
+        self.assertEqual(2, fix.mock_conn.registered_limits.call_count)
+
+    @mock.patch('time.monotonic')
+    def test_circuit_breaker(self, mock_monotonic):
+        self.config_fixture.config(
+            group='oslo_limit',
+            keystone_failure_threshold=2,
+            keystone_recovery_time=30,
+        )
+        fix = self.useFixture(
+            fixture.LimitFixture({'foo': 5}, {'project1': {'foo': 1}})
+        )
+        mock_monotonic.return_value = 1000
+        fix.mock_conn.limits.side_effect = os_exceptions.SDKException('down')
+        utils = limit._EnforcerUtils(cache=False)
+
+        for _ in range(2):
+            self.assertRaises(
+                os_exceptions.SDKException,
+                utils.get_project_limits,
+                'project1',
+                ['foo'],
+            )
+        self.assertEqual('open', utils.breaker.stats().state)
+
+        # Keystone is not called while the circuit is open
+        self.assertRaises(
+            exception.KeystoneUnavailable,
+            utils.get_project_limits,
+            'project1',
+            ['foo'],
+        )
         self.assertEqual(2, fix.mock_conn.limits.call_count)
+
+        # A failed probe opens the circuit again
+        mock_monotonic.return_value = 1030
+        self.assertRaises(
+            os_exceptions.SDKException,
+            utils.get_project_limits,
+            'project1',
+            ['foo'],
+        )
+        self.assertEqual(3, fix.mock_conn.limits.call_count)
+        self.assertRaises(
+            exception.KeystoneUnavailable,
+            utils.get_project_limits,
+            'project1',
+            ['foo'],
+        )
+
+        # A successful probe closes it
+        mock_monotonic.return_value = 1060
+        fix.mock_conn.limits.side_effect = fix.get_projlimit_objects
+        self.assertEqual(
+            [('foo', 1)], utils.get_project_limits('project1', ['foo'])
+        )
+        self.assertEqual(
+            limit.CircuitBreakerStats('closed', 0, 2, 2), utils.breaker.stats()
+        )
+
+    @mock.patch('time.monotonic')
+    def test_circuit_breaker_half_open(self, mock_monotonic):
+        mock_monotonic.return_value = 1000
+        breaker = limit._CircuitBreaker(1, 30)
+        breaker.record_failure()
+        self.assertRaises(exception.KeystoneUnavailable, breaker.check)
+
+        # A single call is let through while the circuit is half-open
+        mock_monotonic.return_value = 1030
+        breaker.check()
+        self.assertEqual('half-open', breaker.stats().state)
+        self.assertRaises(exception.KeystoneUnavailable, breaker.check)
+        breaker.record_success()
+        breaker.check()
+        breaker.check()
+
+    def test_circuit_breaker_disabled(self):
+        breaker = limit._CircuitBreaker()
+        for _ in range(10):
+            breaker.record_failure()
+        breaker.check()
+        self.assertEqual(
+            limit.CircuitBreakerStats('closed', 10, 0, 0), breaker.stats()
+        )
+
+    def test_circuit_breaker_timeout(self):
+        self.config_fixture.config(
+            group='oslo_limit',
+            keystone_timeout=0.01,
+            keystone_failure_threshold=1,
+        )
+        fix = self.useFixture(fixture.LimitFixture({'foo': 5}, {}))
+        slow = threading.Event()
+        self.addCleanup(slow.set)
+        fix.mock_conn.limits.side_effect = lambda **kwargs: slow.wait(5)
+        utils = limit._EnforcerUtils()
+
+        # Calls which time out are failures, even if they are still running
+        self.assertRaises(
+            TimeoutError, utils.get_project_limits, 'project1', ['foo']
+        )
+        self.assertEqual('open', utils.breaker.stats().state)
+
+    def test_circuit_breaker_timeout_waiters(self):
+        self.config_fixture.config(
+            group='oslo_limit',
+            keystone_timeout=0.5,
+            keystone_failure_threshold=3,
+        )
+        fix = self.useFixture(fixture.LimitFixture({'foo': 5}, {}))
+        slow = threading.Event()
+        self.addCleanup(slow.set)
+
+        def limits(**kwargs):
+            slow.wait(5)
+            raise os_exceptions.SDKException('keystone is down')
+
+        fix.mock_conn.limits.side_effect = limits
+        utils = limit._EnforcerUtils()
+        errors = []
+
+        def get_project_limits():
+            try:
+                utils.get_project_limits('project1', ['foo'])
+            except TimeoutError as e:
+                errors.append(e)
+
+        threads = [
+            threading.Thread(target=get_project_limits) for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(3, len(errors))
+        self.assertEqual(1, fix.mock_conn.limits.call_count)
+
+        # The call which all the callers waited for is a single failure,
+        # including once it fails
+        self.assertEqual(
+            limit.CircuitBreakerStats('closed', 1, 0, 0),
+            utils.breaker.stats(),
+        )
+        slow.set()
+        assert utils._executor is not None
+        utils._executor.shutdown(wait=True)
+        self.assertEqual(
+            limit.CircuitBreakerStats('closed', 1, 0, 0),
+            utils.breaker.stats(),
+        )
+
+    @mock.patch('time.monotonic')
+    def test_keystone_enforce_budget(self, mock_monotonic):
+        self.config_fixture.config(
+            group='oslo_limit',
+            keystone_enforce_budget=1,
+            keystone_unavailable_policy='fail-closed',
+        )
+        fix = self.useFixture(
+            fixture.LimitFixture({'foo': 5}, {'project1': {'foo': 1}})
+        )
+        mock_monotonic.return_value = 1000
+        utils = limit._EnforcerUtils()
+
+        with limit._keystone_budget(1):
+            # Nested checks share the budget
+            with limit._keystone_budget(1):
+                mock_monotonic.return_value = 1001
+            self.assertEqual(
+                [('foo', 0)], utils.get_project_limits('project1', ['foo'])
+            )
+        fix.mock_conn.limits.assert_not_called()
+        self.assertEqual('closed', utils.breaker.stats().state)
+
+        with limit._keystone_budget(1):
+            self.assertEqual(
+                [('foo', 1)], utils.get_project_limits('project1', ['foo'])
+            )
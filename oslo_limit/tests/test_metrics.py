@@ -0,0 +1,335 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from collections import Counter
+from typing import Any
+from unittest import mock
+
+from openstack import exceptions as os_exceptions
+from oslo_config import cfg
+from oslo_config import fixture as config_fixture
+from oslotest import base
+import prometheus_client
+
+from oslo_limit import exception
+from oslo_limit import fixture
+from oslo_limit import limit
+from oslo_limit import metrics
+from oslo_limit import opts
+
+CONF = cfg.CONF
+
+
+class RecordingMetrics(metrics.Metrics):
+    def __init__(self):
+        self.counters: Counter[tuple[Any, ...]] = Counter()
+        self.timings: Counter[tuple[Any, ...]] = Counter()
+
+    @staticmethod
+    def _key(name, tags):
+        return (name, *sorted((tags or {}).items()))
+
+    def increment(self, name, value=1, tags=None):
+        self.counters[self._key(name, tags)] += value
+
+    def timing(self, name, seconds, tags=None):
+        self.timings[self._key(name, tags)] += 1
+
+
+class TestEnforcerMetrics(base.BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_fixture = self.useFixture(config_fixture.Config(CONF))
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_id='ENDPOINT_ID'
+        )
+        opts.register_opts(CONF)
+        self.metrics = RecordingMetrics()
+
+    def test_enforce(self):
+        self.useFixture(
+            fixture.LimitFixture({'a': 5, 'b': 7}, {'project1': {'a': 1}})
+        )
+        enforcer = limit.Enforcer(
+            lambda p, r: {'a': 1, 'b': 0}, metrics=self.metrics
+        )
+
+        enforcer.enforce('project2', {'a': 1, 'b': 1})
+        self.assertRaises(
+            exception.ProjectOverLimit,
+            enforcer.enforce,
+            'project1',
+            {'a': 1, 'b': 1},
+        )
+
+        for phase in ('total', 'limits', 'usage', 'check'):
+            self.assertEqual(
+                2, self.metrics.timings[('enforce.duration', ('phase', phase))]
+            )
+        self.assertEqual(
+            {
+                ('cache.misses', ('cache', 'project_limits')): 2,
+                ('cache.misses', ('cache', 'registered_limits')): 1,
+                ('cache.hits', ('cache', 'project_limits')): 2,
+                ('cache.hits', ('cache', 'registered_limits')): 2,
+                (
+                    'keystone.requests',
+                    ('request', 'limits'),
+                    ('result', 'success'),
+                ): 2,
+                (
+                    'keystone.requests',
+                    ('request', 'registered_limits'),
+                    ('result', 'success'),
+                ): 1,
+                ('over_limit', ('resource', 'a')): 1,
+            },
+            dict(self.metrics.counters),
+        )
+        self.assertEqual(
+            2,
+            self.metrics.timings[('keystone.duration', ('request', 'limits'))],
+        )
+
+    def test_enforce_many(self):
+        self.useFixture(fixture.LimitFixture({'a': 1}, {}))
+        enforcer = limit.Enforcer(lambda p, r: {'a': 1}, metrics=self.metrics)
+
+        enforcer.enforce_many({'project1': {'a': 1}, 'project2': {'a': 1}})
+
+        self.assertEqual(
+            2, self.metrics.counters[('over_limit', ('resource', 'a'))]
+        )
+        self.assertEqual(
+            1, self.metrics.timings[('enforce.duration', ('phase', 'total'))]
+        )
+
+    def test_keystone_failure(self):
+        fix = self.useFixture(fixture.LimitFixture({'a': 1}, {}))
+        fix.mock_conn.limits.side_effect = os_exceptions.SDKException('down')
+        enforcer = limit.Enforcer(lambda p, r: {'a': 0}, metrics=self.metrics)
+
+        self.assertRaises(
+            os_exceptions.SDKException, enforcer.enforce, 'project1', {'a': 1}
+        )
+
+        self.assertEqual(
+            1,
+            self.metrics.counters[
+                (
+                    'keystone.requests',
+                    ('request', 'limits'),
+                    ('result', 'failure'),
+                )
+            ],
+        )
+
+    def test_cache_evictions(self):
+        self.config_fixture.config(group='oslo_limit', cache_max_projects=1)
+        self.useFixture(fixture.LimitFixture({'a': 5}, {}))
+        enforcer = limit.Enforcer(lambda p, r: {'a': 0}, metrics=self.metrics)
+
+        for project_id in ('project1', 'project2', 'project3'):
+            enforcer.enforce(project_id, {'a': 1})
+
+        self.assertEqual(
+            2,
+            self.metrics.counters[
+                ('cache.evictions', ('cache', 'project_limits'))
+            ],
+        )
+
+    def test_usage_cache(self):
+        self.config_fixture.config(
+            group='oslo_limit', usage_cache_expiration_time=60
+        )
+        self.useFixture(fixture.LimitFixture({'a': 5, 'b': 5}, {}))
+        enforcer = limit.Enforcer(
+            lambda p, r: {'a': 0, 'b': 0}, metrics=self.metrics
+        )
+
+        enforcer.enforce('project1', {'a': 1, 'b': 1})
+        enforcer.enforce('project1', {'a': 1})
+
+        self.assertEqual(
+            2, self.metrics.counters[('cache.misses', ('cache', 'usage'))]
+        )
+        self.assertEqual(
+            1, self.metrics.counters[('cache.hits', ('cache', 'usage'))]
+        )
+
+    def test_metrics_failure(self):
+        self.useFixture(fixture.LimitFixture({'a': 1}, {}))
+        failing_metrics = mock.Mock(spec=metrics.Metrics)
+        failing_metrics.increment.side_effect = ValueError('broken')
+        failing_metrics.timing.side_effect = ValueError('broken')
+        enforcer = limit.Enforcer(
+            lambda p, r: {'a': 0}, metrics=failing_metrics
+        )
+
+        # Failures to report metrics are logged, and do not fail checks
+        with self.assertLogs('oslo.limit.limit', 'DEBUG') as logs:
+            enforcer.enforce('project1', {'a': 1})
+            self.assertRaises(
+                exception.ProjectOverLimit,
+                enforcer.enforce,
+                'project1',
+                {'a': 2},
+            )
+
+        self.assertTrue(failing_metrics.increment.called)
+        self.assertTrue(failing_metrics.timing.called)
+        levels = [record.levelname for record in logs.records]
+        self.assertEqual('WARNING', levels[0])
+        self.assertEqual({'DEBUG'}, set(levels[1:]))
+
+
+class TestMetrics(base.BaseTestCase):
+    @mock.patch('time.perf_counter')
+    def test_timer_discarded(self, mock_perf_counter):
+        class CountingMetrics(metrics.Metrics):
+            def increment(self, name, value=1, tags=None):
+                pass
+
+        # Blocks are not timed when timings are discarded
+        for discarding_metrics in (metrics.Metrics(), CountingMetrics()):
+            with discarding_metrics.timer('enforce.duration'):
+                pass
+        mock_perf_counter.assert_not_called()
+
+    def test_timer(self):
+        recording_metrics = RecordingMetrics()
+
+        with recording_metrics.timer('enforce.duration', {'phase': 'usage'}):
+            pass
+        self.assertRaises(
+            ValueError,
+            self._raise_in_timer,
+            recording_metrics.timer('enforce.duration', {'phase': 'usage'}),
+        )
+
+        self.assertEqual(
+            2,
+            recording_metrics.timings[
+                ('enforce.duration', ('phase', 'usage'))
+            ],
+        )
+
+    @staticmethod
+    def _raise_in_timer(timer):
+        with timer:
+            raise ValueError('failed')
+
+
+class TestStatsdMetrics(base.BaseTestCase):
+    def test_metrics(self):
+        client = mock.Mock()
+        statsd_metrics = metrics.StatsdMetrics(client)
+
+        statsd_metrics.increment(
+            'keystone.requests',
+            tags={'request': 'limits', 'result': 'success'},
+        )
+        statsd_metrics.increment('over_limit', 2, tags={'resource': 'a.b'})
+        statsd_metrics.timing('enforce.duration', 0.5, {'phase': 'usage'})
+
+        client.incr.assert_has_calls(
+            [
+                mock.call('oslo_limit.keystone.requests.limits.success', 1),
+                mock.call('oslo_limit.over_limit.a_b', 2),
+            ]
+        )
+        client.timing.assert_called_once_with(
+            'oslo_limit.enforce.duration.usage', 500
+        )
+
+    def test_no_prefix(self):
+        client = mock.Mock()
+
+        metrics.StatsdMetrics(client, prefix='').increment('over_limit')
+
+        client.incr.assert_called_once_with('over_limit', 1)
+
+
+class TestPrometheusMetrics(base.BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_fixture = self.useFixture(config_fixture.Config(CONF))
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_id='ENDPOINT_ID'
+        )
+        opts.register_opts(CONF)
+
+    def test_metrics(self):
+        registry = prometheus_client.CollectorRegistry()
+        prometheus_metrics = metrics.PrometheusMetrics(registry)
+
+        prometheus_metrics.increment('over_limit', tags={'resource': 'a'})
+        prometheus_metrics.increment('over_limit', 2, tags={'resource': 'a'})
+        prometheus_metrics.increment('keystone.requests')
+        with prometheus_metrics.timer('enforce.duration', {'phase': 'usage'}):
+            pass
+
+        self.assertEqual(
+            3,
+            registry.get_sample_value(
+                'oslo_limit_over_limit_total', {'resource': 'a'}
+            ),
+        )
+        self.assertEqual(
+            1, registry.get_sample_value('oslo_limit_keystone_requests_total')
+        )
+        self.assertEqual(
+            1,
+            registry.get_sample_value(
+                'oslo_limit_enforce_duration_seconds_count', {'phase': 'usage'}
+            ),
+        )
+
+    def test_shared_registry(self):
+        registry = prometheus_client.CollectorRegistry()
+        self.useFixture(fixture.LimitFixture({'a': 1}, {}))
+        enforcers = [
+            limit.Enforcer(
+                lambda p, r: {'a': 1},
+                metrics=metrics.PrometheusMetrics(registry),
+            )
+            for _ in range(2)
+        ]
+
+        for enforcer in enforcers:
+            self.assertRaises(
+                exception.ProjectOverLimit,
+                enforcer.enforce,
+                'project1',
+                {'a': 1},
+            )
+
+        self.assertEqual(
+            2,
+            registry.get_sample_value(
+                'oslo_limit_over_limit_total', {'resource': 'a'}
+            ),
+        )
+
+    def test_namespaces(self):
+        registry = prometheus_client.CollectorRegistry()
+
+        metrics.PrometheusMetrics(registry).increment('over_limit')
+        metrics.PrometheusMetrics(registry, namespace='nova').increment(
+            'over_limit'
+        )
+
+        self.assertEqual(
+            1, registry.get_sample_value('oslo_limit_over_limit_total')
+        )
+        self.assertEqual(1, registry.get_sample_value('nova_over_limit_total'))
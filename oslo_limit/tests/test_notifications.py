@@ -0,0 +1,261 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+from unittest import mock
+
+from oslo_config import cfg
+from oslo_config import fixture as config_fixture
+import oslo_messaging
+from oslotest import base
+
+from oslo_limit import cache as limit_cache
+from oslo_limit import fixture
+from oslo_limit import limit
+from oslo_limit import notifications
+from oslo_limit import opts
+
+CONF = cfg.CONF
+
+
+class TestLimitNotificationEndpoint(base.BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_fixture = self.useFixture(config_fixture.Config(CONF))
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_id='ENDPOINT_ID'
+        )
+        opts.register_opts(CONF)
+        self.fix = self.useFixture(
+            fixture.LimitFixture(
+                {'a': 5, 'b': 7}, {'project1': {'a': 1, 'b': 2}}
+            )
+        )
+        self.enforcer = limit.Enforcer(lambda p, r: {'a': 0, 'b': 0})
+        self.endpoint = notifications.LimitNotificationEndpoint(self.enforcer)
+
+    def _notify(self, event_type, limit_id):
+        # Keystone sends CADF notifications by default
+        payload = {
+            'typeURI': 'http://schemas.dmtf.org/cloud/audit/1.0/event',
+            'target': {'id': limit_id, 'typeURI': 'data/security/account'},
+            'resource_info': limit_id,
+        }
+        self.endpoint.info(
+            {}, 'identity.keystone-host', event_type, payload, {}
+        )
+
+    def _get_limits(self, project_id):
+        return dict(self.enforcer.get_project_limits(project_id, ['a', 'b']))
+
+    def test_limit_updated(self):
+        self.assertEqual({'a': 1, 'b': 2}, self._get_limits('project1'))
+        self.assertEqual({'a': 5, 'b': 7}, self._get_limits('project2'))
+        self.assertEqual(2, self.fix.mock_conn.limits.call_count)
+
+        self.fix.projlimits['project1']['a'] = 3
+        self._notify(
+            'identity.limit.updated', self.fix.get_limit_id('project1', 'a')
+        )
+
+        # Only the limits of project1 are fetched again
+        self.assertEqual({'a': 3, 'b': 2}, self._get_limits('project1'))
+        self.assertEqual({'a': 5, 'b': 7}, self._get_limits('project2'))
+        self.assertEqual(3, self.fix.mock_conn.limits.call_count)
+        self.fix.mock_conn.get_limit.assert_not_called()
+
+    def test_limit_created(self):
+        self.assertEqual({'a': 5, 'b': 7}, self._get_limits('project2'))
+
+        self.fix.projlimits['project2'] = {'a': 4}
+        self._notify(
+            'identity.limit.created', self.fix.get_limit_id('project2', 'a')
+        )
+
+        self.assertEqual({'a': 4, 'b': 7}, self._get_limits('project2'))
+        self.fix.mock_conn.get_limit.assert_called_once_with(
+            self.fix.get_limit_id('project2', 'a')
+        )
+
+    def test_limit_deleted(self):
+        self.assertEqual({'a': 1, 'b': 2}, self._get_limits('project1'))
+        limit_id = self.fix.get_limit_id('project1', 'a')
+
+        del self.fix.projlimits['project1']['a']
+        self._notify('identity.limit.deleted', limit_id)
+
+        self.assertEqual({'a': 5, 'b': 2}, self._get_limits('project1'))
+        self.fix.mock_conn.get_limit.assert_not_called()
+
+    def test_limit_not_cached(self):
+        self.assertEqual({'a': 1, 'b': 2}, self._get_limits('project1'))
+
+        # Deleted limits which were not cached do not apply to cached projects
+        self._notify('identity.limit.deleted', 'unknown')
+        # Created limits of other endpoints do not apply either
+        self.fix.mock_conn.get_limit.side_effect = None
+        self.fix.mock_conn.get_limit.return_value = mock.Mock(
+            service_id='other_service_id',
+            region_id='region_id',
+            project_id='project1',
+        )
+        self._notify('identity.limit.created', 'other')
+
+        self.assertEqual({'a': 1, 'b': 2}, self._get_limits('project1'))
+        self.assertEqual(1, self.fix.mock_conn.limits.call_count)
+
+    def test_registered_limit_updated(self):
+        self.assertEqual({'a': 5, 'b': 7}, self._get_limits('project2'))
+
+        self.fix.reglimits['a'] = 6
+        self._notify(
+            'identity.registered_limit.updated',
+            self.fix.get_limit_id(None, 'a'),
+        )
+
+        self.assertEqual({'a': 6, 'b': 7}, self._get_limits('project2'))
+        self.assertEqual(2, self.fix.mock_conn.registered_limits.call_count)
+        self.assertEqual(1, self.fix.mock_conn.limits.call_count)
+
+    def test_limit_created_warm_cache(self):
+        self.enforcer.warm_cache()
+        self.assertEqual({'a': 5, 'b': 7}, self._get_limits('project2'))
+
+        self.fix.projlimits['project2'] = {'b': 3}
+        self._notify(
+            'identity.limit.created', self.fix.get_limit_id('project2', 'b')
+        )
+
+        # The project is not taken to have no project limits
+        self.assertEqual({'a': 5, 'b': 3}, self._get_limits('project2'))
+        self.assertEqual({'a': 1, 'b': 2}, self._get_limits('project1'))
+        self.assertEqual(2, self.fix.mock_conn.limits.call_count)
+
+    def test_shared_cache(self):
+        shared_cache = limit_cache.MemoryCache()
+        enforcer = limit.Enforcer(
+            lambda p, r: {'a': 0, 'b': 0}, shared_cache=shared_cache
+        )
+        enforcer.get_project_limits('project1', ['a'])
+        key = 'oslo_limit:service_id:region_id:project_limits:project1'
+        self.assertIsNotNone(shared_cache.get(key))
+
+        # Limits read from the shared cache are evicted too
+        other = limit.Enforcer(
+            lambda p, r: {'a': 0, 'b': 0}, shared_cache=shared_cache
+        )
+        other.get_project_limits('project1', ['a'])
+        self.assertEqual(1, self.fix.mock_conn.limits.call_count)
+
+        notifications.LimitNotificationEndpoint(other).info(
+            {},
+            'identity.keystone-host',
+            'identity.limit.deleted',
+            {'resource_info': self.fix.get_limit_id('project1', 'a')},
+            {},
+        )
+
+        self.assertIsNone(shared_cache.get(key))
+        self.assertIsNone(other._model._utils.plimit_cache.get('project1'))  # type: ignore
+
+    def test_lazy_enforcer(self):
+        enforcer = limit.Enforcer(lambda p, r: {'a': 0}, lazy=True)
+        notifications.LimitNotificationEndpoint(enforcer).info(
+            {}, 'identity.keystone-host', 'identity.limit.created', {}, {}
+        )
+        notifications.LimitNotificationEndpoint(enforcer).info(
+            {},
+            'identity.keystone-host',
+            'identity.limit.created',
+            {'resource_info': 'limit_id'},
+            {},
+        )
+
+        self.fix.mock_conn.get_limit.assert_not_called()
+        self.assertIsNone(enforcer._model)
+
+    def test_other_events(self):
+        with mock.patch.object(self.enforcer, 'invalidate_limit') as mock_il:
+            self._notify('identity.project.updated', 'project1')
+            self._notify('identity.limit.updated', None)
+
+        mock_il.assert_not_called()
+
+    def test_failure(self):
+        enforcers = [mock.Mock(), mock.Mock()]
+        enforcers[0].invalidate_limit.side_effect = Exception('boom')
+        endpoint = notifications.LimitNotificationEndpoint(*enforcers)
+
+        endpoint.info(
+            {},
+            'identity.keystone-host',
+            'identity.registered_limit.deleted',
+            {'resource_info': 'limit_id'},
+            {},
+        )
+
+        for enforcer in enforcers:
+            enforcer.invalidate_limit.assert_called_once_with(
+                'limit_id', registered=True, deleted=True
+            )
+
+
+class TestNotificationListener(base.BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_fixture = self.useFixture(config_fixture.Config(CONF))
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_id='ENDPOINT_ID'
+        )
+        opts.register_opts(CONF)
+
+    def test_listener(self):
+        fix = self.useFixture(
+            fixture.LimitFixture({'a': 5}, {'project1': {'a': 1}})
+        )
+        enforcer = limit.Enforcer(lambda p, r: {'a': 0})
+        self.assertEqual(
+            [('a', 1)], enforcer.get_project_limits('project1', ['a'])
+        )
+        transport = oslo_messaging.get_notification_transport(
+            CONF, url='fake://'
+        )
+        self.addCleanup(transport.cleanup)
+        notifier = oslo_messaging.Notifier(
+            transport,
+            publisher_id='identity.keystone-host',
+            driver='messaging',
+            topics=['notifications'],
+        )
+
+        listener = notifications.get_notification_listener(
+            transport, [enforcer]
+        )
+        listener.start()
+        self.addCleanup(listener.wait)
+        self.addCleanup(listener.stop)
+
+        fix.projlimits['project1']['a'] = 2
+        notifier.info(
+            {},
+            'identity.limit.updated',
+            {'resource_info': fix.get_limit_id('project1', 'a')},
+        )
+
+        utils = enforcer._model._utils  # type: ignore
+        deadline = time.monotonic() + 5
+        while utils.plimit_cache.get('project1') is not None:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(
+            [('a', 2)], enforcer.get_project_limits('project1', ['a'])
+        )
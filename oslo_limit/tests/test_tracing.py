@@ -0,0 +1,205 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import sys
+from unittest import mock
+
+from opentelemetry.sdk import trace as sdk_trace
+from opentelemetry.sdk.trace import export
+from opentelemetry.sdk.trace.export import in_memory_span_exporter
+from opentelemetry import trace
+from oslo_config import cfg
+from oslo_config import fixture as config_fixture
+from oslotest import base
+
+from oslo_limit import exception
+from oslo_limit import fixture
+from oslo_limit import limit
+from oslo_limit import opts
+from oslo_limit import tracing
+
+CONF = cfg.CONF
+
+
+class TestTracing(base.BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_fixture = self.useFixture(config_fixture.Config(CONF))
+        self.config_fixture.config(
+            group='oslo_limit', endpoint_id='ENDPOINT_ID'
+        )
+        opts.register_opts(CONF)
+        self.exporter = in_memory_span_exporter.InMemorySpanExporter()
+        provider = sdk_trace.TracerProvider()
+        provider.add_span_processor(export.SimpleSpanProcessor(self.exporter))
+        tracing.set_tracer(provider.get_tracer('test'))
+        self.addCleanup(tracing.set_tracer, None)
+
+    def _get_spans(self, name):
+        return [
+            span
+            for span in self.exporter.get_finished_spans()
+            if span.name == name
+        ]
+
+    def test_enforce(self):
+        self.useFixture(
+            fixture.LimitFixture({'a': 5, 'b': 7}, {'project1': {'a': 1}})
+        )
+        enforcer = limit.Enforcer(lambda p, r: {'a': 1, 'b': 0})
+        self.exporter.clear()
+
+        self.assertRaises(
+            exception.ProjectOverLimit,
+            enforcer.enforce,
+            'project1',
+            {'b': 1, 'a': 1},
+        )
+
+        (enforce,) = self._get_spans('oslo_limit.enforce')
+        self.assertEqual(
+            {
+                'oslo_limit.project_id': 'project1',
+                'oslo_limit.resources': ('a', 'b'),
+            },
+            dict(enforce.attributes),
+        )
+        self.assertEqual(trace.StatusCode.ERROR, enforce.status.status_code)
+
+        get_limits = self._get_spans('oslo_limit.get_limit')
+        self.assertEqual(
+            [
+                {
+                    'oslo_limit.project_id': 'project1',
+                    'oslo_limit.resource': 'a',
+                    'oslo_limit.limit': 1,
+                    'oslo_limit.cache_hit': False,
+                },
+                {
+                    'oslo_limit.project_id': 'project1',
+                    'oslo_limit.resource': 'b',
+                    'oslo_limit.limit': 7,
+                    'oslo_limit.cache_hit': False,
+                },
+            ],
+            [dict(span.attributes) for span in get_limits],
+        )
+        for span in get_limits:
+            self.assertEqual(enforce.context.span_id, span.parent.span_id)
+
+        # The limits of project1 were looked up for a, and the registered
+        # limits for b
+        (keystone_limits,) = self._get_spans('oslo_limit.keystone.limits')
+        self.assertEqual(
+            get_limits[0].context.span_id, keystone_limits.parent.span_id
+        )
+        (keystone_reglimits,) = self._get_spans(
+            'oslo_limit.keystone.registered_limits'
+        )
+        self.assertEqual(
+            get_limits[1].context.span_id, keystone_reglimits.parent.span_id
+        )
+
+        (usage,) = self._get_spans('oslo_limit.usage')
+        self.assertEqual(
+            {
+                'oslo_limit.project_ids': ('project1',),
+                'oslo_limit.resources': ('a', 'b'),
+            },
+            dict(usage.attributes),
+        )
+
+    def test_enforce_keystone_timeout(self):
+        # Requests to keystone are made in other threads to time out
+        self.config_fixture.config(group='oslo_limit', keystone_timeout=5)
+        self.useFixture(fixture.LimitFixture({'a': 5}, {}))
+        enforcer = limit.Enforcer(lambda p, r: {'a': 0})
+        self.exporter.clear()
+
+        enforcer.enforce('project1', {'a': 1})
+
+        (enforce,) = self._get_spans('oslo_limit.enforce')
+        (get_limit,) = self._get_spans('oslo_limit.get_limit')
+        self.assertEqual(enforce.context.span_id, get_limit.parent.span_id)
+        for name in (
+            'oslo_limit.keystone.limits',
+            'oslo_limit.keystone.registered_limits',
+        ):
+            (keystone,) = self._get_spans(name)
+            self.assertEqual(
+                enforce.context.trace_id, keystone.context.trace_id
+            )
+            self.assertEqual(
+                get_limit.context.span_id, keystone.parent.span_id
+            )
+
+    def test_cache_hit(self):
+        self.useFixture(fixture.LimitFixture({'a': 5}, {}))
+        enforcer = limit.Enforcer(lambda p, r: {'a': 0})
+        enforcer.enforce('project1', {'a': 1})
+        self.exporter.clear()
+
+        enforcer.enforce('project1', {'a': 1})
+
+        (get_limit,) = self._get_spans('oslo_limit.get_limit')
+        self.assertTrue(get_limit.attributes['oslo_limit.cache_hit'])
+        self.assertEqual([], self._get_spans('oslo_limit.keystone.limits'))
+
+    def test_enforce_many(self):
+        self.useFixture(fixture.LimitFixture({'a': 5}, {}))
+        enforcer = limit.Enforcer(lambda p, r: {'a': 0})
+        self.exporter.clear()
+
+        enforcer.enforce_many({'project2': {'a': 1}, None: {'a': 1}})
+
+        (enforce_many,) = self._get_spans('oslo_limit.enforce_many')
+        self.assertEqual(
+            {
+                'oslo_limit.project_ids': ('project2',),
+                'oslo_limit.resources': ('a',),
+            },
+            dict(enforce_many.attributes),
+        )
+        self.assertEqual(2, len(self._get_spans('oslo_limit.usage')))
+
+
+class TestTracer(base.BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(tracing.set_tracer, None)
+
+    def test_default_tracer(self):
+        tracing.set_tracer(None)
+
+        # No spans are created until the service sets a tracer provider
+        self.assertIsInstance(tracing.get_tracer(), tracing.NoopTracer)
+
+        provider = sdk_trace.TracerProvider()
+        with mock.patch.object(
+            trace, 'get_tracer_provider', return_value=provider
+        ):
+            self.assertIsInstance(tracing.get_tracer(), tracing.NoopTracer)
+            with mock.patch.object(tracing, '_no_provider_until', 0.0):
+                tracer = tracing.get_tracer()
+
+        self.assertIsInstance(tracer, sdk_trace.Tracer)
+        self.assertIs(tracer, tracing.get_tracer())
+
+    def test_default_tracer_without_opentelemetry(self):
+        tracing.set_tracer(None)
+
+        with mock.patch.dict(sys.modules, {'opentelemetry': None}):
+            tracer = tracing.get_tracer()
+
+        self.assertIsInstance(tracer, tracing.NoopTracer)
+        with tracer.start_as_current_span('span') as span:
+            span.set_attribute('key', 'value')
@@ -0,0 +1,143 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tracing of enforcers
+
+Enforcers create spans with an OpenTelemetry compatible tracer. It defaults
+to the tracer of the tracer provider of opentelemetry-api once the service
+sets one, and to a tracer which creates no spans until then, or if
+opentelemetry-api is not installed. The attributes of spans are only set when
+they are recorded. The spans are:
+
+``oslo_limit.enforce``, ``oslo_limit.enforce_many``, ``oslo_limit.claim``
+    A check, with the ``oslo_limit.project_id`` and ``oslo_limit.resources``
+    attributes.
+``oslo_limit.get_limit``
+    The lookup of the limit of a resource for a project, with the
+    ``oslo_limit.project_id``, ``oslo_limit.resource``, ``oslo_limit.limit``
+    and ``oslo_limit.cache_hit`` attributes, the latter being False when
+    keystone was queried.
+``oslo_limit.keystone.<request>``
+    A request to keystone, such as ``oslo_limit.keystone.limits``.
+``oslo_limit.usage``
+    A call to the usage callbacks, with the ``oslo_limit.project_ids`` and
+    ``oslo_limit.resources`` attributes.
+"""
+
+import contextlib
+import time
+from typing import Any, Protocol
+
+__all__ = [
+    'NoopTracer',
+    'Span',
+    'Tracer',
+    'get_tracer',
+    'set_tracer',
+]
+
+
+class Span(Protocol):
+    def is_recording(self) -> bool: ...
+
+    def set_attribute(self, key: str, value: Any) -> None: ...
+
+
+class Tracer(Protocol):
+    """The subset of the Tracer API of OpenTelemetry used by enforcers"""
+
+    def start_as_current_span(
+        self, name: str, *, attributes: Any = None
+    ) -> contextlib.AbstractContextManager[Span]: ...
+
+
+class _NoopSpan:
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        pass
+
+    def is_recording(self) -> bool:
+        return False
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class NoopTracer:
+    """A tracer which creates no spans"""
+
+    def start_as_current_span(
+        self, name: str, *, attributes: Any = None
+    ) -> _NoopSpan:
+        return _NOOP_SPAN
+
+
+_NOOP_TRACER = NoopTracer()
+
+# Seconds after which the tracer provider of opentelemetry-api is looked up
+# again while none is set, since looking it up takes longer than a check
+_PROVIDER_CHECK_INTERVAL = 1.0
+
+_TRACER: Tracer | None = None
+# The time until which there is no tracer provider
+_no_provider_until = 0.0
+
+
+def get_tracer() -> Tracer:
+    """Get the tracer of enforcers"""
+    global _TRACER, _no_provider_until
+    if _TRACER is not None:
+        return _TRACER
+
+    now = time.monotonic()
+    if now < _no_provider_until:
+        return _NOOP_TRACER
+
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        _TRACER = _NOOP_TRACER
+        return _TRACER
+
+    provider = trace.get_tracer_provider()
+    if isinstance(
+        provider, (trace.ProxyTracerProvider, trace.NoOpTracerProvider)
+    ):
+        # Spans would not be recorded, so save creating them
+        _no_provider_until = now + _PROVIDER_CHECK_INTERVAL
+        return _NOOP_TRACER
+
+    _TRACER = provider.get_tracer('oslo.limit')
+    return _TRACER
+
+
+def set_tracer(tracer: Tracer | None) -> None:
+    """Set the tracer of enforcers
+
+    :param tracer: a tracer with the start_as_current_span() method of
+                   OpenTelemetry tracers, or None for the default tracer.
+    """
+    global _TRACER, _no_provider_until
+    _TRACER = tracer
+    _no_provider_until = 0.0
+
+
+def _set_attributes(span: Span, **attributes: Any) -> None:
+    """Set the attributes of a span, leaving out those which are None"""
+    for key, value in attributes.items():
+        if value is not None:
+            span.set_attribute(f'oslo_limit.{key}', value)
@@ -0,0 +1,321 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmarks of the enforcement hot path
+
+Checks are made against the fake keystone of oslo_limit.fixture.LimitFixture,
+so the time spent looking up limits which are not cached includes that of
+the fake keystone rather than of network requests. Its limits are plain
+objects rather than SDK resources, which take too long to create to look up
+the limits of a million projects. Each benchmark reports the time of one
+call, the best of several runs.
+
+Run ``python tools/benchmark.py --save baseline.json`` on the base branch,
+then ``python tools/benchmark.py --compare baseline.json`` with the change,
+on the same host, to find regressions. Benchmarks of features missing from
+the base branch, such as Enforcer.warm_cache(), are skipped there.
+
+tools/benchmark-baseline.json was recorded this way before limits were cached
+per project with expiration and looked up through a circuit breaker. Without
+caching, or with a cold cache, every check now does more work around each
+request made to keystone, which the fake keystone answers in microseconds,
+so these benchmarks are reported as regressions against it while the warm
+checks are several times faster.
+"""
+
+import argparse
+from collections.abc import Callable, Collection, Iterator
+import itertools
+import json
+import platform
+import random
+import sys
+import threading
+import time
+import types
+from typing import Any
+
+from oslo_config import cfg
+
+from oslo_limit import fixture
+from oslo_limit import limit
+from oslo_limit import opts
+
+CONF = cfg.CONF
+
+RESOURCES = (1, 10, 100)
+PROJECTS = (1, 1000, 1000000)
+THREADS = (1, 4, 16)
+
+# {name: seconds per call}
+Results = dict[str, float]
+
+
+class _LimitFixture(fixture.LimitFixture):
+    def get_reglimit_objects(
+        self,
+        service_id: str | None = None,
+        region_id: str | None = None,
+        resource_name: str | None = None,
+    ) -> list[Any]:
+        return [
+            types.SimpleNamespace(
+                id=f'registered:{name}',
+                resource_name=name,
+                default_limit=value,
+            )
+            for name, value in self.reglimits.items()
+            if resource_name in (None, name)
+        ]
+
+    def get_projlimit_objects(
+        self,
+        service_id: str | None = None,
+        region_id: str | None = None,
+        resource_name: str | None = None,
+        project_id: str | None = None,
+    ) -> list[Any]:
+        if project_id is None:
+            projlimits = self.projlimits
+        else:
+            projlimits = {project_id: self.projlimits.get(project_id, {})}
+        return [
+            types.SimpleNamespace(
+                id=f'{proj_id}:{name}',
+                project_id=proj_id,
+                resource_name=name,
+                resource_limit=value,
+            )
+            for proj_id, limits in projlimits.items()
+            for name, value in limits.items()
+            if resource_name in (None, name)
+        ]
+
+
+def _usage(
+    project_id: str | None, resources: Collection[str]
+) -> dict[str, int]:
+    return dict.fromkeys(resources, 0)
+
+
+def _resources(count: int) -> list[str]:
+    return [f'resource{i}' for i in range(count)]
+
+
+def _project_ids() -> Iterator[str]:
+    return (f'project{i}' for i in itertools.count())
+
+
+def _measure(
+    func: Callable[[], object], min_time: float, repeat: int = 3
+) -> float:
+    """Get the time of a call of func, the best of repeat runs."""
+    # Find how many calls last at least min_time
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def bench_resources(min_time: float) -> Results:
+    """Checks of deltas of 1 to 100 resources, with and without caching
+
+    Without caching, limits are looked up in keystone for every check. With
+    a cold cache, every check is for a new project whose project limits are
+    looked up, while the registered limits are cached.
+    """
+    results = {}
+    for count in RESOURCES:
+        resources = _resources(count)
+        deltas = dict.fromkeys(resources, 1)
+        with _LimitFixture(dict.fromkeys(resources, 10), {}):
+            enforcer = limit.Enforcer(_usage, cache=False)
+            results[f'enforce.nocache.resources={count}'] = _measure(
+                lambda: enforcer.enforce('project', deltas), min_time
+            )
+
+            enforcer = limit.Enforcer(_usage)
+            project_ids = _project_ids()
+            enforcer.enforce(next(project_ids), deltas)
+            results[f'enforce.cold.resources={count}'] = _measure(
+                lambda: enforcer.enforce(next(project_ids), deltas), min_time
+            )
+
+            enforcer.enforce('project', deltas)
+            results[f'enforce.warm.resources={count}'] = _measure(
+                lambda: enforcer.enforce('project', deltas), min_time
+            )
+
+            results[f'calculate_usage.warm.resources={count}'] = _measure(
+                lambda: enforcer.calculate_usage('project', resources),
+                min_time,
+            )
+    return results
+
+
+def bench_projects(min_time: float, max_projects: int) -> Results:
+    """Checks of random projects out of 1 to 1M with cached project limits
+
+    The limits of all projects are loaded with Enforcer.warm_cache().
+    """
+    results = {}
+    deltas = {'resource0': 1}
+    for count in PROJECTS:
+        if count > max_projects:
+            continue
+
+        projlimits = {f'project{i}': {'resource0': 10} for i in range(count)}
+        with _LimitFixture({'resource0': 10}, projlimits):
+            enforcer = limit.Enforcer(_usage)
+            if not hasattr(enforcer, 'warm_cache'):
+                continue
+            enforcer.warm_cache()
+
+            rand = random.Random(count)  # noqa: S311
+            project_ids = itertools.cycle(
+                [f'project{rand.randrange(count)}' for _ in range(10000)]
+            )
+            results[f'enforce.warm.projects={count}'] = _measure(
+                lambda: enforcer.enforce(next(project_ids), deltas), min_time
+            )
+    return results
+
+
+def bench_threads(min_time: float) -> Results:
+    """Checks made at once by 1 to 16 threads sharing a warm cache
+
+    This is the time of all the checks divided by their number, so it
+    goes up with threads when they contend for the locks of the caches.
+    """
+    results = {}
+    deltas = {'resource0': 1, 'resource1': 1}
+    project_ids = [f'project{i}' for i in range(100)]
+    with _LimitFixture({'resource0': 10, 'resource1': 10}, {}):
+        enforcer = limit.Enforcer(_usage)
+        for project_id in project_ids:
+            enforcer.enforce(project_id, deltas)
+
+        def check(count: int) -> None:
+            for i in range(count):
+                enforcer.enforce(project_ids[i % 100], deltas)
+
+        for count in THREADS:
+            per_thread = 1000 // count
+
+            def run() -> None:
+                threads = [
+                    threading.Thread(target=check, args=(per_thread,))
+                    for _ in range(count)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            elapsed = _measure(run, min_time)
+            results[f'enforce.warm.threads={count}'] = elapsed / (
+                per_thread * count
+            )
+    return results
+
+
+def _compare(results: Results, baseline: Results, tolerance: float) -> bool:
+    """Print the results next to the baseline, and whether they regressed."""
+    regressed = False
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f'{name:45} {seconds * 1e6:12.2f} us')
+            continue
+
+        ratio = seconds / base
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = ' REGRESSION'
+            regressed = True
+        print(
+            f'{name:45} {seconds * 1e6:12.2f} us '
+            f'{base * 1e6:12.2f} us {ratio:6.2f}x{flag}'
+        )
+    return regressed
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--min-time',
+        type=float,
+        default=0.2,
+        help='Minimum time in seconds of each run of a benchmark.',
+    )
+    parser.add_argument(
+        '--max-projects',
+        type=int,
+        default=max(PROJECTS),
+        help='Skip the benchmarks with more projects than this.',
+    )
+    parser.add_argument(
+        '--save', metavar='FILE', help='Save the results as a baseline.'
+    )
+    parser.add_argument(
+        '--compare', metavar='FILE', help='Compare the results to a baseline.'
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.25,
+        help='Slowdown relative to the baseline reported as a regression.',
+    )
+    args = parser.parse_args(argv)
+
+    opts.register_opts(CONF)
+    CONF.set_override('endpoint_id', 'ENDPOINT_ID', group='oslo_limit')
+
+    results: Results = {}
+    results.update(bench_resources(args.min_time))
+    results.update(bench_projects(args.min_time, args.max_projects))
+    results.update(bench_threads(args.min_time))
+
+    baseline: Results = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    regressed = _compare(results, baseline, args.tolerance)
+
+    if args.save:
+        data: dict[str, Any] = {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': results,
+        }
+        with open(args.save, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())